@@ -2,13 +2,72 @@
 import os
 import aws_cdk as cdk
 from aws_cdk import (
-    App, Stack, Duration, RemovalPolicy, CfnOutput,
+    App, Stack, Duration, RemovalPolicy, CfnOutput, BundlingOptions,
     aws_ec2 as ec2, aws_rds as rds, aws_secretsmanager as secretsmanager,
     aws_lambda as _lambda, aws_iam as iam, aws_events as events,
     aws_events_targets as targets, aws_logs as logs,
+    aws_stepfunctions as sfn, aws_stepfunctions_tasks as tasks,
+    aws_sqs as sqs, aws_lambda_event_sources as lambda_event_sources,
     Environment, SecretValue
 )
 
+# Per-function settings for the ingestion Lambdas built in ArubaCentralIngestionStack.
+# Construct ids are kept stable so existing deployments update in place.
+# late_env names values only known inside the stack (e.g. queue URLs).
+LAMBDA_CONFIGS = [
+    {
+        # Clients + legacy devices mixed
+        "id": "clientsFn",
+        "handler": "ingestion_handler.lambda_handler",
+        "log_group_id": "IngestionLogGroup",
+        "alias_id": "clientsFnLive",
+        "env": {
+            "PAGE_LIMIT": "100",
+            "SITE_PAGE_DELAY_MS": "400",
+            "CLIENT_PAGE_DELAY_MS": "250",
+            "DEVICE_PAGE_DELAY_MS": "250",
+            "ARUBA_CLIENTS_EXCLUDE_STATUS": "disconnected",
+            "COLLECT_CLIENTS": "true",
+            "COLLECT_DEVICES": "true",
+        },
+    },
+    {
+        "id": "switch-interfacesFn",
+        "handler": "switch_interfaces_ingestion_handler.lambda_handler",
+        "log_group_id": "SwitchInterfacesLogGroup",
+        "alias_id": "switchInterfacesFnLive",
+        "env": {"COLLECT_SWITCH_INTERFACEDETAILS": "true"},
+    },
+    {
+        # Device status (v2), decoupled from clients
+        "id": "devicestatusFn",
+        "handler": "device_status_v2_ingestion_handler.lambda_handler",
+        "log_group_id": "DeviceStatusV2LogGroup",
+        "alias_id": "deviceStatusFnLive",
+        "env": {"ARUBA_DEVICE_STATUS_ENDPOINT": "/network-monitoring/v2/devices/status"},
+    },
+    {
+        # Scheduled: lists APs and enqueues them for apIngestionFn
+        "id": "apListerFn",
+        "handler": "ap_ingestion_lambda_handler.list_aps_handler",
+        "log_group_id": "ApListerLogGroup",
+        "alias_id": "apListerFnLive",
+        "env": {"ARUBA_APS_ENDPOINT": "/monitoring/v2/aps"},
+        "late_env": ["AP_QUEUE_URL"],
+    },
+    {
+        # SQS consumer for the AP queue
+        "id": "apIngestionFn",
+        "handler": "ap_ingestion_lambda_handler.lambda_handler",
+        "log_group_id": "ApIngestionLogGroup",
+        "alias_id": "apIngestionFnLive",
+        "env": {
+            "ARUBA_APS_ENDPOINT": "/monitoring/v2/aps",
+            "ARUBA_AP_DETAIL_ENDPOINT": "/monitoring/v2/aps/{serial}",
+        },
+    },
+]
+
 def _require_context(app: App, key: str, description: str) -> str:
     val = app.node.try_get_context(key)
     if not val:
@@ -57,7 +116,9 @@ class ArubaCentralIngestionStack(Stack):
             raise ValueError("mysqlVersion must start with a digit (e.g. 8.0.34).")
 
         # Existing VPC + subnets
-        vpc = ec2.Vpc.from_lookup(self, "ExistingVpc", vpc_id=vpc_id)
+        # Lookup results are cached in cdk.context.json, keyed by account/region/vpc-id;
+        # once that file is committed (see README), synth does not call EC2.
+        vpc = ec2.Vpc.from_lookup(self, "ExistingVpc", vpc_id=vpc_id, return_vpn_gateways=False)
         lambda_subnets = [ec2.Subnet.from_subnet_id(self, f"LambdaSubnet{i}", sid) for i, sid in enumerate(lambda_subnet_ids)]
         db_subnets = [ec2.Subnet.from_subnet_id(self, f"DbSubnet{i}", sid) for i, sid in enumerate(db_subnet_ids)]
         lambda_subnet_selection = ec2.SubnetSelection(subnets=lambda_subnets)
@@ -91,7 +152,10 @@ class ArubaCentralIngestionStack(Stack):
         # Security Groups
         db_sg = ec2.SecurityGroup(self, "DbSg", vpc=vpc, description="MySQL RDS security group", allow_all_outbound=False)
         lambda_sg = ec2.SecurityGroup(self, "LambdaSg", vpc=vpc, description="Lambda SG", allow_all_outbound=True)
+        proxy_sg = ec2.SecurityGroup(self, "DbProxySg", vpc=vpc, description="RDS Proxy security group", allow_all_outbound=True)
         db_sg.add_ingress_rule(lambda_sg, ec2.Port.tcp(3306), "Lambda access to MySQL")
+        proxy_sg.add_ingress_rule(lambda_sg, ec2.Port.tcp(3306), "Lambda access to RDS Proxy")
+        db_sg.add_ingress_rule(proxy_sg, ec2.Port.tcp(3306), "RDS Proxy access to MySQL")
 
         # RDS (use generic version constructor to avoid missing constant issues)
         selected_mysql_version = rds.MysqlEngineVersion.of(mysql_version_str, "8.0")
@@ -115,6 +179,19 @@ class ArubaCentralIngestionStack(Stack):
             publicly_accessible=False,
         )
 
+        # RDS Proxy pools server-side connections so the four Lambdas (and their
+        # concurrent sandboxes) share a bounded set of MySQL connections
+        db_proxy = rds.DatabaseProxy(
+            self,
+            "DbProxy",
+            proxy_target=rds.ProxyTarget.from_instance(db_instance),
+            secrets=[db_secret],
+            vpc=vpc,
+            vpc_subnets=db_subnet_selection,
+            security_groups=[proxy_sg],
+            require_tls=True,
+        )
+
         # IAM Role
         ingestion_role = iam.Role(
             self,
@@ -127,190 +204,203 @@ class ArubaCentralIngestionStack(Stack):
         )
         db_secret.grant_read(ingestion_role)
         aruba_api_secret.grant_read(ingestion_role)
+        # BatchGetSecretValue is authorized account-wide; per-secret GetSecretValue grants above still apply
+        ingestion_role.add_to_policy(iam.PolicyStatement(
+            actions=["secretsmanager:BatchGetSecretValue"],
+            resources=["*"],
+        ))
 
-        # Lambda (clients + legacy devices mixed)
-        ingestion_fn = _lambda.Function(
-            self,
-            "clientsFn",
-            runtime=_lambda.Runtime.PYTHON_3_11,
-            handler="ingestion_handler.lambda_handler",
-            code=_lambda.Code.from_asset("lambda_py"),
-            role=ingestion_role,
-            memory_size=512,
-            timeout=Duration.minutes(15),
-            vpc=vpc,
-            security_groups=[lambda_sg],
-            vpc_subnets=lambda_subnet_selection,
-            environment={
-                "ENVIRONMENT": environment_name,
-                "LOG_LEVEL": "INFO" if is_prod else "DEBUG",
-                "DB_SECRET_ARN": db_secret.secret_arn,
-                "ARUBA_API_SECRET_ARN": aruba_api_secret.secret_arn,
-                "DB_HOST": db_instance.instance_endpoint.hostname,
-                "DB_PORT": str(db_instance.instance_endpoint.port),
-                "PAGE_LIMIT": "100",
-                "SITE_PAGE_DELAY_MS": "400",
-                "CLIENT_PAGE_DELAY_MS": "250",
-                "DEVICE_PAGE_DELAY_MS": "250",
-                "ARUBA_CLIENTS_EXCLUDE_STATUS": "disconnected",
-                "ARUBA_PAGE_SIZE": "100",
-                "ARUBA_PAGE_DELAY_SECONDS": "2.0",
-                "COLLECT_CLIENTS": "true",
-                "COLLECT_DEVICES": "true",
-            },
-        )
-
-        logs.LogGroup(
-            self,
-            "IngestionLogGroup",
-            log_group_name=f"/aws/lambda/{ingestion_fn.function_name}",
-            retention=logs.RetentionDays.TWO_WEEKS,
-            removal_policy=RemovalPolicy.DESTROY,
+        # Warm sandboxes: the schedules invoke a published "live" alias that keeps
+        # provisioned concurrency, so module-scope init (secrets, boto3 clients, DB
+        # connection) is already done when EventBridge fires. Default 1 in prod, 0 elsewhere.
+        provisioned_concurrency = int(
+            app_node.node.try_get_context("provisionedConcurrency") or (1 if is_prod else 0)
         )
 
-        # Removed 4hr EventBridge rule (IngestionSchedule)
+        def _live_alias(fn: _lambda.Function, alias_id: str) -> _lambda.Alias:
+            return _lambda.Alias(
+                self,
+                alias_id,
+                alias_name="live",
+                version=fn.current_version,
+                provisioned_concurrent_executions=provisioned_concurrency or None,
+            )
 
-        events.Rule(
-            self, "ArubaIngestionEvery15Min",
-            schedule=events.Schedule.rate(Duration.minutes(30)),
-            targets=[targets.LambdaFunction(ingestion_fn)]
+        # Shared Lambda asset: dependencies installed as wheels, sources byte-compiled
+        # (.pyc only) and metadata/caches stripped so cold starts load fewer code chunks
+        lambda_code = _lambda.Code.from_asset(
+            "lambda_py",
+            exclude=["__pycache__", "*.pyc"],
+            bundling=BundlingOptions(
+                image=_lambda.Runtime.PYTHON_3_11.bundling_image,
+                command=[
+                    "bash", "-c",
+                    "pip install -r requirements.txt -t /asset-output --only-binary=:all: --no-compile"
+                    " && cp -r . /asset-output"
+                    " && rm -rf /asset-output/*.dist-info /asset-output/tests"
+                    " && python -m compileall -q -b /asset-output"
+                    " && find /asset-output -name '__pycache__' -prune -exec rm -rf {} +"
+                    " && find /asset-output -name '*.py' -delete",
+                ],
+            ),
         )
 
-        # Dedicated Switch Interfaces Ingestion Lambda
-        switch_interfacedetails_fn = _lambda.Function(
+        # Shared layer (/opt/python): boto3 Session, Secrets Manager cache and
+        # third-party wheels common to every function. Layer content is cached
+        # independently of each function's code, keeping the function assets small.
+        shared_layer = _lambda.LayerVersion(
             self,
-            "switch-interfacesFn",
-            runtime=_lambda.Runtime.PYTHON_3_11,
-            handler="switch_interfaces_ingestion_handler.lambda_handler",
-            code=_lambda.Code.from_asset("lambda_py"),
-            role=ingestion_role,
-            memory_size=512,
-            timeout=Duration.minutes(15),
-            vpc=vpc,
-            security_groups=[lambda_sg],
-            vpc_subnets=lambda_subnet_selection,
-            environment={
-                "ENVIRONMENT": environment_name,
-                "LOG_LEVEL": "INFO" if is_prod else "DEBUG",
-                "DB_SECRET_ARN": db_secret.secret_arn,
-                "ARUBA_API_SECRET_ARN": aruba_api_secret.secret_arn,
-                "DB_HOST": db_instance.instance_endpoint.hostname,
-                "DB_PORT": str(db_instance.instance_endpoint.port),
-                "ARUBA_PAGE_SIZE": "100",
-                "ARUBA_PAGE_DELAY_SECONDS": "2.0",
-                "COLLECT_SWITCH_INTERFACEDETAILS": "true",
-            },
+            "SharedCoreLayer",
+            code=_lambda.Code.from_asset(
+                "lambda_layer",
+                exclude=["__pycache__", "*.pyc"],
+                bundling=BundlingOptions(
+                    image=_lambda.Runtime.PYTHON_3_11.bundling_image,
+                    command=[
+                        "bash", "-c",
+                        "pip install -r requirements.txt -t /asset-output/python --only-binary=:all: --no-compile"
+                        " && cp -r python /asset-output"
+                        " && rm -rf /asset-output/python/*.dist-info"
+                        " && python -m compileall -q -b /asset-output/python"
+                        " && find /asset-output -name '__pycache__' -prune -exec rm -rf {} +"
+                        " && find /asset-output -name '*.py' -delete",
+                    ],
+                ),
+            ),
+            compatible_runtimes=[_lambda.Runtime.PYTHON_3_11],
+            description="Shared AWS clients, secret cache and dependencies for Aruba ingestion Lambdas",
         )
 
-        logs.LogGroup(
+        # AP work queue: the lister enqueues one message per AP and the AP
+        # ingestion Lambda consumes it in batches. Visibility timeout is 6x the
+        # consumer's 15 minute timeout (the AWS guidance for Lambda event
+        # sources), so a batch still being retried or throttled is not
+        # redelivered to another consumer. Failed items reappear after it; the
+        # lister re-enqueues unwatermarked APs every 30 minutes in any case.
+        # 3 receives x 90 minutes stays inside the 6 hour retention.
+        ap_dlq = sqs.Queue(
             self,
-            "SwitchInterfacesLogGroup",
-            log_group_name=f"/aws/lambda/{switch_interfacedetails_fn.function_name}",
-            retention=logs.RetentionDays.TWO_WEEKS,
-            removal_policy=RemovalPolicy.DESTROY,
+            "ApSerialsDlq",
+            retention_period=Duration.days(14),
         )
-
-        events.Rule(
+        ap_queue = sqs.Queue(
             self,
-            "SwitchInterfacesEvery15Min",
-            schedule=events.Schedule.rate(Duration.minutes(30)),
-            description="Periodic Aruba Central switch interfaces ingestion",
-            targets=[targets.LambdaFunction(switch_interfacedetails_fn)],
+            "ApSerialsQueue",
+            visibility_timeout=Duration.minutes(90),
+            retention_period=Duration.hours(6),
+            dead_letter_queue=sqs.DeadLetterQueue(max_receive_count=3, queue=ap_dlq),
         )
+        ap_queue.grant_send_messages(ingestion_role)
 
-        # Dedicated Device Status (v2) Lambda (decoupled from clients)
-        device_status_v2_fn = _lambda.Function(
-            self,
-            "devicestatusFn",
-            runtime=_lambda.Runtime.PYTHON_3_11,
-            handler="device_status_v2_ingestion_handler.lambda_handler",
-            code=_lambda.Code.from_asset("lambda_py"),
-            role=ingestion_role,
-            memory_size=512,
-            timeout=Duration.minutes(15),
-            vpc=vpc,
-            security_groups=[lambda_sg],
-            vpc_subnets=lambda_subnet_selection,
-            environment={
-                "ENVIRONMENT": environment_name,
-                "LOG_LEVEL": "INFO" if is_prod else "DEBUG",
-                "DB_SECRET_ARN": db_secret.secret_arn,
-                "ARUBA_API_SECRET_ARN": aruba_api_secret.secret_arn,
-                "DB_HOST": db_instance.instance_endpoint.hostname,
-                "DB_PORT": str(db_instance.instance_endpoint.port),
-                "ARUBA_PAGE_SIZE": "100",
-                "ARUBA_PAGE_DELAY_SECONDS": "2.0",
-                "ARUBA_DEVICE_STATUS_ENDPOINT": "/network-monitoring/v2/devices/status",
-            },
-        )
+        # Every ingestion Lambda shares the asset, layer, role, network placement
+        # and the environment below; LAMBDA_CONFIGS supplies the differences.
+        common_env = {
+            "ENVIRONMENT": environment_name,
+            "LOG_LEVEL": "INFO" if is_prod else "DEBUG",
+            "DB_SECRET_ARN": db_secret.secret_arn,
+            "ARUBA_API_SECRET_ARN": aruba_api_secret.secret_arn,
+            "DB_HOST": db_proxy.endpoint,
+            "DB_PORT": str(db_instance.instance_endpoint.port),
+            "DB_SSL": "true",
+            "ARUBA_PAGE_SIZE": "100",
+            "ARUBA_PAGE_DELAY_SECONDS": "0.25",
+        }
+        late_env = {"AP_QUEUE_URL": ap_queue.queue_url}
+        fns: dict[str, _lambda.Function] = {}
+        live: dict[str, _lambda.Alias] = {}
+        for cfg in LAMBDA_CONFIGS:
+            env = {**common_env, **cfg["env"]}
+            env.update({k: late_env[k] for k in cfg.get("late_env", ())})
+            fn = _lambda.Function(
+                self,
+                cfg["id"],
+                runtime=_lambda.Runtime.PYTHON_3_11,
+                handler=cfg["handler"],
+                code=lambda_code,
+                layers=[shared_layer],
+                role=ingestion_role,
+                memory_size=512,
+                timeout=Duration.minutes(15),
+                vpc=vpc,
+                security_groups=[lambda_sg],
+                vpc_subnets=lambda_subnet_selection,
+                environment=env,
+            )
+            logs.LogGroup(
+                self,
+                cfg["log_group_id"],
+                log_group_name=f"/aws/lambda/{fn.function_name}",
+                retention=logs.RetentionDays.TWO_WEEKS,
+                removal_policy=RemovalPolicy.DESTROY,
+            )
+            fns[cfg["id"]] = fn
+            live[cfg["id"]] = _live_alias(fn, cfg["alias_id"])
 
-        logs.LogGroup(
-            self,
-            "DeviceStatusV2LogGroup",
-            log_group_name=f"/aws/lambda/{device_status_v2_fn.function_name}",
-            retention=logs.RetentionDays.TWO_WEEKS,
-            removal_policy=RemovalPolicy.DESTROY,
-        )
+        ingestion_fn = fns["clientsFn"]
+        switch_interfacedetails_fn = fns["switch-interfacesFn"]
+        device_status_v2_fn = fns["devicestatusFn"]
+        ingestion_fn_live = live["clientsFn"]
+        switch_interfacedetails_fn_live = live["switch-interfacesFn"]
+        device_status_v2_fn_live = live["devicestatusFn"]
+        ap_lister_fn_live = live["apListerFn"]
+        ap_ingestion_fn_live = live["apIngestionFn"]
 
-        events.Rule(
-            self,
-            "DeviceStatusV2Every15Min",
-            schedule=events.Schedule.rate(Duration.minutes(30)),
-            description="Periodic Aruba Central device status v2 ingestion",
-            targets=[targets.LambdaFunction(device_status_v2_fn)],
+        # Batches of 10 APs; max_concurrency caps parallel consumers so detail
+        # calls stay inside the Aruba Central API rate limit.
+        ap_ingestion_fn_live.add_event_source(
+            lambda_event_sources.SqsEventSource(
+                ap_queue,
+                batch_size=10,
+                max_batching_window=Duration.seconds(5),
+                max_concurrency=int(app_node.node.try_get_context("apQueueConsumers") or 4),
+                report_batch_item_failures=True,
+            )
         )
 
-        # Dedicated AP Ingestion Lambda
-        ap_ingestion_fn = _lambda.Function(
-            self,
-            "apIngestionFn",
-            runtime=_lambda.Runtime.PYTHON_3_11,
-            handler="ap_ingestion_lambda_handler.lambda_handler",
-            code=_lambda.Code.from_asset("lambda_py"),
-            role=ingestion_role,
-            memory_size=512,
-            timeout=Duration.minutes(15),
-            vpc=vpc,
-            security_groups=[lambda_sg],
-            vpc_subnets=lambda_subnet_selection,
-            environment={
-                "ENVIRONMENT": environment_name,
-                "LOG_LEVEL": "INFO" if is_prod else "DEBUG",
-                "DB_SECRET_ARN": db_secret.secret_arn,
-                "ARUBA_API_SECRET_ARN": aruba_api_secret.secret_arn,
-                "DB_HOST": db_instance.instance_endpoint.hostname,
-                "DB_PORT": str(db_instance.instance_endpoint.port),
-                "ARUBA_PAGE_SIZE": "100",
-                "ARUBA_PAGE_DELAY_SECONDS": "2.0",
-                "ARUBA_APS_ENDPOINT": "/monitoring/v2/aps",
-                "ARUBA_AP_DETAIL_ENDPOINT": "/monitoring/v2/aps/{serial}",
-            },
-        )
+        # Single schedule fanning out to all four Lambdas via a Step Functions
+        # Parallel state. Each branch catches its own failure so one failed
+        # ingestion does not cancel the others.
+        def _invoke_branch(name: str, fn: _lambda.IFunction) -> sfn.IChainable:
+            return tasks.LambdaInvoke(
+                self,
+                f"Invoke{name}",
+                lambda_function=fn,
+                retry_on_service_exceptions=True,
+                result_path=sfn.JsonPath.DISCARD,
+            ).add_catch(sfn.Pass(self, f"{name}Failed"), result_path="$.error")
+
+        ingestion_fan_out = sfn.Parallel(self, "IngestAll")
+        ingestion_fan_out.branch(_invoke_branch("Clients", ingestion_fn_live))
+        ingestion_fan_out.branch(_invoke_branch("SwitchInterfaces", switch_interfacedetails_fn_live))
+        ingestion_fan_out.branch(_invoke_branch("DeviceStatusV2", device_status_v2_fn_live))
+        ingestion_fan_out.branch(_invoke_branch("ApLister", ap_lister_fn_live))
 
-        logs.LogGroup(
+        ingestion_state_machine = sfn.StateMachine(
             self,
-            "ApIngestionLogGroup",
-            log_group_name=f"/aws/lambda/{ap_ingestion_fn.function_name}",
-            retention=logs.RetentionDays.TWO_WEEKS,
-            removal_policy=RemovalPolicy.DESTROY,
+            "IngestionStateMachine",
+            definition_body=sfn.DefinitionBody.from_chainable(ingestion_fan_out),
+            timeout=Duration.minutes(30),
         )
 
         events.Rule(
             self,
-            "ApIngestionEvery15Min",
+            "IngestionEvery30Min",
             schedule=events.Schedule.rate(Duration.minutes(30)),
-            description="Periodic Aruba Central AP ingestion",
-            targets=[targets.LambdaFunction(ap_ingestion_fn)],
+            description="Periodic Aruba Central ingestion (clients, switch interfaces, device status, APs)",
+            targets=[targets.SfnStateMachine(ingestion_state_machine)],
         )
 
         # Outputs
         CfnOutput(self, "RdsEndpoint", value=db_instance.instance_endpoint.hostname)
+        CfnOutput(self, "RdsProxyEndpoint", value=db_proxy.endpoint)
         CfnOutput(self, "LambdaName", value=ingestion_fn.function_name)
         try:
             CfnOutput(self, "DeviceStatusV2LambdaName", value=device_status_v2_fn.function_name)
         except Exception:
             pass
         CfnOutput(self, "SwitchInterfaceDetailsLambdaName", value=switch_interfacedetails_fn.function_name)
+        CfnOutput(self, "ApQueueUrl", value=ap_queue.queue_url)
+        CfnOutput(self, "IngestionStateMachineArn", value=ingestion_state_machine.state_machine_arn)
         CfnOutput(self, "ArubaApiSecretArn", value=aruba_api_secret.secret_arn)
         CfnOutput(self, "DbSecretArn", value=db_secret.secret_arn)
         CfnOutput(self, "LambdaRuntime", value=ingestion_fn.runtime.to_string())
@@ -0,0 +1 @@
+"""Code shared by the ingestion Lambdas, shipped as the SharedCoreLayer (/opt/python)."""
@@ -0,0 +1,86 @@
+"""AWS clients and the Secrets Manager cache shared by all ingestion Lambdas.
+
+Clients are created once per sandbox at import (Lambda init) from a single
+boto3 Session, so warm invocations reuse them and their connection pools.
+"""
+import base64, json, logging, os, time
+from typing import Any, Dict, Iterable, Tuple
+
+try:
+    import boto3  # type: ignore
+except ImportError:
+    boto3 = None  # type: ignore
+try:
+    import orjson as _j  # type: ignore
+except ImportError:
+    _j = json  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+SESSION = boto3.session.Session() if boto3 is not None else None
+SM = SESSION.client("secretsmanager") if SESSION is not None else None
+
+_clients: Dict[str, Any] = {"secretsmanager": SM}
+# Parsed secrets keyed by ARN/name -> (value, monotonic expiry).  The layer is
+# imported once per sandbox, so every handler in the process shares this.
+# SECRET_CACHE_TTL_SECONDS > 0 re-reads a secret after that long so rotated
+# credentials are picked up; the default 0 keeps it for the sandbox lifetime.
+_SECRET_TTL = float(os.getenv("SECRET_CACHE_TTL_SECONDS", "0"))
+_cached_secrets: Dict[str, Tuple[Dict[str, Any], float]] = {}
+
+
+def client(service: str):
+    """Return the shared boto3 client for `service`, creating it on first use."""
+    if SESSION is None:
+        raise RuntimeError("boto3 is required in the Lambda runtime but is not installed locally")
+    c = _clients.get(service)
+    if c is None:
+        c = _clients[service] = SESSION.client(service)
+    return c
+
+
+def parse_secret(resp: Dict[str, Any]) -> Dict[str, Any]:
+    if "SecretString" in resp:
+        return _j.loads(resp["SecretString"])
+    return _j.loads(base64.b64decode(resp["SecretBinary"]))
+
+
+def _cache_secret(key: str, value: Dict[str, Any]):
+    _cached_secrets[key] = (value, time.monotonic() + _SECRET_TTL if _SECRET_TTL > 0 else float("inf"))
+
+
+def _cached(key: str):
+    hit = _cached_secrets.get(key)
+    if hit is not None and time.monotonic() < hit[1]:
+        return hit[0]
+    return None
+
+
+def get_secret(arn: str) -> Dict[str, Any]:
+    js = _cached(arn)
+    if js is not None:
+        return js
+    if SM is None:
+        raise RuntimeError("boto3 is required in the Lambda runtime but is not installed locally")
+    js = parse_secret(SM.get_secret_value(SecretId=arn))
+    _cache_secret(arn, js)
+    return js
+
+
+def prefetch_secrets(arns: Iterable[str]):
+    """Warm the secret cache with a single BatchGetSecretValue round-trip.
+
+    Best effort: anything not returned here is fetched by get_secret.
+    """
+    missing = [a for a in arns if _cached(a) is None]
+    if not missing or SM is None:
+        return
+    try:
+        resp = SM.batch_get_secret_value(SecretIdList=missing)
+    except Exception as e:
+        logger.warning(f"[init] batch_get_secret_value failed, falling back to per-secret fetch: {e}")
+        return
+    for sv in resp.get("SecretValues", []):
+        for key in (sv.get("ARN"), sv.get("Name")):
+            if key in missing:
+                _cache_secret(key, parse_secret(sv))
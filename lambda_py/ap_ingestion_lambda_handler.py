@@ -1,204 +1,348 @@
 """Lambda handler to ingest Aruba AP and embedded array data into MySQL.
 
-- Discovers all APs via Aruba Central API (paginated)
-- Fetches details for each AP (radios, wlans, ports, modems, ...)
-- Appends all data to normalized SQL tables (ap, ap_radio, ap_wlan, ap_port, ap_modem)
+- list_aps_handler (scheduled) discovers all APs via Aruba Central API (paginated)
+  and enqueues one SQS message per AP
+- lambda_handler consumes SQS batches of APs (or the whole fleet when invoked directly)
+- Fetches details for each AP (radios, wlans, ports, modems, ...), sending the
+  stored ETag / Last-Modified so unchanged APs (304) skip all DB writes
+- Upserts all data into normalized SQL tables (ap, ap_radio, ap_wlan, ap_port, ap_modem)
 - Handles secrets via AWS Secrets Manager
 - Robust to API/DB errors, logs summary
 
 Environment Variables (subset):
     DB_SECRET_ARN, ARUBA_API_SECRET_ARN  Secrets Manager ARNs
     ARUBA_PAGE_SIZE (default 100)
-    ARUBA_PAGE_DELAY_SECONDS (default 2.0)
+    ARUBA_PAGE_DELAY_SECONDS (default 0.25)
     ARUBA_APS_ENDPOINT (optional override, default /monitoring/v2/aps)
     ARUBA_AP_DETAIL_ENDPOINT (optional override, default /monitoring/v2/aps/{serial})
-    DB_CLOSE_EACH_INVOCATION (default true)
+    AP_DETAIL_CONCURRENCY (default 12) worker threads issuing AP detail requests
+    AP_QUEUE_URL  SQS queue list_aps_handler feeds (lister only)
+    AP_SKIP_UNCHANGED (default true) lister skips APs whose list timestamp is not newer than the stored watermark
+    LOG_LEVEL (default INFO) set by the CDK stack (DEBUG outside prod)
+    DB_CLOSE_EACH_INVOCATION (default false) release the MySQL connection to db's connection cache after each run
 """
-import os, json, time, logging, base64
-from typing import Any, Dict, List
+import os, sys, json, time, logging
+from datetime import datetime, timezone
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import orjson as _j  # type: ignore
+except ImportError:
+    _j = json  # type: ignore
+
+from db import AP_COLUMNS
+from shared import clients
+from bootstrap import get_api, get_db
 
 logger = logging.getLogger()
-logger.setLevel(logging.DEBUG)
+logger.setLevel(os.getenv("LOG_LEVEL", "INFO"))
+
+# fromisoformat accepts a trailing 'Z' from 3.11 (the Lambda runtime); older interpreters need +00:00
+_FROMISO_ACCEPTS_Z = sys.version_info >= (3, 11)
+
+# Built during Lambda init from the shared layer's boto3 Session
+_SQS_CLIENT = clients.client("sqs") if clients.SESSION is not None else None
 
 _api = None
 _db = None
-_cached_secrets: Dict[str, Dict[str, Any]] = {}
-
-def _get_secret_cached(arn: str) -> Dict[str, Any]:
-    if arn in _cached_secrets:
-        return _cached_secrets[arn]
-    try:
-        import boto3  # type: ignore
-    except ImportError:
-        boto3 = None  # type: ignore
-    if boto3 is None:  # type: ignore
-        raise RuntimeError("boto3 is required in the Lambda runtime but is not installed locally")
-    sm = boto3.client("secretsmanager")
-    resp = sm.get_secret_value(SecretId=arn)
-    if "SecretString" in resp:
-        js = json.loads(resp["SecretString"])
-    else:
-        js = json.loads(base64.b64decode(resp["SecretBinary"]).decode())
-    _cached_secrets[arn] = js
-    return js
+# serial -> (ETag, Last-Modified) of the last stored AP details; survives warm starts
+# and is reloaded from the ap table after a cold start
+_ap_validators: Dict[str, Tuple[Optional[str], Optional[str]]] = {}
+_ap_validators_loaded = False
 
 def _init():
     global _api, _db
-    required = ["DB_SECRET_ARN", "ARUBA_API_SECRET_ARN"]
-    missing = [k for k in required if not os.getenv(k)]
-    if missing:
-        raise RuntimeError(f"Missing env vars {missing}")
-    if _db is None:
-        db_secret = _get_secret_cached(os.environ["DB_SECRET_ARN"])
-        from db import MySqlRepository
-        for key in ("host", "username", "password"):
-            if key not in db_secret:
-                raise RuntimeError(f"DB secret missing '{key}'")
-        _db = MySqlRepository(
-            host=db_secret["host"],
-            port=int(db_secret.get("port", 3306)),
-            user=db_secret["username"],
-            password=db_secret["password"],
-            database=db_secret.get("dbname", "aruba_central"),
-        )
-        _db.connect()
-        _db.ensure_schema()
-        logger.info("[init] DB ready (ap_ingestion)")
-    if _api is None:
-        api_secret = _get_secret_cached(os.environ["ARUBA_API_SECRET_ARN"])
-        for key in ("baseUrl", "clientSecret"):
-            if key not in api_secret:
-                raise RuntimeError(f"API secret missing '{key}'")
-        from api_client import ArubaApiClient
-        _api = ArubaApiClient(
-            client_id=api_secret.get("clientId"),
-            client_secret=api_secret["clientSecret"],
-            customer_id=api_secret.get("customerId"),
-            base_url=api_secret["baseUrl"],
-            oauth_token_url=api_secret.get("oauthTokenUrl"),
-            page_limit=int(os.getenv("ARUBA_PAGE_SIZE", "100")),
-            page_delay_seconds=float(os.getenv("ARUBA_PAGE_DELAY_SECONDS", "2.0"))
-        )
-        logger.info("[init] API client ready (ap_ingestion)")
+    _db, _api = get_db(), get_api()
 
-def _fetch_all_aps() -> List[Dict[str, Any]]:
-    # Query Aruba Central API for the full list of APs
+def _iter_aps() -> Iterator[Dict[str, Any]]:
+    # Stream the AP list from Aruba Central API page by page
     endpoint = os.getenv("ARUBA_APS_LIST_ENDPOINT", "/network-monitoring/v1alpha1/aps")
     page_size = int(os.getenv("ARUBA_PAGE_SIZE", "100"))
     params = {"limit": page_size}
     # Use the robust Aruba API pagination helper (cursor or offset)
-    aps = _api._cursor_or_offset_collect(
+    return _api._cursor_or_offset_iter(
         endpoint=endpoint,
         root_keys=["items", "aps", "data"],
         params=params
     )
-    logger.info(f"Discovered {len(aps)} APs from API list endpoint (via _cursor_or_offset_collect)")
-    return aps
 
-def _fetch_ap_details(serial: str) -> Dict[str, Any]:
+def _fetch_ap_details(api, serial: str, validators: Tuple[Optional[str], Optional[str]] = (None, None)):
+    """Conditional GET of one AP's details; safe to run on worker threads.
+
+    Returns (details, (etag, last_modified), status). details is None when the
+    API answers 304 Not Modified for the cached validators; status is None when
+    the request failed, so the caller can report the AP instead of storing it.
+    """
     endpoint = "/network-monitoring/v1alpha1/aps/{serialNumber}"
     try:
         # Always use serialNumber as the path param
-        return _api.get(endpoint.format(serialNumber=serial))
+        details, etag, last_modified, status = api.get_conditional(
+            endpoint.format(serialNumber=serial), etag=validators[0], last_modified=validators[1]
+        )
+        return details, (etag, last_modified), status
     except Exception as e:
         logger.error(f"Failed to fetch details for AP {serial}: {e}")
-        return {}
+        return None, (None, None), None
 
-def lambda_handler(event, context):
+# DB column -> Aruba API field, read from the details payload with a fallback to
+# the AP list item. serial and the detail validators are passed in directly.
+_AP_FIELD_MAP = {
+    "name": "deviceName",
+    "mac_address": "macAddress",
+    "ip_address": "ipv4",
+    "model": "model",
+    "status": "status",
+    "site_id": "siteId",
+    "site_name": "siteName",
+    "sw_version": "softwareVersion",
+    "uptime": "uptimeInMillis",
+    "cluster_name": "clusterName",
+    "public_ip": "publicIpv4",
+}
+
+# (column, API field) in AP_COLUMNS order; None marks the columns passed in directly
+_AP_ROW_FIELDS = tuple((col, _AP_FIELD_MAP.get(col)) for col in AP_COLUMNS)
+
+def _ap_row(details: Dict[str, Any], ap: Dict[str, Any], serial: str,
+            etag: Optional[str], last_modified: Optional[str]) -> tuple:
+    """AP row tuple in AP_COLUMNS order, without building a dict per AP."""
+    direct = {
+        "serial": details.get("serialNumber") or serial,
+        "detail_etag": etag,
+        "detail_last_modified": last_modified,
+    }
+    return tuple(direct[col] if key is None else details.get(key) or ap.get(key) for col, key in _AP_ROW_FIELDS)
+
+def _ingest_ap(ap: Dict[str, Any], serial: str, details: Dict[str, Any], validators=(None, None)):
+    ap_row = _ap_row(details, ap, serial, validators[0], validators[1])
+    radio_rows: List[Dict[str, Any]] = []
+    wlan_rows: List[Dict[str, Any]] = []
+    port_rows: List[Dict[str, Any]] = []
+    # Radios and WLANs (WLANs are nested under each radio)
+    for idx, radio in enumerate(details.get("radios", [])):
+        radio_rows.append({
+            "radio_index": idx,
+            "mac_address": radio.get("macAddress"),
+            "band": radio.get("band"),
+            "channel": radio.get("channel"),
+            "bandwidth": radio.get("bandwidth"),
+            "status": radio.get("status"),
+            "radio_number": radio.get("radioNumber"),
+            "mode": radio.get("mode"),
+            "antenna": radio.get("antenna"),
+            "spatial_stream": radio.get("spatialStream"),
+            "power": radio.get("power"),
+        })
+        # WLANs for this radio
+        for wlan in radio.get("wlans", []):
+            # Extract wlan_name from WLAN object (standard logic)
+            wlan_name = wlan.get("wlanName") or wlan.get("wLanName")
+            if not wlan_name and logger.isEnabledFor(logging.DEBUG):
+                logger.debug("[ap_wlan] Missing wlan_name in WLAN object: %s", json.dumps(wlan)[:300])
+            wlan_row = {
+                "wlan_name": wlan_name,
+                "security": wlan.get("security"),
+                "security_level": wlan.get("securityLevel"),
+                "bssid": wlan.get("bssid"),
+                "vlan": wlan.get("vlan"),
+                "status": wlan.get("status"),
+            }
+            logger.debug("[ap_wlan] Insert WLAN row for AP %s: %s", serial, wlan_row)
+            wlan_rows.append(wlan_row)
+    # Ports
+    for port in details.get("ports", []):
+        port_rows.append({
+            "mac_address": port.get("macAddress"),
+            "port_name": port.get("name"),
+            "port_index": port.get("portIndex"),
+            "status": port.get("status"),
+            "vlan_mode": port.get("vlanMode"),
+            "allowed_vlan": port.get("allowedVlan"),
+            "native_vlan": port.get("nativeVlan"),
+            "access_vlan": port.get("accessVlan"),
+            "speed": port.get("speed"),
+            "duplex": port.get("duplex"),
+            "connector": port.get("connector"),
+        })
+    # Modem (if present, single object)
+    modem = details.get("modem")
+    # One transaction per AP; child rows are upserted on their natural keys and
+    # rows the API no longer reports are deleted by generation (sync_ap_children)
+    _db.upsert_ap_with_children(ap_row, radio_rows, wlan_rows, port_rows, modem)
+    _ap_validators[serial] = validators
+
+# Secrets fetch and DB connect happen in the Lambda init phase; lambda_handler
+# retries via _init() if this fails.
+if os.getenv("AWS_LAMBDA_FUNCTION_NAME"):
+    try:
+        _init()
+    except Exception as e:
+        logger.warning(f"[init] module-scope init failed, deferring to handler: {e}")
+
+def _ap_serial(ap: Dict[str, Any]) -> Optional[str]:
+    return ap.get("serialNumber") or ap.get("serial") or ap.get("serial_number")
+
+def _list_modified_ms(ap: Dict[str, Any]) -> Optional[int]:
+    """Modification time reported on an AP list item, as epoch ms (None if absent)."""
+    val = ap.get("lastModifiedTimestamp") or ap.get("statusUpdateTime")
+    if val in (None, "", 0, "0"):
+        return None
+    if isinstance(val, str) and val.isdigit():
+        val = int(val)
+    if isinstance(val, (int, float)):
+        return int(val if val > 1e11 else val * 1000)
+    try:
+        val = str(val)
+        dt = datetime.fromisoformat(val if _FROMISO_ACCEPTS_Z else val.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp() * 1000)
+
+def _load_validators():
+    global _ap_validators_loaded
+    if _ap_validators_loaded:
+        return
+    try:
+        _ap_validators.update(_db.load_ap_validators())
+    except Exception as e:
+        logger.warning(f"Failed to load AP detail validators, fetching all details: {e}")
+    _ap_validators_loaded = True
+
+def _process_aps(items: Iterable[Tuple[Dict[str, Any], Any]]) -> Tuple[Dict[str, int], List[Any]]:
+    """Fetch details for each (ap, tag) in parallel and write them on this thread.
+
+    Returns outcome counts and the tags of APs that failed to ingest.
+    """
+    workers = max(1, int(os.getenv("AP_DETAIL_CONCURRENCY", "12")))
+    outcomes = {"aps": 0, "inserted": 0, "unchanged": 0, "failed": 0}
+    failed_tags: List[Any] = []
+    watermarks: List[Tuple[int, str]] = []
+
+    def _store(fut, ap, serial, tag):
+        details, validators, status = fut.result()
+        if status is None or (status != 304 and not details):
+            # Fetch failed (or the body did not parse): storing empty details
+            # would delete the AP's child rows, so report it for SQS redrive
+            # and leave it unwatermarked instead
+            outcomes["failed"] += 1
+            failed_tags.append(tag)
+            return
+        if status == 304:
+            outcomes["unchanged"] += 1
+        else:
+            try:
+                _ingest_ap(ap, serial, details, validators)
+                outcomes["inserted"] += 1
+            except Exception as e:
+                logger.error(f"Failed to ingest AP {serial}: {e}")
+                outcomes["failed"] += 1
+                failed_tags.append(tag)
+                return
+        ts = _list_modified_ms(ap)
+        if ts is not None:
+            watermarks.append((ts, serial))
+
+    # Detail GETs are I/O bound and run in parallel while list pages are still
+    # streaming in; DB writes stay on this thread because the MySQL connection
+    # is not thread-safe. In-flight work is capped so memory stays bounded.
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        in_flight: Dict[Any, Any] = {}
+        for ap, tag in items:
+            outcomes["aps"] += 1
+            serial = _ap_serial(ap)
+            if not serial:
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Skipping AP with missing serial: %s", json.dumps(ap)[:300])
+                continue
+            validators = _ap_validators.get(serial, (None, None))
+            in_flight[ex.submit(_fetch_ap_details, _api, serial, validators)] = (ap, serial, tag)
+            if len(in_flight) >= workers * 2:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    _store(fut, *in_flight.pop(fut))
+        for fut in as_completed(in_flight):
+            _store(fut, *in_flight[fut])
+    try:
+        _db.update_ap_watermarks(watermarks)
+    except Exception as e:
+        # Not fatal: those APs are simply re-enqueued next cycle
+        logger.warning(f"Failed to store AP list watermarks: {e}")
+    return outcomes, failed_tags
+
+def list_aps_handler(event, context):
+    """Scheduled entry point: enqueue one SQS message per AP for lambda_handler.
+
+    APs whose list timestamp is not newer than the watermark stored at their
+    last ingest are not enqueued.
+    """
     start = time.time()
     _init()
-    close_conn = os.getenv("DB_CLOSE_EACH_INVOCATION", "true").lower() == "true"
-    inserted = 0
-    failed = 0
-    aps = _fetch_all_aps()
-    for ap in aps:
-        serial = ap.get("serialNumber") or ap.get("serial") or ap.get("serial_number")
+    _db.ping()
+    queue_url = os.environ["AP_QUEUE_URL"]
+    skip_unchanged = os.getenv("AP_SKIP_UNCHANGED", "true").lower() == "true"
+    stored_marks = _db.load_ap_watermarks() if skip_unchanged else {}
+    listed = 0
+    skipped = 0
+    enqueued = 0
+    batch: List[Dict[str, str]] = []
+
+    def _flush():
+        nonlocal enqueued
+        resp = _SQS_CLIENT.send_message_batch(QueueUrl=queue_url, Entries=batch)
+        enqueued += len(resp.get("Successful", []))
+        for f in resp.get("Failed", []):
+            logger.error(f"[ap_lister] enqueue failed id={f.get('Id')} code={f.get('Code')} msg={f.get('Message')}")
+        batch.clear()
+
+    for ap in _iter_aps():
+        listed += 1
+        serial = _ap_serial(ap)
         if not serial:
-            logger.debug(f"Skipping AP with missing serial: {json.dumps(ap)[:300]}")
             continue
-        try:
-            details = _fetch_ap_details(serial)
-            # Map API fields to DB schema (fall back to top-level AP fields if details missing)
-            ap_row = {
-                "serial": details.get("serialNumber") or serial,
-                "name": details.get("deviceName") or ap.get("deviceName"),
-                "mac_address": details.get("macAddress") or ap.get("macAddress"),
-                "ip_address": details.get("ipv4") or ap.get("ipv4"),
-                "model": details.get("model") or ap.get("model"),
-                "status": details.get("status") or ap.get("status"),
-                "site_id": details.get("siteId") or ap.get("siteId"),
-                "site_name": details.get("siteName") or ap.get("siteName"),
-                "sw_version": details.get("softwareVersion") or ap.get("softwareVersion"),
-                "uptime": details.get("uptimeInMillis") or ap.get("uptimeInMillis"),
-                "cluster_name": details.get("clusterName") or ap.get("clusterName"),
-                "public_ip": details.get("publicIpv4") or ap.get("publicIpv4"),
-            }
-            _db.insert_ap(ap_row)
-            # Delete all existing child records for this AP serial before inserting new ones
-            _db.delete_ap_radios(serial)
-            _db.delete_ap_wlans(serial)
-            _db.delete_ap_ports(serial)
-            _db.delete_ap_modems(serial)
-            # Radios and WLANs (WLANs are nested under each radio)
-            for idx, radio in enumerate(details.get("radios", [])):
-                radio_row = {
-                    "radio_index": idx,
-                    "mac_address": radio.get("macAddress"),
-                    "band": radio.get("band"),
-                    "channel": radio.get("channel"),
-                    "bandwidth": radio.get("bandwidth"),
-                    "status": radio.get("status"),
-                    "radio_number": radio.get("radioNumber"),
-                    "mode": radio.get("mode"),
-                    "antenna": radio.get("antenna"),
-                    "spatial_stream": radio.get("spatialStream"),
-                    "power": radio.get("power"),
-                }
-                _db.insert_ap_radio(serial, radio_row)
-                # WLANs for this radio
-                for wlan in radio.get("wlans", []):
-                    # Extract wlan_name from WLAN object (standard logic)
-                    wlan_name = wlan.get("wlanName") or wlan.get("wLanName")
-                    if not wlan_name:
-                        logger.debug(f"[ap_wlan] Missing wlan_name in WLAN object: {json.dumps(wlan)[:300]}")
-                    wlan_row = {
-                        "wlan_name": wlan_name,
-                        "security": wlan.get("security"),
-                        "security_level": wlan.get("securityLevel"),
-                        "bssid": wlan.get("bssid"),
-                        "vlan": wlan.get("vlan"),
-                        "status": wlan.get("status"),
-                    }
-                    logger.debug(f"[ap_wlan] Insert WLAN row for AP {serial}: {json.dumps(wlan_row)}")
-                    _db.insert_ap_wlan(serial, wlan_row)
-            # Ports
-            for port in details.get("ports", []):
-                port_row = {
-                    "mac_address": port.get("macAddress"),
-                    "port_name": port.get("name"),
-                    "port_index": port.get("portIndex"),
-                    "status": port.get("status"),
-                    "vlan_mode": port.get("vlanMode"),
-                    "allowed_vlan": port.get("allowedVlan"),
-                    "native_vlan": port.get("nativeVlan"),
-                    "access_vlan": port.get("accessVlan"),
-                    "speed": port.get("speed"),
-                    "duplex": port.get("duplex"),
-                    "connector": port.get("connector"),
-                }
-                _db.insert_ap_port(serial, port_row)
-            # Modem (if present, single object)
-            modem = details.get("modem")
-            if modem:
-                _db.insert_ap_modem(serial, modem)
-            inserted += 1
-        except Exception as e:
-            logger.error(f"Failed to ingest AP {serial}: {e}")
-            failed += 1
+        mark = stored_marks.get(serial)
+        if mark is not None:
+            ts = _list_modified_ms(ap)
+            if ts is not None and ts <= mark:
+                skipped += 1
+                continue
+        # SendMessageBatch accepts at most 10 entries per call
+        batch.append({"Id": str(len(batch)), "MessageBody": json.dumps(ap, separators=(",", ":"))})
+        if len(batch) == 10:
+            _flush()
+    if batch:
+        _flush()
     dur = round(time.time() - start, 3)
-    summary = {"aps": len(aps), "inserted": inserted, "failed": failed, "duration_sec": dur}
+    summary = {"aps": listed, "skipped": skipped, "enqueued": enqueued, "duration_sec": dur}
+    logger.info(f"[ap_lister_summary] {json.dumps(summary, separators=(',',':'))}")
+    return {"statusCode": 200, "body": json.dumps(summary)}
+
+def lambda_handler(event, context):
+    """Ingest APs from an SQS batch (one AP list item per message).
+
+    Invoked without SQS records (e.g. manually), it lists and ingests the
+    whole fleet in one run as before.
+    """
+    start = time.time()
+    _init()
+    # Reuse the warm connection; ping re-establishes it if RDS closed it while idle
+    _db.ping()
+    close_conn = os.getenv("DB_CLOSE_EACH_INVOCATION", "false").lower() == "true"
+    _load_validators()
+    records = (event or {}).get("Records")
+    if records is not None:
+        items = ((_j.loads(r["body"]), r["messageId"]) for r in records)
+        outcomes, failed_ids = _process_aps(items)
+        result = {"batchItemFailures": [{"itemIdentifier": mid} for mid in failed_ids]}
+        summary = {**outcomes, "duration_sec": round(time.time() - start, 3)}
+    else:
+        outcomes, _ = _process_aps((ap, None) for ap in _iter_aps())
+        logger.info(f"Discovered {outcomes['aps']} APs from API list endpoint (via _cursor_or_offset_iter)")
+        summary = {**outcomes, "duration_sec": round(time.time() - start, 3)}
+        result = {"statusCode": 200, "body": json.dumps(summary)}
     logger.info(f"[ap_ingestion_summary] {json.dumps(summary, separators=(',',':'))}")
-    result = {"statusCode": 200, "body": json.dumps(summary)}
     if close_conn and _db:
         try:
             _db.close()
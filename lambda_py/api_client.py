@@ -2,23 +2,131 @@ import os
 import time
 import logging
 from datetime import datetime, timedelta, timezone
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterator, Mapping, Optional, Union
 import json
 import urllib.request
 import urllib.error
 import urllib.parse
 from urllib.error import HTTPError
+import io
+import base64
 import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+
+try:
+    import urllib3  # type: ignore  # ships with botocore in the Lambda runtime
+except ImportError:
+    urllib3 = None  # type: ignore
+
+try:
+    import httpx  # type: ignore  # optional, shipped in the shared layer with its http2 extra
+except ImportError:
+    httpx = None  # type: ignore
+
+try:
+    # Parses response bytes directly in C; its JSONDecodeError subclasses json's
+    from orjson import loads as _loads  # type: ignore
+except ImportError:
+    _loads = json.loads
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# Module-level pool so keep-alive connections (and their TLS sessions) survive
+# across requests, worker threads and warm invocations. Retries stay in
+# _do_request, which also handles 429 pacing and 401 re-auth.
+# num_pools covers the API gateway plus the OAuth token host.
+_HTTP = urllib3.PoolManager(
+    num_pools=4,
+    maxsize=int(os.getenv("ARUBA_HTTP_POOL_MAXSIZE", "16")),
+    retries=False,
+) if urllib3 is not None else None
+
+
+def _http2_client():
+    """HTTP/2 client multiplexing concurrent requests over one TLS connection per host.
+
+    None (urllib3/urllib is used) when httpx or h2 is missing or ARUBA_HTTP2=false.
+    """
+    if httpx is None or os.getenv("ARUBA_HTTP2", "true").lower() != "true":
+        return None
+    try:
+        return httpx.Client(
+            http2=True,
+            headers={"Accept": "application/json"},
+            limits=httpx.Limits(max_keepalive_connections=4, max_connections=16),
+        )
+    except ImportError:  # httpx without the h2 package
+        return None
+
+
+_HTTP2 = _http2_client()
+
+# OAuth token persisted here so warm containers and fresh client instances skip
+# the token POST. ARUBA_TOKEN_SSM_PARAM (optional) names a SecureString that
+# also carries the token across cold starts.
+_TOKEN_CACHE_PATH = os.getenv("ARUBA_TOKEN_CACHE_PATH", "/tmp/aruba_oauth.json")
+
+# List keys to look for, in priority order, in responses from the documented
+# endpoints; their shape is stable, so no other keys are scanned for these.
+_ROOT_KEYS_BY_ENDPOINT = {
+    "/network-monitoring/v1alpha1/devices": ("devices", "items", "data"),
+    "/network-monitoring/v1alpha1/clients": ("items", "clients", "data"),
+    "/network-monitoring/v1alpha1/sites-health": ("items", "sites", "data"),
+    "/network-monitoring/v1alpha1/aps": ("items", "aps", "data"),
+}
+
+# Stable identity keys, in priority order, used to dedupe devices across pages
+_DEVICE_KEYS = ("id", "deviceId", "macAddress", "mac", "serialNumber")
+
+def _device_key(d: Dict[str, Any]) -> Optional[str]:
+    """Dedup key for a device: first stable id, else name|ipv4, else None."""
+    key = next((d[k] for k in _DEVICE_KEYS if d.get(k)), None)
+    if not key:
+        name = d.get("deviceName") or d.get("name")
+        ip4 = d.get("ipv4")
+        if name or ip4:
+            key = f"{name or ''}|{ip4 or ''}"
+    return key
+
+# Device keys the switch interfaces handler reads from list_devices results
+PROJECT_DEVICE_FIELDS = (
+    "deviceType", "serialNumber", "serial", "_site_id", "siteId", "site_id",
+    "_site_name", "name", "deviceName", "hostname",
+)
+
 class ArubaApiClient:
 
     def get(self, endpoint: str, params: Dict[str, Any] = None):
         """Public GET method for compatibility with ingestion handlers."""
         return self._get_json(endpoint, params)
 
+    def get_conditional(self, endpoint: str, params: Dict[str, Any] = None,
+                        etag: Optional[str] = None, last_modified: Optional[str] = None):
+        """GET with If-None-Match / If-Modified-Since validators.
+
+        Returns (json, etag, last_modified, status); json is None on 304 Not Modified.
+        """
+        self._ensure_token()
+        url = f"{self.base_url}{endpoint}"
+        if params:
+            url = f"{url}?{urllib.parse.urlencode(params, doseq=True)}"
+        headers = dict(self._headers())
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        status, resp_headers, raw = self._do_request(urllib.request.Request(url, headers=headers), meta=True)
+        if status == 304:
+            return None, etag, last_modified, status
+        try:
+            js = _loads(raw)
+        except json.JSONDecodeError:
+            logger.error(f"[parse] Failed to parse JSON from {url}")
+            js = {}
+        return js, resp_headers.get("ETag"), resp_headers.get("Last-Modified"), status
+
     def get_switch_interfaces(self, serial: str, site_id: str = None) -> list:
         """Fetch interfaces for a switch given serial, passing site_id as a query parameter if required."""
         endpoint = f"/network-monitoring/v1alpha1/switch/{serial}/interfaces"
@@ -34,6 +142,32 @@ class ArubaApiClient:
         except Exception as e:
             logger.error(f"[switch_interfaces] Failed for serial={serial} site_id={site_id}: {e}")
             return []
+
+    def get_switch_interfaces_batch(self, serials: List[str], site_id: Union[str, Mapping[str, str], None] = None,
+                                    max_workers: int = 8) -> Dict[str, list]:
+        """Fetch interfaces for many switches concurrently; returns {serial: interfaces}.
+
+        `site_id` is either one site for every serial or a serial -> site_id mapping.
+        Requests share the client's throttle, and a failed switch maps to [] just
+        like get_switch_interfaces.
+        """
+        if not serials:
+            return {}
+        self._ensure_token()
+        sites = site_id if isinstance(site_id, Mapping) else None
+        results: Dict[str, list] = {}
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(serials)))) as pool:
+            futures = {
+                pool.submit(self.get_switch_interfaces, s, sites.get(s) if sites is not None else site_id): s
+                for s in serials
+            }
+            for fut in as_completed(futures):
+                try:
+                    results[futures[fut]] = fut.result()
+                except Exception as e:
+                    logger.error(f"[switch_interfaces] Failed for serial={futures[fut]}: {e}")
+                    results[futures[fut]] = []
+        return {s: results[s] for s in serials}
     """
     Aruba Central API client (clients-focused after device removal).
     """
@@ -46,7 +180,7 @@ class ArubaApiClient:
                  oauth_token_url: Optional[str] = None,
                  page_limit: int = 100,
                  early_expiry_buffer: int = 300,
-                 page_delay_seconds: float = 2.0,
+                 page_delay_seconds: float = 0.25,
                  request_timeout: int = 30,
                  max_retries: int = 3):
         self.client_id = client_id
@@ -59,16 +193,45 @@ class ArubaApiClient:
         self.early_expiry_buffer = early_expiry_buffer
         self.request_timeout = request_timeout
         self.max_retries = max_retries
+        # Shared keep-alive pool (None -> urlopen); every GET and the token POST go through _send
+        self._http = _HTTP
+        self._http2 = _HTTP2
 
         # Token cache (module-level persistence across warm starts)
         self._access_token: Optional[str] = None
         self._expires_at: Optional[datetime] = None
+        # Serializes token refresh when the client is shared across worker threads
+        self._token_lock = threading.Lock()
+        self._headers_cached: Dict[str, str] = {}
+        self._headers_key: Optional[tuple] = None
+        self._base_auth_b64 = self._basic_auth_b64(client_id, client_secret) if client_id else None
 
         self.min_interval = float(os.getenv("ARUBA_MIN_REQUEST_INTERVAL_SEC", "0.5"))  # base throttle
         self.max_backoff = float(os.getenv("ARUBA_MAX_BACKOFF_SEC", "30"))
         self._lock = threading.Lock()
-        self._last_request_ts = 0.0
+        # Earliest monotonic time the next request may be sent (see _throttle)
+        self._next_allowed = 0.0
+        # Sliding 60s window of reserved send times (monotonic); _rpm_cap shrinks when
+        # X-RateLimit-Remaining runs low and returns to ARUBA_MAX_RPM once it recovers
+        self._req_times: deque = deque()
+        self._rpm_max = max(1, int(os.getenv("ARUBA_MAX_RPM", "300")))
+        self._rpm_floor = max(1, min(self._rpm_max, int(os.getenv("ARUBA_MIN_RPM", "10"))))
+        self._rpm_cap = self._rpm_max
+        # AIMD tuning of min_interval from the last ARUBA_AIMD_WINDOW request outcomes
+        self._outcomes: deque = deque(maxlen=max(1, int(os.getenv("ARUBA_AIMD_WINDOW", "20"))))
+        self._aimd_alpha = float(os.getenv("ARUBA_AIMD_ALPHA", "0.05"))
+        self._aimd_beta = float(os.getenv("ARUBA_AIMD_BETA", "1.5"))
+        self._aimd_floor = float(os.getenv("ARUBA_MIN_INTERVAL_FLOOR_SEC", "0.1"))
+        self._aimd_ceil = float(os.getenv("ARUBA_MIN_INTERVAL_CEIL_SEC", "5.0"))
+        self._target_latency = float(os.getenv("ARUBA_TARGET_LATENCY_SEC", "1.0"))
         self.max_pages_per_call = int(os.getenv("ARUBA_MAX_PAGES_PER_CALL", "60"))
+        # Listing options are fixed for the sandbox's lifetime; read them once here
+        self._sites_sort = os.getenv("ARUBA_SITES_SORT", "").strip()
+        self._device_sort = os.getenv("ARUBA_DEVICE_SORT", "")
+        self._clients_try_global = os.getenv("ARUBA_CLIENTS_TRY_GLOBAL", "false").lower() == "true"
+        self._site_concurrency = max(1, int(os.getenv("ARUBA_SITE_CONCURRENCY", "4")))
+        # Label of the clients site-filter variant that last returned data (see list_clients_single_site)
+        self._clients_variant: Optional[str] = None
 
         # Allow explicit env override for token URL precedence
         env_token_url = os.getenv("ARUBA_OAUTH_TOKEN_URL")
@@ -81,28 +244,36 @@ class ArubaApiClient:
 
     # ---------- Public high-level ----------
     def list_sites(self) -> List[Dict[str, Any]]:
-        sort_expr = os.getenv("ARUBA_SITES_SORT", "").strip()
+        """List-returning wrapper around iter_list_sites."""
+        return list(self.iter_list_sites())
+
+    def iter_list_sites(self) -> Iterator[Dict[str, Any]]:
+        """Yield sites page by page."""
+        sort_expr = self._sites_sort
         params: Dict[str, Any] = {}
         if sort_expr:
             params["sort"] = sort_expr
-        return self._cursor_or_offset_collect(
+        return self._cursor_or_offset_iter(
             endpoint="/network-monitoring/v1alpha1/sites-health",
-            root_keys=["sites", "items", "data"],
+            root_keys=None,
             params=params
         )
 
     def list_clients_single_site(self, site_id: str) -> List[Dict[str, Any]]:
-        """Fetch clients for a site using status filter with cursor-first pagination.
+        """List-returning wrapper around iter_list_clients_single_site."""
+        return list(self.iter_list_clients_single_site(site_id))
+
+    def iter_list_clients_single_site(self, site_id: str) -> Iterator[Dict[str, Any]]:
+        """Yield clients for a site using status filter with cursor-first pagination.
 
         Logic:
         1. Build filter clause (status IN + optional lastSeenAt cutoff)
         2. Attempt cursor pagination using 'next' token if present in first response.
         3. Fallback to offset pagination if no 'next' is returned.
         """
-        import urllib.parse
         endpoint = "/network-monitoring/v1alpha1/clients"
 
-        try_global = os.getenv("ARUBA_CLIENTS_TRY_GLOBAL", "false").lower() == "true"
+        try_global = self._clients_try_global
         variants = [
             ("site-id", {"site-id": site_id}),
             ("siteId", {"siteId": site_id}),
@@ -110,107 +281,134 @@ class ArubaApiClient:
         if try_global:
             variants.append(("nosite", {}))
 
-        def _collect_for_variant(variant_params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        def _iter_for_variant(variant_params: Dict[str, Any], meta: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
             base_params: Dict[str, Any] = {**variant_params}
-            items = self._cursor_or_offset_collect(
+            return self._cursor_or_offset_iter(
                 endpoint=endpoint,
-                root_keys=["clients", "items", "data"],
+                root_keys=None,
                 params=base_params,
                 annotate=lambda c: c.setdefault("_site_id", site_id) if site_id else None,
-                per_page_site_delay=True
+                per_page_site_delay=True,
+                meta=meta
             )
-            return items
 
+        # Once a variant has returned clients, the API's site parameter is known;
+        # later sites use only that one instead of re-probing the others.
+        if self._clients_variant is not None:
+            variants = [v for v in variants if v[0] == self._clients_variant] or variants
+        # A variant is accepted as soon as its first client arrives; the rest
+        # of its pages are streamed through.
         for label, base in variants:
             vp = dict(base)
-            items = _collect_for_variant(vp)
-            if items:
-                return items
-        return []
-
-    def list_devices(self) -> List[Dict[str, Any]]:
-        """Fetch devices using cursor-based pagination with 'next' token.
+            meta: Dict[str, Any] = {}
+            it = _iter_for_variant(vp, meta)
+            first = next(it, None)
+            if first is not None:
+                self._clients_variant = label
+                yield first
+                yield from it
+                return
+            # A 200 reporting total 0 with no cursor is an empty site, not a
+            # rejected site filter, so the remaining variants are not probed.
+            if meta.get("status_ok") and not meta.get("had_next") and meta.get("first_page_size") == 0 \
+                    and meta.get("total") == 0:
+                logger.info(f"[clients] site={site_id} variant={label} reported total=0; skipping other variants")
+                return
+
+    def list_devices(self, fields: Optional[tuple] = None) -> List[Dict[str, Any]]:
+        """List-returning wrapper around iter_devices."""
+        return list(self.iter_devices(fields))
+
+    def iter_devices(self, fields: Optional[tuple] = None) -> Iterator[Dict[str, Any]]:
+        """Yield devices using cursor-based pagination with 'next' token.
 
         Aruba docs indicate a 'next' field for pagination. We repeatedly request
         pages until 'next' is null/missing or safety limits are hit.
         Deduplication by stable key (id/deviceId/macAddress/mac/serialNumber) is
         applied to avoid duplicates if API returns overlapping pages.
+        Only the current page is held in memory; with `fields` (e.g.
+        PROJECT_DEVICE_FIELDS) each device is reduced to those keys.
         """
-        import urllib.request, urllib.parse, json as _json
         endpoint = "/network-monitoring/v1alpha1/devices"
-        collected: List[Dict[str, Any]] = []
+        root_keys = _ROOT_KEYS_BY_ENDPOINT[endpoint]
+        unique = 0
         seen_keys: set = set()
+        seen_add = seen_keys.add
         page = 0
-        next_token: Optional[str] = None
         limit = self.page_limit
         # The API allows up to 100 (docs say default 1000 but max 100). Ensure <=100.
         if limit > 100:
             limit = 100
-        base_params = {"limit": limit}
-        sort_expr = os.getenv("ARUBA_DEVICE_SORT", "")
+        # limit/sort only go on the first page; cursor pages carry just the
+        # token, so both URL shapes are built once up front
+        first_params = {"limit": limit}
+        sort_expr = self._device_sort
         if sort_expr:
-            base_params["sort"] = sort_expr
-        while True:
-            page += 1
-            params = dict(base_params)
-            if page > 1 and next_token:
-                params = {"next": next_token}
-            qs = urllib.parse.urlencode(params)
-            url = f"{self.base_url}{endpoint}?{qs}" if qs else f"{self.base_url}{endpoint}"
-            req = urllib.request.Request(url, headers=self._headers())
-            raw = self._do_request(req)
-            try:
-                js = _json.loads(raw.decode())
-            except Exception:
-                logger.warning(f"[devices] JSON decode failed page={page} url={url}")
-                break
-            page_items: List[Dict[str, Any]] = []
-            if isinstance(js, dict):
-                for k in ("devices", "items", "data"):
-                    if k in js and isinstance(js[k], list):
-                        page_items = js[k]
-                        break
-                if not page_items:
-                    for v in js.values():
+            first_params["sort"] = sort_expr
+        first_url = f"{self.base_url}{endpoint}?{urllib.parse.urlencode(first_params)}"
+        cursor_prefix = f"{self.base_url}{endpoint}?next="
+        page_delay = max(self.min_interval, min(self.page_delay_seconds, 1.0))
+
+        def fetch(url: str, delay: float = 0.0):
+            if delay:
+                time.sleep(delay)
+            return url, self._do_request(urllib.request.Request(url, headers=self._headers()))
+
+        # One background worker fetches page N+1 while page N is parsed and
+        # consumed; the inter-page delay runs inside the worker.
+        pool = ThreadPoolExecutor(max_workers=1)
+        fut = pool.submit(fetch, first_url)
+        try:
+            while fut is not None:
+                page += 1
+                url, raw = fut.result()
+                fut = None
+                try:
+                    js = _loads(raw)
+                except Exception:
+                    logger.warning(f"[devices] JSON decode failed page={page} url={url}")
+                    break
+                page_items: List[Dict[str, Any]] = []
+                if isinstance(js, dict):
+                    for k in root_keys:
+                        v = js.get(k)
                         if isinstance(v, list):
                             page_items = v
                             break
-            elif isinstance(js, list):
-                page_items = js
-            if not page_items:
-                logger.info(f"[devices] empty page page={page} breaking")
-                break
-            added = 0
-            dups = 0
-            for d in page_items:
-                key = (
-                    d.get("id") or d.get("deviceId") or d.get("macAddress") or d.get("mac") or d.get("serialNumber")
-                )
-                if not key:
-                    name = d.get("deviceName") or d.get("name")
-                    ip4 = d.get("ipv4")
-                    if name or ip4:
-                        key = f"{name or ''}|{ip4 or ''}"
-                if key and key in seen_keys:
-                    dups += 1
-                    continue
-                if key:
-                    seen_keys.add(key)
-                collected.append(d)
-                added += 1
-            logger.info(f"[devices] page={page} raw={len(page_items)} added={added} dups={dups} total_unique={len(collected)}")
-            # Next token extraction
-            new_next = js.get("next") if isinstance(js, dict) else None
-            if not new_next:
-                logger.info(f"[devices] pagination complete page={page} (no next)")
-                break
-            next_token = new_next
-            if page >= self.max_pages_per_call:
-                logger.warning(f"[devices] hit max_pages_per_call={self.max_pages_per_call} stopping early")
-                break
-            time.sleep(max(self.min_interval, min(self.page_delay_seconds, 1.0)))
-        logger.info(f"[devices] collected_unique={len(collected)} pages={page}")
-        return collected
+                elif isinstance(js, list):
+                    page_items = js
+                if not page_items:
+                    logger.info(f"[devices] empty page page={page} breaking")
+                    break
+                # Next token extraction happens before the page is processed so
+                # the following request can already be in flight.
+                new_next = js.get("next") if isinstance(js, dict) else None
+                if not new_next:
+                    logger.info(f"[devices] pagination complete page={page} (no next)")
+                elif page >= self.max_pages_per_call:
+                    logger.warning(f"[devices] hit max_pages_per_call={self.max_pages_per_call} stopping early")
+                else:
+                    fut = pool.submit(fetch, cursor_prefix + urllib.parse.quote_plus(str(new_next)), page_delay)
+                # seen_add() returns None, so a new key is recorded and kept in one
+                # pass; keyless devices are always kept
+                new_items = [
+                    d for d, key in zip(page_items, map(_device_key, page_items))
+                    if not key or (key not in seen_keys and not seen_add(key))
+                ]
+                added = len(new_items)
+                dups = len(page_items) - added
+                unique += added
+                if fields:
+                    for d in new_items:
+                        yield {k: d.get(k) for k in fields}
+                else:
+                    yield from new_items
+                logger.info(f"[devices] page={page} raw={len(page_items)} added={added} dups={dups} total_unique={unique}")
+        finally:
+            if fut is not None:
+                fut.cancel()
+            pool.shutdown(wait=False)
+        logger.info(f"[devices] collected_unique={unique} pages={page}")
 
     def list_all_clients(self, site_id_override: Optional[str]) -> List[Dict[str, Any]]:
         """Aggregate clients across all sites (or single site if override provided).
@@ -218,14 +416,21 @@ class ArubaApiClient:
         Maintains prior behavior expected by ingestion_handler while leveraging
         cursor-first pagination inside list_clients_single_site.
         """
+        return [c for _, c in self.iter_list_all_clients(site_id_override)]
+
+    def iter_list_all_clients(self, site_id_override: Optional[str]) -> Iterator[tuple]:
+        """Yield (site, client) pairs site by site instead of one combined list.
+
+        Only the sites currently being fetched (ARUBA_SITE_CONCURRENCY) are held
+        in memory, so callers can write each site out as it completes.
+        """
         if site_id_override:
-            clients = self.list_clients_single_site(site_id_override)
-            for c in clients:
+            site = {"id": site_id_override}
+            for c in self.iter_list_clients_single_site(site_id_override):
                 c["_site_id"] = site_id_override
-            return clients
+                yield site, c
+            return
 
-        import logging
-        logger = logging.getLogger(__name__)
         sites = []
         for attempt in range(2):
             try:
@@ -235,43 +440,77 @@ class ArubaApiClient:
             except Exception as e:
                 logger.error(f"[sites] Attempt {attempt+1} failed to enumerate sites: {e}")
                 if attempt == 1:
-                    return []
-        all_clients: List[Dict[str, Any]] = []
-        for idx, site in enumerate(sites, 1):
-            sid = site.get("id")
-            if not sid:
-                continue
-            if all_clients:
-                time.sleep(self.page_delay_seconds)
-            site_clients = self.list_clients_single_site(sid)
-            site_name = site.get("name")
-            for sc in site_clients:
-                sc["_site_id"] = sid
-                sc["_site_name"] = site_name
-            logger.info(f"[sites] Site {idx}/{len(sites)} id={sid} name={site_name} clients_found={len(site_clients)}")
-            all_clients.extend(site_clients)
-        return all_clients
+                    return
+        # Sites are fetched concurrently; _do_request's shared throttle still
+        # paces the overall request rate, so workers only overlap network waits.
+        # At most `workers` sites are in flight, and a finished site is handed
+        # to the caller before its slot is refilled.
+        workers = self._site_concurrency
+        todo = iter([s for s in sites if s.get("id")])
+        total = sum(1 for s in sites if s.get("id"))
+        idx = 0
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = {}
+            for s in todo:
+                pending[pool.submit(self.list_clients_single_site, s["id"])] = s
+                if len(pending) >= workers:
+                    break
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    site = pending.pop(fut)
+                    idx += 1
+                    sid = site["id"]
+                    site_name = site.get("name")
+                    site_clients = fut.result()
+                    for sc in site_clients:
+                        sc["_site_id"] = sid
+                        sc["_site_name"] = site_name
+                    logger.info(f"[sites] Site {idx}/{total} id={sid} name={site_name} clients_found={len(site_clients)}")
+                    nxt = next(todo, None)
+                    if nxt is not None:
+                        pending[pool.submit(self.list_clients_single_site, nxt["id"])] = nxt
+                    for sc in site_clients:
+                        yield site, sc
 
     # ---------- Unified cursor/offset collector ----------
     def _cursor_or_offset_collect(self,
         endpoint: str,
-        root_keys: List[str],
+        root_keys: Optional[List[str]],
         params: Dict[str, Any],
         annotate=None,
         per_page_site_delay: bool = False
     ) -> List[Dict[str, Any]]:
-        """Generic collector that prefers cursor ('next') pagination.
+        """List-returning wrapper around _cursor_or_offset_iter."""
+        return list(self._cursor_or_offset_iter(
+            endpoint=endpoint,
+            root_keys=root_keys,
+            params=params,
+            annotate=annotate,
+            per_page_site_delay=per_page_site_delay
+        ))
+
+    def _cursor_or_offset_iter(self,
+        endpoint: str,
+        root_keys: Optional[List[str]],
+        params: Dict[str, Any],
+        annotate=None,
+        per_page_site_delay: bool = False,
+        meta: Optional[Dict[str, Any]] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """Generic generator that prefers cursor ('next') pagination.
 
         Steps:
           1. Perform first request with provided params + limit.
           2. If JSON has 'next', iterate using only {'next': token} on subsequent pages.
           3. Else fallback to offset loop (limit/offset) until empty or max_pages_per_call.
+        Items are yielded page by page, so callers can start work before the
+        last page arrives and only one page is held in memory.
         annotate: optional callable run per item for tagging (site id injection etc.)
         per_page_site_delay: if True, adds a small delay between pages (used for clients variant pacing).
+        meta: optional dict filled after the first page with status_ok, had_next,
+        first_page_size and total (the response's total/count, if any).
         """
-    # No logging
-        import urllib.request, urllib.parse
-        collected: List[Dict[str, Any]] = []
         limit = min(self.page_limit, 100)
         base_params = dict(params)
         base_params.setdefault("limit", limit)
@@ -281,24 +520,36 @@ class ArubaApiClient:
             qs = urllib.parse.urlencode(p, doseq=True)
             return f"{self.base_url}{endpoint}?{qs}" if qs else f"{self.base_url}{endpoint}"
 
+        # Known endpoints use their fixed key order; otherwise 'items' first,
+        # then the caller's keys, then any list value.
+        known_keys = _ROOT_KEYS_BY_ENDPOINT.get(endpoint)
+        keys = known_keys or ("items", *(k for k in root_keys or () if k != "items"))
+
         def _extract_items(js: Any) -> List[Dict[str, Any]]:
-            # Prioritize 'items' for client list extraction
             if isinstance(js, dict):
-                if 'items' in js and isinstance(js['items'], list):
-                    return js['items']
-                # Fallback to other root keys
-                for k in root_keys:
-                    if k in js and isinstance(js[k], list):
-                        return js[k]
-                for v in js.values():
+                for k in keys:
+                    v = js.get(k)
                     if isinstance(v, list):
                         return v
+                if known_keys is None:
+                    for v in js.values():
+                        if isinstance(v, list):
+                            return v
                 if 'data' in js and isinstance(js['data'], dict):
                     return [js['data']]
             elif isinstance(js, list):
                 return js
             return []
 
+        def _annotated(items: List[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+            for it in items:
+                if annotate:
+                    try:
+                        annotate(it)
+                    except Exception:
+                        pass
+                yield it
+
         page = 0
         next_token: Optional[str] = None
         # Issue first request
@@ -306,56 +557,120 @@ class ArubaApiClient:
         req = urllib.request.Request(url, headers=self._headers())
         raw = self._do_request(req)
         try:
-            js = json.loads(raw.decode())
+            js = _loads(raw)
         except Exception:
-            return []
+            return
         page += 1
-        items = _extract_items(js)
-        for it in items:
-            if annotate:
-                try:
-                    annotate(it)
-                except Exception:
-                    pass
-            collected.append(it)
+        first_items = _extract_items(js)
         next_token = js.get("next") if isinstance(js, dict) else None
+        if meta is not None:
+            total = None
+            if isinstance(js, dict):
+                total = js.get("total", js.get("count"))
+            meta.update(status_ok=True, had_next=bool(next_token), first_page_size=len(first_items), total=total)
+        yield from _annotated(first_items)
 
         # Use 'next' paging if available
         # Save original site identifier params for paging
         site_id_keys = [k for k in params.keys() if k in ("site-id", "siteId")]
         site_id_params = {k: params[k] for k in site_id_keys}
+        # Only send 'next' (and site id if present), NOT 'limit' for cursor-based paging.
+        # The site id part never changes, so it is encoded once for all pages.
+        fixed_qs = urllib.parse.urlencode(site_id_params, doseq=True)
+        cursor_prefix = f"{self.base_url}{endpoint}?next="
+        cursor_suffix = f"&{fixed_qs}" if fixed_qs else ""
         while next_token and page < self.max_pages_per_call:
-            # Only send 'next' (and site id if present), NOT 'limit' for cursor-based paging
-            paging_params = {"next": next_token, **site_id_params}
-            cursor_url = _build_url(paging_params)
+            cursor_url = f"{cursor_prefix}{urllib.parse.quote_plus(str(next_token))}{cursor_suffix}"
             req = urllib.request.Request(cursor_url, headers=self._headers())
             raw = self._do_request(req)
             try:
-                js = json.loads(raw.decode())
+                js = _loads(raw)
             except Exception:
                 break
             page += 1
             items = _extract_items(js)
             if not items:
                 break
-            for it in items:
-                if annotate:
-                    try:
-                        annotate(it)
-                    except Exception:
-                        pass
-                collected.append(it)
+            yield from _annotated(items)
             next_token = js.get("next") if isinstance(js, dict) else None
             if per_page_site_delay:
                 time.sleep(max(self.min_interval, min(self.page_delay_seconds, 1.0)))
-        return collected
 
     # ---------- Core HTTP ----------
     def _ensure_token(self):
-        now = datetime.now(timezone.utc)
-        if self._access_token and self._expires_at and now + timedelta(seconds=self.early_expiry_buffer) < self._expires_at:
-            return
-        self._authenticate()
+        with self._token_lock:
+            now = datetime.now(timezone.utc)
+            if self._access_token and self._expires_at and now + timedelta(seconds=self.early_expiry_buffer) < self._expires_at:
+                return
+            if self.client_id and self._load_cached_token(now):
+                return
+            self._authenticate()
+
+    def _load_cached_token(self, now: datetime) -> bool:
+        """Adopt a still-valid token from /tmp or SSM; False when a POST is needed."""
+        sources = [("file", self._read_token_file)]
+        if os.getenv("ARUBA_TOKEN_SSM_PARAM"):
+            sources.append(("ssm", self._read_token_ssm))
+        for name, read in sources:
+            try:
+                js = read()
+                if not js or js.get("client_id") != self.client_id or js.get("token_url") != self.oauth_token_url:
+                    continue
+                expires_at = datetime.fromisoformat(js["expires_at"])
+            except Exception as e:
+                logger.warning(f"[auth] cached token unreadable source={name} err={e}")
+                continue
+            if now + timedelta(seconds=self.early_expiry_buffer) < expires_at:
+                self._access_token = js["access_token"]
+                self._expires_at = expires_at
+                logger.info(f"[auth] Reusing cached token source={name} expires_at={expires_at.isoformat()}")
+                return True
+        return False
+
+    def _store_cached_token(self):
+        """Best effort: persist the current token for later instances."""
+        payload = json.dumps({
+            "client_id": self.client_id,
+            "token_url": self.oauth_token_url,
+            "access_token": self._access_token,
+            "expires_at": self._expires_at.isoformat(),
+        })
+        try:
+            tmp = f"{_TOKEN_CACHE_PATH}.{os.getpid()}.{threading.get_ident()}"
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                f.write(payload)
+            os.replace(tmp, _TOKEN_CACHE_PATH)
+        except OSError as e:
+            logger.warning(f"[auth] token cache write failed path={_TOKEN_CACHE_PATH} err={e}")
+        param = os.getenv("ARUBA_TOKEN_SSM_PARAM")
+        if param:
+            try:
+                self._ssm().put_parameter(Name=param, Value=payload, Type="SecureString", Overwrite=True)
+            except Exception as e:
+                logger.warning(f"[auth] token SSM write failed param={param} err={e}")
+
+    @staticmethod
+    def _read_token_file() -> Optional[Dict[str, Any]]:
+        try:
+            with open(_TOKEN_CACHE_PATH, "rb") as f:
+                return _loads(f.read())
+        except FileNotFoundError:
+            return None
+
+    def _read_token_ssm(self) -> Optional[Dict[str, Any]]:
+        try:
+            resp = self._ssm().get_parameter(Name=os.environ["ARUBA_TOKEN_SSM_PARAM"], WithDecryption=True)
+        except Exception as e:
+            if type(e).__name__ == "ParameterNotFound":
+                return None
+            raise
+        return _loads(resp["Parameter"]["Value"])
+
+    @staticmethod
+    def _ssm():
+        from shared import clients  # Lambda layer; only needed when the SSM toggle is set
+        return clients.client("ssm")
 
     def _authenticate(self):
         if not self.client_secret:
@@ -376,7 +691,7 @@ class ArubaApiClient:
             )
             try:
                 raw = self._do_request(req)
-                js = json.loads(raw.decode())
+                js = _loads(raw)
                 return js
             except HTTPError as e:
                 body = e.read().decode(errors="ignore")
@@ -411,7 +726,7 @@ class ArubaApiClient:
             basic_headers = {
                 "Content-Type": "application/x-www-form-urlencoded",
                 "Accept": "application/json",
-                "Authorization": "Basic " + self._basic_auth_b64(self.client_id, self.client_secret)
+                "Authorization": "Basic " + self._base_auth_b64
             }
             data_basic = {
                 "grant_type": "client_credentials",
@@ -427,92 +742,212 @@ class ArubaApiClient:
         ttl = js.get("expires_in", 7200)
         self._expires_at = datetime.now(timezone.utc) + timedelta(seconds=ttl)
         logger.info(f"[auth] Authenticated; expires_at={self._expires_at.isoformat()} ttl={ttl}s token_url={self.oauth_token_url}")
+        self._store_cached_token()
 
     def _basic_auth_b64(self, client_id: str, client_secret: str) -> str:
-        import base64
         raw = f"{client_id}:{client_secret}".encode()
         return base64.b64encode(raw).decode()
 
     def _headers(self):
-        h = {"Accept": "application/json", "Authorization": f"Bearer {self._access_token}"}
-        if self.customer_id:
-            h["X-Customer-Id"] = self.customer_id
-        return h
+        """Request headers for the current token; rebuilt only when the token or customer id changes.
+
+        The returned dict is shared, so callers that add headers must copy it first.
+        """
+        key = (self._access_token, self.customer_id)
+        if key != self._headers_key:
+            h = {"Accept": "application/json", "Authorization": f"Bearer {self._access_token}"}
+            if self.customer_id:
+                h["X-Customer-Id"] = self.customer_id
+            self._headers_cached = h
+            self._headers_key = key
+        return self._headers_cached
+
+    def _do_request(self, req: urllib.request.Request, meta: bool = False):
+        """Send req with throttling, retries and 401 re-auth; returns the body bytes.
+
+        meta=True returns (status, headers, body) instead and reports 304 Not Modified
+        as a result rather than an error.
+        """
+        attempt = 1
+        while True:
+            self._throttle()
+            sent_at = time.monotonic()
+            try:
+                status, headers, body = self._send(req)
+                self._observe_rate_headers(headers)
+                self._record_outcome(time.monotonic() - sent_at, ok=True)
+                return (status, headers, body) if meta else body
+            except urllib.error.HTTPError as e:
+                self._observe_rate_headers(e.headers)
+                if meta and e.code == 304:
+                    self._record_outcome(time.monotonic() - sent_at, ok=True)
+                    return 304, e.headers, b""
+                body = e.read().decode(errors="ignore")
+                status = e.code
+                retriable = status in (429, 500, 502, 503, 504)
+                if retriable:
+                    self._record_outcome(time.monotonic() - sent_at, ok=False)
+                # Special-case 401 invalid access token on API calls: re-auth once, then retry
+                if status == 401 and attempt == 1 and (req.get_header("Authorization") or "").startswith("Bearer "):
+                    lowered = body.lower()
+                    if "invalid access token" in lowered or "unauthorized" in lowered:
+                        stale = req.get_header("Authorization")
+                        try:
+                            with self._token_lock:
+                                # Another worker may already have replaced the rejected token
+                                if self._headers()["Authorization"] == stale:
+                                    self._access_token = None
+                                    self._expires_at = None
+                                    self._authenticate()
+                        except Exception as reauth_err:
+                            raise RuntimeError(f"[auth] re-auth after 401 failed err={reauth_err}")
+                        # Keep the original headers (conditional validators included); swap only the token
+                        headers = dict(req.header_items())
+                        headers["Authorization"] = self._headers()["Authorization"]
+                        req = urllib.request.Request(req.full_url, data=req.data, headers=headers, method=req.get_method())
+                        attempt += 1
+                        continue
+                if status == 429:
+                    # Honor Retry-After if present
+                    retry_after = e.headers.get("Retry-After")
+                    if retry_after:
+                        try:
+                            delay = float(retry_after)
+                        except ValueError:
+                            delay = 5.0
+                    else:
+                        # exponential backoff with cap
+                        delay = min( (2 ** (attempt - 1)) * self.min_interval * 2, self.max_backoff)
+                    logger.warning(f"[rate] 429 attempt={attempt} delay={delay}s url={req.full_url}")
+                    time.sleep(delay)
+                else:
+                    logger.warning(f"[http] {status} attempt={attempt} retriable={retriable} url={req.full_url} body={body[:300]}")
+                if retriable and attempt < self.max_retries:
+                    if status != 429:  # 429 already slept
+                        time.sleep(min( (2 ** (attempt - 1)) * self.min_interval, self.max_backoff))
+                    attempt += 1
+                    continue
+                raise
+            except urllib.error.URLError as e:
+                if attempt < self.max_retries:
+                    backoff = min( (2 ** (attempt - 1)) * self.min_interval, self.max_backoff)
+                    logger.warning(f"[net] URLError retry attempt={attempt} backoff={backoff}s err={e}")
+                    time.sleep(backoff)
+                    attempt += 1
+                    continue
+                raise
 
-    def _do_request(self, req: urllib.request.Request, attempt: int = 1):
-        # Simple token bucket: enforce min interval
+    def _record_outcome(self, latency: float, ok: bool):
+        """AIMD on min_interval: multiplicative increase on 429/5xx, additive decrease
+        while the recent window is error-free and its mean latency is on target."""
+        with self._lock:
+            self._outcomes.append((latency, ok))
+            if not ok:
+                self.min_interval = min(self._aimd_ceil, self.min_interval * self._aimd_beta)
+                return
+            if len(self._outcomes) < self._outcomes.maxlen or not all(o for _, o in self._outcomes):
+                return
+            if sum(l for l, _ in self._outcomes) / len(self._outcomes) <= self._target_latency:
+                self.min_interval = max(self._aimd_floor, self.min_interval - self._aimd_alpha)
+
+    def _throttle(self):
+        """Block until a request may be sent: min interval plus a 60s sliding window cap.
+
+        Each caller reserves the next free send slot under the lock and sleeps
+        outside it, so concurrent workers queue up without holding the lock.
+        """
         with self._lock:
-            now = time.time()
-            wait = self.min_interval - (now - self._last_request_ts)
-            if wait > 0:
-                time.sleep(wait)
-            self._last_request_ts = time.time()
+            now = time.monotonic()
+            window_start = now - 60.0
+            while self._req_times and self._req_times[0] <= window_start:
+                self._req_times.popleft()
+            slot = max(now, self._next_allowed)
+            if len(self._req_times) >= self._rpm_cap:
+                # Slot times are non-decreasing, so this is when the window has room again
+                slot = max(slot, self._req_times[-self._rpm_cap] + 60.0)
+            self._next_allowed = slot + self.min_interval
+            self._req_times.append(slot)
+        wait = slot - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+
+    def _observe_rate_headers(self, headers):
+        """Tighten the per-minute cap when the server reports <10% quota left, relax it above 50%."""
+        if not headers:
+            return
+        remaining = limit = None
+        for suffix in ("", "-second", "-minute"):
+            r = headers.get(f"X-RateLimit-Remaining{suffix}")
+            if r is not None:
+                remaining, limit = r, headers.get(f"X-RateLimit-Limit{suffix}")
+                break
         try:
+            remaining = int(remaining)
+            limit = int(limit)
+        except (TypeError, ValueError):
+            return
+        if limit <= 0:
+            return
+        with self._lock:
+            if remaining < limit * 0.1:
+                new_cap = max(self._rpm_floor, self._rpm_cap // 2)
+                if new_cap < self._rpm_cap:
+                    logger.warning(f"[rate] quota low remaining={remaining}/{limit}; rpm_cap {self._rpm_cap}->{new_cap}")
+                    self._rpm_cap = new_cap
+            elif remaining >= limit * 0.5:
+                self._rpm_cap = self._rpm_max
+
+    def _send(self, req: urllib.request.Request):
+        """Perform one HTTP exchange, returning (status, headers, body).
+
+        Prefers the shared HTTP/2 client, then pooled urllib3 connections, then
+        urllib; in every case non-2xx responses raise urllib.error.HTTPError and
+        transport failures raise urllib.error.URLError, as urlopen would.
+        """
+        if self._http2 is not None:
+            try:
+                resp = self._http2.request(
+                    req.get_method(),
+                    req.full_url,
+                    content=req.data,
+                    headers=dict(req.header_items()),
+                    timeout=self.request_timeout,
+                )
+            except httpx.HTTPError as e:
+                raise urllib.error.URLError(e)
+            if resp.status_code >= 300:
+                raise urllib.error.HTTPError(req.full_url, resp.status_code, resp.reason_phrase, resp.headers, io.BytesIO(resp.content))
+            return resp.status_code, resp.headers, resp.content
+        if self._http is None:
             with urllib.request.urlopen(req, timeout=self.request_timeout) as resp:
-                return resp.read()
-        except urllib.error.HTTPError as e:
-            body = e.read().decode(errors="ignore")
-            status = e.code
-            retriable = status in (429, 500, 502, 503, 504)
-            # Special-case 401 invalid access token: force re-auth once then retry
-            if status == 401 and attempt == 1:
-                # Try to parse error code to ensure it's an auth token problem
-                lowered = body.lower()
-                if "invalid access token" in lowered or "unauthorized" in lowered:
-                    try:
-                        # Clear tokens and re-authenticate
-                        self._access_token = None
-                        self._expires_at = None
-                        self._authenticate()
-                        # Rebuild headers with new token
-                        new_req = urllib.request.Request(req.full_url, headers=self._headers(), method=getattr(req, 'method', None))
-                        result = self._do_request(new_req, attempt + 1)
-                        if result is None:
-                            raise RuntimeError(f"[auth] Token refresh succeeded but retry returned None for url={req.full_url}")
-                        return result
-                    except Exception as reauth_err:
-                        raise RuntimeError(f"[auth] re-auth after 401 failed err={reauth_err}")
-            if status == 429:
-                # Honor Retry-After if present
-                retry_after = e.headers.get("Retry-After")
-                if retry_after:
-                    try:
-                        delay = float(retry_after)
-                    except ValueError:
-                        delay = 5.0
-                else:
-                    # exponential backoff with cap
-                    delay = min( (2 ** (attempt - 1)) * self.min_interval * 2, self.max_backoff)
-                logger.warning(f"[rate] 429 attempt={attempt} delay={delay}s url={req.full_url}")
-                time.sleep(delay)
-                # Increase base interval slightly to reduce future 429s
-                self.min_interval = min(self.min_interval * 1.25, 5.0)
-            else:
-                logger.warning(f"[http] {status} attempt={attempt} retriable={retriable} url={req.full_url} body={body[:300]}")
-            if retriable and attempt < self.max_retries:
-                backoff = min( (2 ** (attempt - 1)) * self.min_interval, self.max_backoff)
-                if status != 429:  # 429 already slept
-                    time.sleep(backoff)
-                return self._do_request(req, attempt + 1)
-            raise
-        except urllib.error.URLError as e:
-            if attempt < self.max_retries:
-                backoff = min( (2 ** (attempt - 1)) * self.min_interval, self.max_backoff)
-                logger.warning(f"[net] URLError retry attempt={attempt} backoff={backoff}s err={e}")
-                time.sleep(backoff)
-                return self._do_request(req, attempt + 1)
-            raise
+                return resp.status, resp.headers, resp.read()
+        try:
+            resp = self._http.request(
+                req.get_method(),
+                req.full_url,
+                body=req.data,
+                headers=dict(req.header_items()),
+                timeout=self.request_timeout,
+            )
+        except urllib3.exceptions.HTTPError as e:
+            raise urllib.error.URLError(e)
+        if resp.status >= 300:
+            raise urllib.error.HTTPError(req.full_url, resp.status, resp.reason, resp.headers, io.BytesIO(resp.data))
+        return resp.status, resp.headers, resp.data
 
     def _get_json(self, endpoint: str, params: Dict[str, Any] = None):
-        self._ensure_token()
         url = f"{self.base_url}{endpoint}"
         if params:
             qs = urllib.parse.urlencode(params, doseq=True)
             url = f"{url}?{qs}"
+        return self._get_json_url(url)
+
+    def _get_json_url(self, url: str):
+        self._ensure_token()
         req = urllib.request.Request(url, headers=self._headers())
         raw = self._do_request(req)
         try:
-            return json.loads(raw.decode())
+            return _loads(raw)
         except json.JSONDecodeError:
             logger.error(f"[parse] Failed to parse JSON from {url}")
             return {}
@@ -522,9 +957,11 @@ class ArubaApiClient:
         base_params = dict(base_params or {})
         collected: List[Dict[str, Any]] = []
         offset = 0
+        # Everything but the offset is constant across pages; encode it once
+        fixed_qs = urllib.parse.urlencode({**base_params, "limit": self.page_limit}, doseq=True)
+        page_prefix = f"{self.base_url}{endpoint}?{fixed_qs}&offset="
         while True:
-            params = {**base_params, "limit": self.page_limit, "offset": offset}
-            js = self._get_json(endpoint, params)
+            js = self._get_json_url(f"{page_prefix}{offset}")
             if not isinstance(js, dict):
                 break
             items = None
@@ -0,0 +1,72 @@
+"""
+Repository and API client construction shared by the ingestion handlers.
+
+Each handler's _init() calls get_db() / get_api(); both are built once per
+sandbox from the Secrets Manager cache in the shared layer and reused by
+warm invocations. db and api_client are imported on first use so a handler
+only pays for what it builds.
+"""
+
+import os, logging
+from shared.clients import get_secret, prefetch_secrets
+
+logger = logging.getLogger(__name__)
+
+_REQUIRED_ENV = ("DB_SECRET_ARN", "ARUBA_API_SECRET_ARN")
+
+_db = None
+_api = None
+
+
+def _secret(env_key: str, label: str, required_keys) -> dict:
+    missing = [k for k in _REQUIRED_ENV if not os.getenv(k)]
+    if missing:
+        raise RuntimeError(f"Missing env vars {missing}")
+    # One BatchGetSecretValue for both secrets on a cold start; a no-op once cached
+    prefetch_secrets([os.environ[k] for k in _REQUIRED_ENV])
+    secret = get_secret(os.environ[env_key])
+    for key in required_keys:
+        if key not in secret:
+            raise RuntimeError(f"{label} secret missing '{key}'")
+    return secret
+
+
+def get_db():
+    """Connected MySqlRepository with the schema ensured; created on first call."""
+    global _db
+    if _db is None:
+        from db import MySqlRepository
+        db_secret = _secret("DB_SECRET_ARN", "DB", ("host", "username", "password"))
+        db = MySqlRepository(
+            # DB_HOST points at the RDS Proxy endpoint when deployed; the secret's host is the instance
+            host=os.getenv("DB_HOST") or db_secret["host"],
+            port=int(db_secret.get("port", 3306)),
+            user=db_secret["username"],
+            password=db_secret["password"],
+            database=db_secret.get("dbname", "aruba_central"),
+            ssl=os.getenv("DB_SSL", "false").lower() == "true",
+        )
+        db.connect()
+        db.ensure_schema()
+        _db = db
+        logger.info("[init] DB ready")
+    return _db
+
+
+def get_api():
+    """ArubaApiClient configured from the API secret; created on first call."""
+    global _api
+    if _api is None:
+        from api_client import ArubaApiClient
+        api_secret = _secret("ARUBA_API_SECRET_ARN", "API", ("baseUrl", "clientSecret"))
+        _api = ArubaApiClient(
+            client_id=api_secret.get("clientId"),
+            client_secret=api_secret["clientSecret"],
+            customer_id=api_secret.get("customerId"),
+            base_url=api_secret["baseUrl"],
+            oauth_token_url=api_secret.get("oauthTokenUrl"),
+            page_limit=int(os.getenv("ARUBA_PAGE_SIZE", "100")),
+            page_delay_seconds=float(os.getenv("ARUBA_PAGE_DELAY_SECONDS", "0.25"))
+        )
+        logger.info("[init] API client ready")
+    return _api
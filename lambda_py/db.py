@@ -1,3 +1,10 @@
+# device_status and clients are partitioned by day on created_at (UTC); daily
+# partitions are split off p_init and expired by rotate_partitions.
+# Readers of these history tables must bound created_at (and lastSeenAt where
+# they filter on it) from below: the bound lets MySQL prune partitions and use
+# the (_site_id, lastSeenAt) indexes instead of scanning all history. See
+# get_recent_clients / get_recent_device_status.
+
 # Device status table
 CREATE_DEVICE_STATUS_STMT = """
 CREATE TABLE IF NOT EXISTS device_status (
@@ -20,16 +27,17 @@ CREATE TABLE IF NOT EXISTS device_status (
     persona VARCHAR(64) DEFAULT NULL,
     deviceFunction VARCHAR(64) DEFAULT NULL,
     uptimeInMillis BIGINT DEFAULT NULL,
-    lastSeenAt DATETIME DEFAULT NULL,
-    configLastModifiedAt DATETIME DEFAULT NULL,
-    created_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP,
+    lastSeenAt TIMESTAMP NULL DEFAULT NULL,
+    configLastModifiedAt TIMESTAMP NULL DEFAULT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-    PRIMARY KEY (id),
+    PRIMARY KEY (id, created_at),
     KEY idx_dev_site (_site_id, deviceId),
-    KEY idx_dev_site_status (_site_id, status),
+    KEY idx_dev_site_status_lastSeen (_site_id, status, lastSeenAt),
     KEY idx_dev_site_lastSeen (_site_id, lastSeenAt),
     KEY idx_dev_site_created (_site_id, created_at)
-) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci
+PARTITION BY RANGE (UNIX_TIMESTAMP(created_at)) (PARTITION p_init VALUES LESS THAN MAXVALUE);
 """
 
 # Clients table
@@ -57,16 +65,18 @@ CREATE TABLE IF NOT EXISTS clients (
     role VARCHAR(100) DEFAULT NULL,
     port VARCHAR(64) DEFAULT NULL,
     keyManagement VARCHAR(100) DEFAULT NULL,
-    connectedSince DATETIME DEFAULT NULL,
-    lastSeenAt DATETIME DEFAULT NULL,
-    created_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP,
+    connectedSince TIMESTAMP NULL DEFAULT NULL,
+    lastSeenAt TIMESTAMP NULL DEFAULT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-    PRIMARY KEY (id),
+    PRIMARY KEY (id, created_at),
     KEY idx_site_mac (_site_id, mac),
     KEY idx_site_lastSeenAt (_site_id, lastSeenAt),
     KEY idx_site_connectedSince (_site_id, connectedSince),
+    KEY idx_site_status_lastSeen (_site_id, status, lastSeenAt),
     KEY idx_site_created (_site_id, created_at)
-) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci
+PARTITION BY RANGE (UNIX_TIMESTAMP(created_at)) (PARTITION p_init VALUES LESS THAN MAXVALUE);
 """
 
 # Switch interface details table
@@ -76,8 +86,8 @@ CREATE TABLE IF NOT EXISTS switch_interfacedetails (
     _site_id VARCHAR(128) DEFAULT NULL,
     _site_name VARCHAR(255) DEFAULT NULL,
     switch_serial VARCHAR(64) DEFAULT NULL,
-    created_at DATETIME DEFAULT NULL,
-    updated_at DATETIME DEFAULT NULL,
+    created_at TIMESTAMP NULL DEFAULT NULL,
+    updated_at TIMESTAMP NULL DEFAULT NULL,
     neighbourPort VARCHAR(64) DEFAULT NULL,
     neighbourFamily VARCHAR(64) DEFAULT NULL,
     `index` INT DEFAULT NULL,
@@ -127,16 +137,109 @@ CREATE TABLE IF NOT EXISTS switch_interfacedetails (
     portError VARCHAR(128) DEFAULT NULL,
     neighbour VARCHAR(128) DEFAULT NULL,
     neighbourFunction VARCHAR(64) DEFAULT NULL,
-    PRIMARY KEY (_id)
+    PRIMARY KEY (_id),
+    KEY idx_sw_site_serial (_site_id, switch_serial, name),
+    KEY idx_sw_serial_name (switch_serial, name),
+    KEY idx_sw_site_oper (_site_id, operStatus, adminStatus)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 """
+
+# Latest-row-per-entity rollups of device_status / clients, upserted alongside
+# each snapshot insert so "current state" reads are a primary-key lookup
+# instead of a MAX(created_at) scan over history
+CREATE_DEVICE_STATUS_CURRENT_STMT = """
+CREATE TABLE IF NOT EXISTS device_status_current (
+    deviceId VARCHAR(64) NOT NULL,
+    _site_id VARCHAR(64) DEFAULT NULL,
+    serialNumber VARCHAR(64) DEFAULT NULL,
+    deviceName VARCHAR(255) DEFAULT NULL,
+    status VARCHAR(32) DEFAULT NULL,
+    lastSeenAt TIMESTAMP NULL DEFAULT NULL,
+    updated_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (deviceId),
+    KEY idx_devcur_site_status (_site_id, status)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+"""
+
+CREATE_CLIENTS_CURRENT_STMT = """
+CREATE TABLE IF NOT EXISTS clients_current (
+    mac VARCHAR(17) NOT NULL,
+    _site_id VARCHAR(64) NOT NULL,
+    name VARCHAR(255) DEFAULT NULL,
+    status VARCHAR(50) DEFAULT NULL,
+    connectedDeviceSerial VARCHAR(64) DEFAULT NULL,
+    lastSeenAt TIMESTAMP NULL DEFAULT NULL,
+    updated_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (mac, _site_id),
+    KEY idx_clicur_site_status (_site_id, status)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+"""
+
+# Site id -> name lookup, refreshed from every snapshot batch so readers can
+# resolve site names without depending on the per-row _site_name copies
+CREATE_SITES_STMT = """
+CREATE TABLE IF NOT EXISTS sites (
+    _site_id VARCHAR(128) NOT NULL,
+    name VARCHAR(255) DEFAULT NULL,
+    updated_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (_site_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+"""
+_SITES_UPSERT_PREFIX = "INSERT INTO sites (_site_id, name) VALUES "
+_SITES_UPSERT_SUFFIX = " ON DUPLICATE KEY UPDATE name=VALUES(name)"
+
+import atexit
 import logging
+from contextlib import contextmanager
 from typing import Dict, Any
 import pymysql
 import os
+import re
+import tempfile
+import time
+from functools import lru_cache
+from itertools import chain
+from operator import itemgetter
+from datetime import datetime, timedelta, timezone
+
+try:
+    # mysqlclient (libmysqlclient C bindings): used instead of PyMySQL when it is
+    # present in the deployment, as its protocol handling and escaping are native
+    import MySQLdb  # type: ignore
+    import MySQLdb.cursors  # type: ignore
+except ImportError:
+    MySQLdb = None  # type: ignore
 
 logger = logging.getLogger(__name__)
 
+# Tables created by ensure_schema, and the (host, port, database) targets it
+# has already verified in this process (survives warm invocations)
+_SCHEMA_TABLES = (
+    "ap", "ap_radio", "ap_wlan", "ap_port", "ap_modem", "device_status", "clients", "switch_interfacedetails",
+    "device_status_current", "clients_current", "sites",
+)
+_SCHEMA_ENSURED: set = set()
+
+# Idle connections keyed by (host, port, user, database). close() parks a
+# connection here and connect() reuses it after a ping, so warm invocations
+# skip the TCP/TLS/auth handshake.
+_CONN_CACHE: Dict[tuple, Any] = {}
+
+# Run by the driver on every new connection (see connect())
+_SESSION_INIT = "SET time_zone = '+00:00'"
+
+
+def _close_cached_connections():
+    while _CONN_CACHE:
+        _, conn = _CONN_CACHE.popitem()
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+atexit.register(_close_cached_connections)
+
 ClientRecord = Dict[str, Any]
 
 
@@ -157,6 +260,9 @@ CREATE TABLE IF NOT EXISTS ap (
     uptime BIGINT DEFAULT NULL,
     cluster_name VARCHAR(255) DEFAULT NULL,
     public_ip VARCHAR(45) DEFAULT NULL,
+    detail_etag VARCHAR(255) DEFAULT NULL,
+    detail_last_modified VARCHAR(64) DEFAULT NULL,
+    list_modified_ms BIGINT DEFAULT NULL,
     created_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
     PRIMARY KEY (id),
@@ -165,6 +271,18 @@ CREATE TABLE IF NOT EXISTS ap (
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 """
 
+# Column order for AP row tuples (see insert_ap_row)
+AP_COLUMNS = (
+    "serial", "name", "mac_address", "ip_address", "model", "status", "site_id", "site_name",
+    "sw_version", "uptime", "cluster_name", "public_ip", "detail_etag", "detail_last_modified",
+)
+_AP_UPSERT_SQL = (
+    f"INSERT INTO ap ({', '.join(AP_COLUMNS)}) VALUES ({', '.join(['%s'] * len(AP_COLUMNS))}) "
+    "ON DUPLICATE KEY UPDATE "
+    + ", ".join(f"{col}=VALUES({col})" for col in AP_COLUMNS[1:])
+    + ", updated_at=NOW()"
+)
+
 CREATE_AP_RADIO_STMT = """
 CREATE TABLE IF NOT EXISTS ap_radio (
     id BIGINT NOT NULL AUTO_INCREMENT,
@@ -181,7 +299,10 @@ CREATE TABLE IF NOT EXISTS ap_radio (
     spatial_stream VARCHAR(16) DEFAULT NULL,
     power INT DEFAULT NULL,
     created_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    generation_id BIGINT NOT NULL DEFAULT 0,
     PRIMARY KEY (id),
+    UNIQUE KEY uk_ap_radio (ap_serial, radio_index),
     KEY fk_ap_radio_ap_serial (ap_serial),
     CONSTRAINT fk_ap_radio_ap_serial FOREIGN KEY (ap_serial) REFERENCES ap (serial)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
@@ -198,7 +319,10 @@ CREATE TABLE IF NOT EXISTS ap_wlan (
     vlan VARCHAR(16) DEFAULT NULL,
     status VARCHAR(16) DEFAULT NULL,
     created_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    generation_id BIGINT NOT NULL DEFAULT 0,
     PRIMARY KEY (id),
+    UNIQUE KEY uk_ap_wlan (ap_serial, bssid),
     KEY fk_ap_wlan_ap_serial (ap_serial),
     CONSTRAINT fk_ap_wlan_ap_serial FOREIGN KEY (ap_serial) REFERENCES ap (serial)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
@@ -220,7 +344,10 @@ CREATE TABLE IF NOT EXISTS ap_port (
     duplex VARCHAR(16) DEFAULT NULL,
     connector VARCHAR(16) DEFAULT NULL,
     created_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    generation_id BIGINT NOT NULL DEFAULT 0,
     PRIMARY KEY (id),
+    UNIQUE KEY uk_ap_port (ap_serial, port_index),
     KEY fk_ap_port_ap_serial (ap_serial),
     CONSTRAINT fk_ap_port_ap_serial FOREIGN KEY (ap_serial) REFERENCES ap (serial)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
@@ -243,36 +370,278 @@ CREATE TABLE IF NOT EXISTS ap_modem (
     bandwidth VARCHAR(16) DEFAULT NULL,
     band VARCHAR(16) DEFAULT NULL,
     created_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    generation_id BIGINT NOT NULL DEFAULT 0,
     PRIMARY KEY (id),
+    UNIQUE KEY uk_ap_modem (ap_serial),
     KEY fk_ap_modem_ap_serial (ap_serial),
     CONSTRAINT fk_ap_modem_ap_serial FOREIGN KEY (ap_serial) REFERENCES ap (serial)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 """
 
+# AP child tables: data columns (after ap_serial) and the natural key columns
+# that identify a row within one AP. sync_ap_children upserts on those keys,
+# stamping generation_id, then deletes the AP's rows from older generations.
+AP_CHILD_COLUMNS = {
+    "radio": ("radio_index", "mac_address", "band", "channel", "bandwidth", "status", "radio_number",
+              "mode", "antenna", "spatial_stream", "power"),
+    "wlan": ("wlan_name", "security", "security_level", "bssid", "vlan", "status"),
+    "port": ("port_name", "port_index", "mac_address", "status", "vlan_mode", "allowed_vlan", "native_vlan",
+             "access_vlan", "speed", "duplex", "connector"),
+    "modem": ("manufacturer", "sim_state", "status", "state", "model", "imei", "imsi", "iccid",
+              "firmware_version", "access_technology", "bandwidth", "band"),
+}
+_AP_CHILD_KEYS = {"radio": ("radio_index",), "wlan": ("bssid",), "port": ("port_index",), "modem": ()}
+_AP_CHILD_UPSERT_SQL = {
+    kind: (
+        f"INSERT INTO ap_{kind} (ap_serial, {', '.join(cols)}, generation_id) "
+        f"VALUES ({', '.join(['%s'] * (len(cols) + 2))}) "
+        "ON DUPLICATE KEY UPDATE "
+        + ", ".join(f"{c}=VALUES({c})" for c in cols if c not in _AP_CHILD_KEYS[kind])
+        + ", generation_id=VALUES(generation_id), updated_at=NOW()"
+    )
+    for kind, cols in AP_CHILD_COLUMNS.items()
+}
+_AP_CHILD_DELETE_OLDER_SQL = {
+    kind: f"DELETE FROM ap_{kind} WHERE ap_serial = %s AND generation_id < %s" for kind in AP_CHILD_COLUMNS
+}
+
+
+def _modem_row(modem: dict) -> dict:
+    """Map an API modem object onto AP_CHILD_COLUMNS["modem"]."""
+    return {
+        "manufacturer": modem.get("manufacturer"),
+        "sim_state": modem.get("simState"),
+        "status": modem.get("status"),
+        "state": modem.get("state"),
+        "model": modem.get("model"),
+        "imei": modem.get("imei"),
+        "imsi": modem.get("imsi"),
+        "iccid": modem.get("iccid"),
+        "firmware_version": modem.get("firmwareVersion"),
+        "access_technology": modem.get("accessTechnology"),
+        "bandwidth": modem.get("bandwidth"),
+        "band": modem.get("band"),
+    }
+
+# Column order for the bulk snapshot inserts; each INSERT prefix and per-row
+# VALUES group is built once here and repeated per row by _bulk_insert.
+DEVICE_STATUS_COLUMNS = (
+    '_site_id', '_site_name', 'deviceId', 'serialNumber', 'macAddress', 'deviceName', 'model', 'partNumber',
+    'status', 'softwareVersion', 'ipv4', 'ipv6', 'role', 'deviceType', 'deployment', 'persona', 'deviceFunction',
+    'uptimeInMillis', 'lastSeenAt', 'configLastModifiedAt'
+)
+CLIENT_COLUMNS = (
+    'mac', '_site_id', '_site_name', 'name', 'status', 'experience', 'statusReason', 'capabilities',
+    'authentication', 'type', 'ipv4', 'ipv6', 'vlanId', 'network', 'connectedDeviceSerial',
+    'connectedTo', 'tunnelId', 'tunnel', 'role', 'port', 'keyManagement', 'connectedSince', 'lastSeenAt'
+)
+SWITCH_INTERFACE_COLUMNS = (
+    '_site_id', '_site_name', 'switch_serial', 'created_at', 'updated_at',
+    'neighbourPort', 'neighbourFamily', 'index', 'vlanMode', 'module', 'nativeVlan',
+    'neighbourSerial', 'speed', 'isMultipleNeighbourClients', 'duplex', 'name', 'connector',
+    'type', 'transceiverStatus', 'stpInstanceType', 'stpInstanceId', 'stpPortRole', 'stpPortState',
+    'stpPortInconsistent', 'transceiverState', 'ipv4', 'transceiverProductNumber', 'transceiverModel',
+    'transceiverSerial', 'errorReason', 'adminStatus', 'operStatus', 'mtu', 'status', 'transceiverType',
+    'neighbourType', 'neighbourHealth', 'neighbourRole', 'lag', 'allowedVlans', 'allowedVlanIds',
+    'poeStatus', 'alias', 'description', 'poeClass', 'portAlignment', 'serial', 'id', 'peerPort',
+    'peerMemberId', 'uplink', 'portError', 'neighbour', 'neighbourFunction'
+)
+
+
+def _insert_prefix(table: str, cols: tuple) -> str:
+    return f"INSERT INTO {table} ({','.join(f'`{c}`' for c in cols)}) VALUES "
+
+
+def _values_group(cols: tuple) -> str:
+    return "(" + ",".join(["%s"] * len(cols)) + ")"
+
+
+@lru_cache(maxsize=None)
+def _row_getter(cols: tuple):
+    return itemgetter(*cols)
+
+
+@lru_cache(maxsize=256)
+def _multi_row_sql(prefix: str, group: str, n: int, suffix: str = "") -> str:
+    """`prefix` + `n` comma-joined `group`s + `suffix`; equal-sized chunks share one string."""
+    return prefix + ",".join([group] * n) + suffix
+
+
+def _flat_params(rows, cols: tuple) -> list:
+    """Row values in `cols` order, flattened across `rows` for one multi-row statement.
+
+    The normalizers emit every column, so the C-level itemgetter path is the
+    common case; a row missing a key falls back to dict.get (None) for the batch.
+    """
+    try:
+        return list(chain.from_iterable(map(_row_getter(cols), rows)))
+    except KeyError:
+        return list(chain.from_iterable(map(r.get, cols) for r in rows))
+
+
+DEVICE_STATUS_INSERT_PREFIX = _insert_prefix("device_status", DEVICE_STATUS_COLUMNS)
+CLIENT_INSERT_PREFIX = _insert_prefix("clients", CLIENT_COLUMNS)
+SWITCH_INTERFACE_INSERT_PREFIX = _insert_prefix("switch_interfacedetails", SWITCH_INTERFACE_COLUMNS)
+_DEVICE_STATUS_VALUES = _values_group(DEVICE_STATUS_COLUMNS)
+_CLIENT_VALUES = _values_group(CLIENT_COLUMNS)
+_SWITCH_INTERFACE_VALUES = _values_group(SWITCH_INTERFACE_COLUMNS)
+
+
+def _current_upsert(table: str, cols: tuple, key: tuple) -> tuple:
+    """(prefix, values group, cols, key, suffix) for a *_current rollup upsert.
+
+    A row only replaces the stored one when its lastSeenAt is not older, so a
+    late or replayed snapshot cannot roll the current state back. lastSeenAt
+    is assigned last because ON DUPLICATE KEY UPDATE assignments see the
+    values set before them.
+    """
+    newer = "(lastSeenAt IS NULL OR VALUES(lastSeenAt) >= lastSeenAt)"
+    updates = [f"{c}=IF({newer}, VALUES({c}), {c})" for c in cols if c not in key and c != "lastSeenAt"]
+    updates.append("lastSeenAt=IF(%s, VALUES(lastSeenAt), lastSeenAt)" % newer)
+    suffix = " ON DUPLICATE KEY UPDATE " + ", ".join(updates)
+    return _insert_prefix(table, cols), _values_group(cols), cols, key, suffix
+
+
+DEVICE_STATUS_CURRENT = _current_upsert(
+    "device_status_current",
+    ("deviceId", "_site_id", "serialNumber", "deviceName", "status", "lastSeenAt"),
+    ("deviceId",),
+)
+CLIENTS_CURRENT = _current_upsert(
+    "clients_current",
+    ("mac", "_site_id", "name", "status", "connectedDeviceSerial", "lastSeenAt"),
+    ("mac", "_site_id"),
+)
+
+
+def _insert_changed(table: str, cols: tuple, current_table: str, key: tuple) -> tuple:
+    """(prefix, row group, suffix) for a snapshot insert that skips unchanged rows.
+
+    The batch is bound as a VALUES table (MySQL 8.0.19+) and a row is only
+    inserted when its rollup row in `current_table` differs in status or
+    lastSeenAt, a primary-key probe per row instead of a history lookup.
+    """
+    names = ",".join(f"`{c}`" for c in cols)
+    match = " AND ".join(f"cur.`{k}` = s.`{k}`" for k in key)
+    return (
+        f"INSERT INTO {table} ({names}) SELECT * FROM (VALUES ",
+        "ROW(" + ",".join(["%s"] * len(cols)) + ")",
+        f") AS s ({names}) WHERE NOT EXISTS (SELECT 1 FROM {current_table} cur WHERE {match} "
+        "AND cur.status <=> s.status AND cur.lastSeenAt <=> s.lastSeenAt)",
+    )
+
+
+DEVICE_STATUS_INSERT_CHANGED = _insert_changed("device_status", DEVICE_STATUS_COLUMNS, "device_status_current", ("deviceId",))
+CLIENT_INSERT_CHANGED = _insert_changed("clients", CLIENT_COLUMNS, "clients_current", ("mac", "_site_id"))
+
+
+def _load_data_sql(table: str, cols: tuple) -> str:
+    """LOAD DATA LOCAL INFILE statement for a TSV written by _write_tsv (file path bound as %s)."""
+    names = ",".join(f"`{c}`" for c in cols)
+    return (
+        f"LOAD DATA LOCAL INFILE %s INTO TABLE {table} CHARACTER SET utf8mb4 "
+        "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' "
+        f"({names})"
+    )
+
+
+DEVICE_STATUS_LOAD_DATA = _load_data_sql("device_status", DEVICE_STATUS_COLUMNS)
+CLIENT_LOAD_DATA = _load_data_sql("clients", CLIENT_COLUMNS)
+
+_TSV_SPECIAL = re.compile(r"[\\\t\n\r\0]")
+_TSV_ESCAPES = {"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r", "\0": "\\0"}
+
+
+def _load_data_min_rows() -> int:
+    return int(os.getenv("ARUBA_DB_LOAD_DATA_MIN_ROWS", "0"))
+
+
+def _tsv_field(v) -> str:
+    if v is None:
+        return "\\N"
+    if isinstance(v, bool):
+        return "1" if v else "0"
+    if isinstance(v, datetime):
+        return v.isoformat(" ")
+    s = str(v)
+    if _TSV_SPECIAL.search(s):
+        s = _TSV_SPECIAL.sub(lambda m: _TSV_ESCAPES[m.group()], s)
+    return s
+
+
+def _write_tsv(f, rows, cols: tuple):
+    """Rows in `cols` order as LOAD DATA's default text format (NULL as \\N, backslash escapes)."""
+    get = _row_getter(cols)
+    for r in rows:
+        try:
+            vals = get(r)
+        except KeyError:
+            vals = map(r.get, cols)
+        f.write("\t".join(map(_tsv_field, vals)) + "\n")
+
+# Lookback readers (see get_recent_clients): site + lastSeenAt through the
+# matching index, with the created_at bound that enables partition pruning
+_RECENT_SQL = {
+    table: (
+        f"SELECT * FROM {table} FORCE INDEX ({index}) "
+        "WHERE _site_id = %s AND lastSeenAt >= NOW() - INTERVAL %s DAY "
+        "AND created_at >= NOW() - INTERVAL %s DAY ORDER BY lastSeenAt DESC"
+    )
+    for table, index in (("clients", "idx_site_lastSeenAt"), ("device_status", "idx_dev_site_lastSeen"))
+}
+
 class MySqlRepository:
-    def insert_device_status(self, rows):
+    def _bulk_insert(self, prefix: str, values_group: str, cols: tuple, rows, current: tuple = None,
+                     changed: tuple = None, load: str = None) -> int:
+        """Insert dict rows as one multi-row INSERT per chunk, committing once.
+
+        Chunks hold ARUBA_DB_INSERT_BATCH_SIZE rows (default 5000) so a large
+        batch stays well under max_allowed_packet. `current` (see
+        _current_upsert) also upserts each chunk into its rollup table in the
+        same transaction; rows missing a key column are left out of the rollup.
+        The batch's (_site_id, _site_name) pairs are upserted into sites.
+
+        Inside begin()/commit() the COMMIT is left to the caller.
+
+        With ARUBA_DB_SKIP_UNCHANGED=1 and a `changed` statement (see
+        _insert_changed), rows whose status and lastSeenAt match the rollup are
+        not written to history; the return value counts rows actually inserted.
+
+        With ARUBA_DB_LOAD_DATA_MIN_ROWS=N (> 0) and a `load` statement (see
+        _load_data_sql), a batch of at least N rows goes to history through one
+        LOAD DATA LOCAL INFILE from a /tmp TSV instead; the rollup and sites
+        upserts are unchanged. The server needs local_infile=ON.
+        """
         if not rows:
             return 0
         if not self.connection:
             self.connect()
-        batch_size = int(os.getenv("ARUBA_DB_INSERT_BATCH_SIZE", "0")) or len(rows)
-        cols = [
-            '_site_id', '_site_name', 'deviceId', 'serialNumber', 'macAddress', 'deviceName', 'model', 'partNumber',
-            'status', 'softwareVersion', 'ipv4', 'ipv6', 'role', 'deviceType', 'deployment', 'persona', 'deviceFunction',
-            'uptimeInMillis', 'lastSeenAt', 'configLastModifiedAt'
-        ]
-        col_list = ",".join([f"`{c}`" for c in cols])
-        placeholders = ",".join([f"%({c})s" for c in cols])
-        sql = f"INSERT INTO device_status ({col_list}) VALUES ({placeholders})"
-        def _prep(r): return {k: r.get(k) for k in cols}
+        batch_size = int(os.getenv("ARUBA_DB_INSERT_BATCH_SIZE", "0")) or 5000
+        if os.getenv("ARUBA_DB_SKIP_UNCHANGED", "0") != "1":
+            changed = None
+        load_min = _load_data_min_rows()
+        if not load or changed or not load_min or len(rows) < load_min:
+            load = None
         inserted = 0
         try:
-            with self.connection.cursor() as c:
+            with self.bulk_insert_context(), self._write_cursor() as c:
+                if load:
+                    self._load_data(c, load, cols, rows)
+                    inserted = len(rows)
                 for i in range(0, len(rows), batch_size):
-                    chunk = [_prep(r) for r in rows[i:i+batch_size]]
-                    c.executemany(sql, chunk)
-                    inserted += len(chunk)
-            self.connection.commit()
+                    chunk = rows[i:i+batch_size]
+                    if changed:
+                        ch_prefix, ch_row, ch_suffix = changed
+                        params = _flat_params(chunk, cols)
+                        inserted += c.execute(_multi_row_sql(ch_prefix, ch_row, len(chunk), ch_suffix), params) or 0
+                    elif not load:
+                        c.execute(_multi_row_sql(prefix, values_group, len(chunk)), _flat_params(chunk, cols))
+                        inserted += len(chunk)
+                    if current:
+                        self._upsert_current(c, current, chunk)
+                self._upsert_sites(c, rows)
+            self._autocommit()
         except Exception:
             try:
                 self.connection.rollback()
@@ -281,48 +650,128 @@ class MySqlRepository:
             raise
         return inserted
 
-    def insert_clients(self, rows):
-        if not rows:
-            return 0
-        if not self.connection:
-            self.connect()
-        batch_size = int(os.getenv("ARUBA_DB_INSERT_BATCH_SIZE", "0")) or len(rows)
-        cols = [
-            'mac', '_site_id', '_site_name', 'name', 'status', 'experience', 'statusReason', 'capabilities',
-            'authentication', 'type', 'ipv4', 'ipv6', 'vlanId', 'network', 'connectedDeviceSerial',
-            'connectedTo', 'tunnelId', 'tunnel', 'role', 'port', 'keyManagement', 'connectedSince', 'lastSeenAt'
-        ]
-        col_list = ",".join([f"`{c}`" for c in cols])
-        placeholders = ",".join([f"%({c})s" for c in cols])
-        sql = f"INSERT INTO clients ({col_list}) VALUES ({placeholders})"
-        def _prep(r): return {k: r.get(k) for k in cols}
-        inserted = 0
+    @staticmethod
+    def _load_data(c, load: str, cols: tuple, rows):
+        fd, path = tempfile.mkstemp(suffix=".tsv")
         try:
-            with self.connection.cursor() as c:
-                for i in range(0, len(rows), batch_size):
-                    chunk = [_prep(r) for r in rows[i:i+batch_size]]
-                    c.executemany(sql, chunk)
-                    inserted += len(chunk)
-            self.connection.commit()
-        except Exception:
-            try:
-                self.connection.rollback()
-            except Exception:
-                pass
-            raise
-        return inserted
+            with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+                _write_tsv(f, rows, cols)
+            c.execute(load, (path,))
+        finally:
+            os.unlink(path)
+
+    @staticmethod
+    def _upsert_current(c, current: tuple, chunk):
+        cur_prefix, cur_values, cur_cols, cur_key, cur_suffix = current
+        keyed = [r for r in chunk if all(r.get(k) for k in cur_key)]
+        if keyed:
+            c.execute(_multi_row_sql(cur_prefix, cur_values, len(keyed), cur_suffix), _flat_params(keyed, cur_cols))
+
+    @staticmethod
+    def _upsert_sites(c, rows):
+        sites = {r["_site_id"]: r.get("_site_name") for r in rows if r.get("_site_id") and r.get("_site_name")}
+        if sites:
+            c.execute(
+                _multi_row_sql(_SITES_UPSERT_PREFIX, "(%s,%s)", len(sites), _SITES_UPSERT_SUFFIX),
+                list(chain.from_iterable(sites.items())),
+            )
+
+    @contextmanager
+    def bulk_insert_context(self):
+        """With ARUBA_DB_BULK_FAST=1, skip unique/foreign key checks for the enclosed writes.
+
+        The checks are restored on exit. Opt-in: rows written meanwhile are not
+        validated against those constraints, and the SETs pin RDS Proxy sessions.
+        """
+        if os.getenv("ARUBA_DB_BULK_FAST", "0") != "1":
+            yield
+            return
+        with self._write_cursor() as c:
+            c.execute("SET SESSION unique_checks=0, foreign_key_checks=0")
+        try:
+            yield
+        finally:
+            with self._write_cursor() as c:
+                c.execute("SET SESSION unique_checks=1, foreign_key_checks=1")
+
+    def _write_cursor(self):
+        """Tuple-row cursor (the connection default) for INSERT/UPDATE/DELETE."""
+        return self.connection.cursor()
+
+    def _read_cursor(self):
+        """Dict-row cursor for the few readers that look up columns by name."""
+        if isinstance(self.connection, pymysql.connections.Connection):
+            return self.connection.cursor(pymysql.cursors.DictCursor)
+        if MySQLdb is not None:
+            return self.connection.cursor(MySQLdb.cursors.DictCursor)
+        return self.connection.cursor()
+
+    def insert_device_status(self, rows):
+        return self._bulk_insert(DEVICE_STATUS_INSERT_PREFIX, _DEVICE_STATUS_VALUES, DEVICE_STATUS_COLUMNS, rows,
+                                 current=DEVICE_STATUS_CURRENT, changed=DEVICE_STATUS_INSERT_CHANGED,
+                                 load=DEVICE_STATUS_LOAD_DATA)
 
-    def __init__(self, host, port, user, password, database):
+    def insert_clients(self, rows):
+        return self._bulk_insert(CLIENT_INSERT_PREFIX, _CLIENT_VALUES, CLIENT_COLUMNS, rows,
+                                 current=CLIENTS_CURRENT, changed=CLIENT_INSERT_CHANGED,
+                                 load=CLIENT_LOAD_DATA)
+
+    def __init__(self, host, port, user, password, database, ssl=False):
         self.host = host
         self.port = port
         self.user = user
         self.password = password
         self.database = database
+        self.ssl = ssl
         self.connection = None
+        self._in_txn = False
 
     def connect(self):
         if self.connection:
             return
+        cached = _CONN_CACHE.pop(self._cache_key(), None)
+        if cached is not None:
+            try:
+                # reconnect passed positionally: mysqlclient's ping() takes no keywords
+                cached.ping(True)
+                self.connection = cached
+                return
+            except Exception:
+                try:
+                    cached.close()
+                except Exception:
+                    pass
+        # Bounded socket timeouts so a stalled proxy/DB fails the batch instead of the Lambda timeout
+        timeouts = {
+            "read_timeout": int(os.getenv("DB_READ_TIMEOUT_SEC", "30")),
+            "write_timeout": int(os.getenv("DB_WRITE_TIMEOUT_SEC", "60")),
+        }
+        # The history time columns are TIMESTAMP, converted through the session
+        # time_zone; pin it to UTC, which is what the handlers write
+        session = {"init_command": _SESSION_INIT}
+        if MySQLdb is not None and os.getenv("DB_DRIVER", "auto").lower() != "pymysql":
+            ssl_opts = {"ssl_mode": "VERIFY_IDENTITY", "ssl": {"ca": os.getenv("DB_SSL_CA", "/etc/pki/tls/certs/ca-bundle.crt")}} if self.ssl else {}
+            # zlib protocol compression (mysqlclient only; PyMySQL has none). Off by
+            # default because RDS Proxy does not support the compressed protocol.
+            compress_opts = {"compress": True} if os.getenv("DB_COMPRESS", "false").lower() == "true" else {}
+            # LOAD DATA LOCAL (ARUBA_DB_LOAD_DATA_MIN_ROWS) must be allowed client-side too
+            infile_opts = {"local_infile": 1} if _load_data_min_rows() > 0 else {}
+            self.connection = MySQLdb.connect(
+                host=self.host,
+                port=self.port,
+                user=self.user,
+                password=self.password,
+                database=self.database,
+                autocommit=False,
+                connect_timeout=10,
+                charset="utf8mb4",
+                **timeouts,
+                **session,
+                **compress_opts,
+                **infile_opts,
+                **ssl_opts,
+            )
+            return
         self.connection = pymysql.connect(
             host=self.host,
             port=self.port,
@@ -330,18 +779,80 @@ class MySqlRepository:
             password=self.password,
             database=self.database,
             autocommit=False,
-            cursorclass=pymysql.cursors.DictCursor,
             connect_timeout=10,
+            **timeouts,
+            **session,
+            # RDS Proxy requires TLS; its ACM certificate chains to the system trust store
+            ssl_verify_cert=True if self.ssl else None,
+            local_infile=_load_data_min_rows() > 0,
         )
 
-    def close(self):
-        if self.connection:
+    def _cache_key(self) -> tuple:
+        return (self.host, self.port, self.user, self.database)
+
+    def close(self, discard: bool = False):
+        """Release the connection to the process-wide cache (or really close it with discard=True)."""
+        if not self.connection:
+            return
+        conn, self.connection = self.connection, None
+        if self._in_txn:
+            self._in_txn = False
             try:
-                self.connection.close()
-            finally:
-                self.connection = None
+                conn.rollback()
+            except Exception:
+                discard = True
+        if not discard:
+            previous = _CONN_CACHE.get(self._cache_key())
+            _CONN_CACHE[self._cache_key()] = conn
+            if previous is None:
+                return
+            conn = previous
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def ping(self):
+        """Check a reused connection is still alive, reconnecting if the server dropped it."""
+        if not self.connection:
+            self.connect()
+            return
+        try:
+            self.connection.ping(True)
+        except Exception:
+            self.close(discard=True)
+            self.connect()
+
+    def begin(self):
+        """Open an explicit transaction; AP write methods defer COMMIT until commit()."""
+        if not self.connection:
+            self.connect()
+        if hasattr(self.connection, "begin"):
+            self.connection.begin()
+        else:  # MySQLdb connections have no begin()
+            self.connection.query("BEGIN")
+        self._in_txn = True
+
+    def commit(self):
+        self._in_txn = False
+        self.connection.commit()
+
+    def rollback(self):
+        self._in_txn = False
+        try:
+            self.connection.rollback()
+        except Exception:
+            pass
+
+    def _autocommit(self):
+        # Commit per statement unless the caller opened a transaction via begin()
+        if not self._in_txn:
+            self.connection.commit()
 
     def ensure_schema(self):
+        key = (self.host, self.port, self.database)
+        if key in _SCHEMA_ENSURED:
+            return
         if not self.connection:
             self.connect()
         # Create all required tables if they do not exist
@@ -353,12 +864,22 @@ class MySqlRepository:
             CREATE_AP_MODEM_STMT,
             CREATE_DEVICE_STATUS_STMT,
             CREATE_CLIENTS_STMT,
-            CREATE_SWITCH_INTERFACEDETAILS_STMT
+            CREATE_SWITCH_INTERFACEDETAILS_STMT,
+            CREATE_DEVICE_STATUS_CURRENT_STMT,
+            CREATE_CLIENTS_CURRENT_STMT,
+            CREATE_SITES_STMT,
         ]
         try:
-            with self.connection.cursor() as c:
-                for stmt in stmts:
-                    c.execute(stmt)
+            with self._read_cursor() as c:
+                # One lookup instead of a CREATE round-trip per table once the schema exists
+                c.execute(
+                    "SELECT COUNT(*) AS n FROM information_schema.TABLES "
+                    "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN (%s)" % ", ".join(["%s"] * len(_SCHEMA_TABLES)),
+                    _SCHEMA_TABLES,
+                )
+                if c.fetchone()["n"] < len(_SCHEMA_TABLES):
+                    for stmt in stmts:
+                        c.execute(stmt)
             self.connection.commit()
         except Exception:
             try:
@@ -366,35 +887,55 @@ class MySqlRepository:
             except Exception:
                 pass
             raise
+        _SCHEMA_ENSURED.add(key)
 
-    def insert_switch_interfacedetails(self, rows):
-        if not rows:
-            return 0
+    def rotate_partitions(self, table: str, retention_days: int = 0, days_ahead: int = 3) -> Dict[str, list]:
+        """Maintain daily pYYYYMMDD partitions (UTC) on a table partitioned like clients.
+
+        Splits partitions for today through `days_ahead` days out of p_init and,
+        when retention_days > 0, drops daily partitions older than that many
+        days, which removes their rows without a row-by-row DELETE.
+        Tables that are not partitioned are left alone.
+        """
         if not self.connection:
             self.connect()
-        batch_size = int(os.getenv("ARUBA_DB_INSERT_BATCH_SIZE", "0")) or len(rows)
-        cols = [
-            '_site_id', '_site_name', 'switch_serial', 'created_at', 'updated_at',
-            'neighbourPort', 'neighbourFamily', 'index', 'vlanMode', 'module', 'nativeVlan',
-            'neighbourSerial', 'speed', 'isMultipleNeighbourClients', 'duplex', 'name', 'connector',
-            'type', 'transceiverStatus', 'stpInstanceType', 'stpInstanceId', 'stpPortRole', 'stpPortState',
-            'stpPortInconsistent', 'transceiverState', 'ipv4', 'transceiverProductNumber', 'transceiverModel',
-            'transceiverSerial', 'errorReason', 'adminStatus', 'operStatus', 'mtu', 'status', 'transceiverType',
-            'neighbourType', 'neighbourHealth', 'neighbourRole', 'lag', 'allowedVlans', 'allowedVlanIds',
-            'poeStatus', 'alias', 'description', 'poeClass', 'portAlignment', 'serial', 'id', 'peerPort',
-            'peerMemberId', 'uplink', 'portError', 'neighbour', 'neighbourFunction'
-        ]
-        col_list = ",".join([f"`{c}`" for c in cols])
-        placeholders = ",".join([f"%({c})s" for c in cols])
-        sql = f"INSERT INTO switch_interfacedetails ({col_list}) VALUES ({placeholders})"
-        def _prep(r): return {k: r.get(k) for k in cols}
-        inserted = 0
+        today = datetime.now(timezone.utc).date()
+        added: list = []
+        dropped: list = []
         try:
-            with self.connection.cursor() as c:
-                for i in range(0, len(rows), batch_size):
-                    chunk = [_prep(r) for r in rows[i:i+batch_size]]
-                    c.executemany(sql, chunk)
-                    inserted += len(chunk)
+            with self._read_cursor() as c:
+                c.execute(
+                    "SELECT PARTITION_NAME AS name FROM information_schema.PARTITIONS "
+                    "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL",
+                    (table,),
+                )
+                names = {r["name"] for r in c.fetchall()}
+                if "p_init" not in names:
+                    logger.warning(f"[partitions] {table} is not partitioned; skipping rotation")
+                    self.connection.commit()
+                    return {"added": added, "dropped": dropped}
+                days = {datetime.strptime(n[1:], "%Y%m%d").date() for n in names if n != "p_init"}
+                last = max(days) if days else today - timedelta(days=1)
+                new_parts = []
+                day = max(last + timedelta(days=1), today)
+                while day <= today + timedelta(days=days_ahead):
+                    # Upper bound is the next UTC midnight, as an epoch to match UNIX_TIMESTAMP(created_at)
+                    bound = datetime(day.year, day.month, day.day, tzinfo=timezone.utc) + timedelta(days=1)
+                    name = f"p{day:%Y%m%d}"
+                    new_parts.append(f"PARTITION {name} VALUES LESS THAN ({int(bound.timestamp())})")
+                    added.append(name)
+                    day += timedelta(days=1)
+                if new_parts:
+                    c.execute(
+                        f"ALTER TABLE {table} REORGANIZE PARTITION p_init INTO ("
+                        + ", ".join(new_parts)
+                        + ", PARTITION p_init VALUES LESS THAN MAXVALUE)"
+                    )
+                if retention_days > 0:
+                    cutoff = today - timedelta(days=retention_days)
+                    dropped = sorted(f"p{d:%Y%m%d}" for d in days if d < cutoff)
+                    if dropped:
+                        c.execute(f"ALTER TABLE {table} DROP PARTITION {', '.join(dropped)}")
             self.connection.commit()
         except Exception:
             try:
@@ -402,33 +943,22 @@ class MySqlRepository:
             except Exception:
                 pass
             raise
-        return inserted
+        if added or dropped:
+            logger.info(f"[partitions] {table} added={added} dropped={dropped}")
+        return {"added": added, "dropped": dropped}
+
+    def insert_switch_interfacedetails(self, rows):
+        return self._bulk_insert(SWITCH_INTERFACE_INSERT_PREFIX, _SWITCH_INTERFACE_VALUES, SWITCH_INTERFACE_COLUMNS, rows)
 
     def insert_ap(self, ap: dict):
-        sql = """
-        INSERT INTO ap (serial, name, mac_address, ip_address, model, status, site_id, site_name, sw_version, uptime, cluster_name, public_ip)
-        VALUES (%(serial)s, %(name)s, %(mac_address)s, %(ip_address)s, %(model)s, %(status)s, %(site_id)s, %(site_name)s, %(sw_version)s, %(uptime)s, %(cluster_name)s, %(public_ip)s)
-        ON DUPLICATE KEY UPDATE
-          name=VALUES(name), mac_address=VALUES(mac_address), ip_address=VALUES(ip_address), model=VALUES(model), status=VALUES(status), site_id=VALUES(site_id), site_name=VALUES(site_name), sw_version=VALUES(sw_version), uptime=VALUES(uptime), cluster_name=VALUES(cluster_name), public_ip=VALUES(public_ip), updated_at=NOW()
-        """
-        data = {
-            "serial": ap.get("serial"),
-            "name": ap.get("name"),
-            "mac_address": ap.get("mac_address"),
-            "ip_address": ap.get("ip_address"),
-            "model": ap.get("model"),
-            "status": ap.get("status"),
-            "site_id": ap.get("site_id"),
-            "site_name": ap.get("site_name"),
-            "sw_version": ap.get("sw_version"),
-            "uptime": ap.get("uptime"),
-            "cluster_name": ap.get("cluster_name"),
-            "public_ip": ap.get("public_ip"),
-        }
+        self.insert_ap_row(tuple(ap.get(col) for col in AP_COLUMNS))
+
+    def insert_ap_row(self, row: tuple):
+        """Upsert one AP given a tuple ordered as AP_COLUMNS."""
         try:
-            with self.connection.cursor() as c:
-                c.execute(sql, data)
-            self.connection.commit()
+            with self._write_cursor() as c:
+                c.execute(_AP_UPSERT_SQL, row)
+            self._autocommit()
         except Exception:
             try:
                 self.connection.rollback()
@@ -436,114 +966,127 @@ class MySqlRepository:
                 pass
             raise
 
-    def delete_ap_radios(self, ap_serial: str):
-        sql = "DELETE FROM ap_radio WHERE ap_serial = %s"
-        with self.connection.cursor() as c:
-            c.execute(sql, (ap_serial,))
-        self.connection.commit()
+    def upsert_ap_with_children(self, ap_row: tuple, radios: list, wlans: list, ports: list, modem: dict = None):
+        """Write one AP and all of its child rows in a single transaction.
 
-    def insert_ap_radio(self, ap_serial: str, radio: dict):
-        sql = """
-        INSERT INTO ap_radio (ap_serial, radio_index, mac_address, band, channel, bandwidth, status, radio_number, mode, antenna, spatial_stream, power)
-        VALUES (%(ap_serial)s, %(radio_index)s, %(mac_address)s, %(band)s, %(channel)s, %(bandwidth)s, %(status)s, %(radio_number)s, %(mode)s, %(antenna)s, %(spatial_stream)s, %(power)s)
+        ap_row is ordered as AP_COLUMNS; each child list goes out as one
+        multi-row statement, and the whole AP costs one COMMIT. Child rows the
+        API no longer reports (including a removed modem) are deleted here.
         """
-        data = {
-            "ap_serial": ap_serial,
-            "radio_index": radio.get("radio_index"),
-            "mac_address": radio.get("mac_address"),
-            "band": radio.get("band"),
-            "channel": radio.get("channel"),
-            "bandwidth": radio.get("bandwidth"),
-            "status": radio.get("status"),
-            "radio_number": radio.get("radio_number"),
-            "mode": radio.get("mode"),
-            "antenna": radio.get("antenna"),
-            "spatial_stream": radio.get("spatial_stream"),
-            "power": radio.get("power"),
-        }
-        with self.connection.cursor() as c:
-            c.execute(sql, data)
-        self.connection.commit()
+        if not self.connection:
+            self.connect()
+        serial = ap_row[0]
+        gen = time.time_ns() // 1_000_000
+        self.begin()
+        try:
+            self.insert_ap_row(ap_row)
+            self.sync_ap_children(serial, "radio", radios, gen)
+            self.sync_ap_children(serial, "wlan", wlans, gen)
+            self.sync_ap_children(serial, "port", ports, gen)
+            self.sync_ap_children(serial, "modem", [_modem_row(modem)] if modem else [], gen)
+            self.commit()
+        except Exception:
+            self.rollback()
+            raise
 
-    def delete_ap_wlans(self, ap_serial: str):
-        sql = "DELETE FROM ap_wlan WHERE ap_serial = %s"
-        with self.connection.cursor() as c:
-            c.execute(sql, (ap_serial,))
-        self.connection.commit()
+    def sync_ap_children(self, ap_serial: str, kind: str, rows: list, gen: int) -> int:
+        """Upsert one AP's child rows of `kind` at generation `gen` and drop older ones.
 
-    def insert_ap_wlan(self, ap_serial: str, wlan: dict):
-        sql = """
-        INSERT INTO ap_wlan (ap_serial, wlan_name, security, security_level, bssid, vlan, status)
-        VALUES (%(ap_serial)s, %(wlan_name)s, %(security)s, %(security_level)s, %(bssid)s, %(vlan)s, %(status)s)
+        Unchanged rows are updated in place on their natural key instead of
+        being deleted and reinserted.
         """
-        data = {
-            "ap_serial": ap_serial,
-            "wlan_name": wlan.get("wlan_name"),
-            "security": wlan.get("security"),
-            "security_level": wlan.get("security_level"),
-            "bssid": wlan.get("bssid"),
-            "vlan": wlan.get("vlan"),
-            "status": wlan.get("status"),
-        }
-        with self.connection.cursor() as c:
-            c.execute(sql, data)
-        self.connection.commit()
+        self._upsert_ap_children(kind, ap_serial, rows, gen)
+        with self._write_cursor() as c:
+            c.execute(_AP_CHILD_DELETE_OLDER_SQL[kind], (ap_serial, gen))
+        self._autocommit()
+        return len(rows)
 
-    def delete_ap_ports(self, ap_serial: str):
-        sql = "DELETE FROM ap_port WHERE ap_serial = %s"
-        with self.connection.cursor() as c:
-            c.execute(sql, (ap_serial,))
-        self.connection.commit()
+    def _upsert_ap_children(self, kind: str, ap_serial: str, rows: list, gen: int = None) -> int:
+        if not rows:
+            return 0
+        if gen is None:
+            gen = time.time_ns() // 1_000_000
+        cols = AP_CHILD_COLUMNS[kind]
+        data = [(ap_serial, *(r.get(c) for c in cols), gen) for r in rows]
+        with self._write_cursor() as c:
+            c.executemany(_AP_CHILD_UPSERT_SQL[kind], data)
+        self._autocommit()
+        return len(data)
+
+    def insert_ap_radio(self, ap_serial: str, radio: dict):
+        return self.insert_ap_radios_bulk(ap_serial, [radio])
+
+    def insert_ap_radios_bulk(self, ap_serial: str, radios: list):
+        return self._upsert_ap_children("radio", ap_serial, radios)
+
+    def insert_ap_wlan(self, ap_serial: str, wlan: dict):
+        return self.insert_ap_wlans_bulk(ap_serial, [wlan])
+
+    def insert_ap_wlans_bulk(self, ap_serial: str, wlans: list):
+        return self._upsert_ap_children("wlan", ap_serial, wlans)
 
     def insert_ap_port(self, ap_serial: str, port: dict):
-        sql = """
-        INSERT INTO ap_port (ap_serial, port_name, port_index, mac_address, status, vlan_mode, allowed_vlan, native_vlan, access_vlan, speed, duplex, connector)
-        VALUES (%(ap_serial)s, %(port_name)s, %(port_index)s, %(mac_address)s, %(status)s, %(vlan_mode)s, %(allowed_vlan)s, %(native_vlan)s, %(access_vlan)s, %(speed)s, %(duplex)s, %(connector)s)
-        """
-        data = {
-            "ap_serial": ap_serial,
-            "port_name": port.get("port_name"),
-            "port_index": port.get("port_index"),
-            "mac_address": port.get("mac_address"),
-            "status": port.get("status"),
-            "vlan_mode": port.get("vlan_mode"),
-            "allowed_vlan": port.get("allowed_vlan"),
-            "native_vlan": port.get("native_vlan"),
-            "access_vlan": port.get("access_vlan"),
-            "speed": port.get("speed"),
-            "duplex": port.get("duplex"),
-            "connector": port.get("connector"),
-        }
-        with self.connection.cursor() as c:
-            c.execute(sql, data)
+        return self.insert_ap_ports_bulk(ap_serial, [port])
+
+    def insert_ap_ports_bulk(self, ap_serial: str, ports: list):
+        return self._upsert_ap_children("port", ap_serial, ports)
+
+    def insert_ap_modem(self, ap_serial: str, modem: dict):
+        self._upsert_ap_children("modem", ap_serial, [_modem_row(modem)])
+
+    def get_recent_clients(self, site_id: str, lookback_days: int = 7) -> list:
+        """Client snapshot rows for a site seen in the last `lookback_days` days, newest first."""
+        return self._recent_rows("clients", site_id, lookback_days)
+
+    def get_recent_device_status(self, site_id: str, lookback_days: int = 7) -> list:
+        """Device status snapshot rows for a site seen in the last `lookback_days` days, newest first."""
+        return self._recent_rows("device_status", site_id, lookback_days)
+
+    def _recent_rows(self, table: str, site_id: str, lookback_days: int) -> list:
+        # A row is ingested no earlier than it was last seen, so the same bound
+        # on created_at is safe and lets MySQL prune the daily partitions
+        if not self.connection:
+            self.connect()
+        with self._read_cursor() as c:
+            c.execute(_RECENT_SQL[table], (site_id, int(lookback_days), int(lookback_days)))
+            rows = c.fetchall()
         self.connection.commit()
+        return list(rows)
 
-    def delete_ap_modems(self, ap_serial: str):
-        sql = "DELETE FROM ap_modem WHERE ap_serial = %s"
-        with self.connection.cursor() as c:
-            c.execute(sql, (ap_serial,))
+    def load_ap_validators(self) -> Dict[str, tuple]:
+        """Return {serial: (detail_etag, detail_last_modified)} for APs with stored validators."""
+        if not self.connection:
+            self.connect()
+        sql = "SELECT serial, detail_etag, detail_last_modified FROM ap WHERE detail_etag IS NOT NULL OR detail_last_modified IS NOT NULL"
+        with self._read_cursor() as c:
+            c.execute(sql)
+            rows = c.fetchall()
         self.connection.commit()
+        return {r["serial"]: (r["detail_etag"], r["detail_last_modified"]) for r in rows}
 
-    def insert_ap_modem(self, ap_serial: str, modem: dict):
-        sql = """
-        INSERT INTO ap_modem (ap_serial, manufacturer, sim_state, status, state, model, imei, imsi, iccid, firmware_version, access_technology, bandwidth, band)
-        VALUES (%(ap_serial)s, %(manufacturer)s, %(sim_state)s, %(status)s, %(state)s, %(model)s, %(imei)s, %(imsi)s, %(iccid)s, %(firmware_version)s, %(access_technology)s, %(bandwidth)s, %(band)s)
+    def load_ap_watermarks(self) -> Dict[str, int]:
+        """Return {serial: list_modified_ms} for APs with a stored list watermark."""
+        if not self.connection:
+            self.connect()
+        sql = "SELECT serial, list_modified_ms FROM ap WHERE list_modified_ms IS NOT NULL"
+        with self._read_cursor() as c:
+            c.execute(sql)
+            rows = c.fetchall()
+        self.connection.commit()
+        return {r["serial"]: r["list_modified_ms"] for r in rows}
+
+    def update_ap_watermarks(self, rows: list):
+        """Store list watermarks given (list_modified_ms, serial) tuples.
+
+        updated_at is pinned so it keeps recording the AP's last details write
+        rather than a watermark-only update.
         """
-        data = {
-            "ap_serial": ap_serial,
-            "manufacturer": modem.get("manufacturer"),
-            "sim_state": modem.get("simState"),
-            "status": modem.get("status"),
-            "state": modem.get("state"),
-            "model": modem.get("model"),
-            "imei": modem.get("imei"),
-            "imsi": modem.get("imsi"),
-            "iccid": modem.get("iccid"),
-            "firmware_version": modem.get("firmwareVersion"),
-            "access_technology": modem.get("accessTechnology"),
-            "bandwidth": modem.get("bandwidth"),
-            "band": modem.get("band"),
-        }
-        with self.connection.cursor() as c:
-            c.execute(sql, data)
-        self.connection.commit()
\ No newline at end of file
+        if not rows:
+            return 0
+        if not self.connection:
+            self.connect()
+        sql = "UPDATE ap SET list_modified_ms = %s, updated_at = updated_at WHERE serial = %s"
+        with self._write_cursor() as c:
+            c.executemany(sql, rows)
+        self._autocommit()
+        return len(rows)
@@ -16,55 +16,49 @@ Design:
 Environment Variables (subset):
     DB_SECRET_ARN, ARUBA_API_SECRET_ARN  Secrets Manager ARNs
     ARUBA_PAGE_SIZE (default 100)
-    ARUBA_PAGE_DELAY_SECONDS (default 2.0)
+    ARUBA_PAGE_DELAY_SECONDS (default 0.25)
     ARUBA_DEVICE_STATUS_ENDPOINT (optional override)
     ARUBA_DEVICE_STATUS_FALLBACK_V1ALPHA1 (default true) attempt list_devices() if v2 404s
     ARUBA_DEVICE_STATUS_USE_V2 (default false). If set true, attempt /network-monitoring/v2/devices/status first.
     DB_CLOSE_EACH_INVOCATION (default true)
+    DEVICE_STATUS_INSERT_BATCH (default 1000) rows buffered per insert while pages stream in
 
 If later the official endpoint or envelope differs, adjust _fetch_device_status_events().
 """
-import os, json, time, logging, base64
+import os, sys, json, time, logging
 from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional
+from bootstrap import get_api, get_db
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-_api = None
-_db = None
-_cached_secrets: Dict[str, Dict[str, Any]] = {}
+# fromisoformat accepts a trailing 'Z' from 3.11 (the Lambda runtime); older interpreters need +00:00
+_FROMISO_ACCEPTS_Z = sys.version_info >= (3, 11)
 
+# Feature flags are fixed for the life of the sandbox; resolve them once
+_USE_V2 = os.getenv("ARUBA_DEVICE_STATUS_USE_V2", "false").lower() == "true"
+_FALLBACK_V1ALPHA1 = os.getenv("ARUBA_DEVICE_STATUS_FALLBACK_V1ALPHA1", "true").lower() == "true"
+_LOG_RAW_SAMPLE = os.getenv("LOG_RAW_DEVICE_STATUS_SAMPLE", "false").lower() == "true"
 
-def _get_secret_cached(arn: str) -> Dict[str, Any]:
-    if arn in _cached_secrets:
-        return _cached_secrets[arn]
-    try:
-        import boto3  # type: ignore
-    except ImportError:
-        boto3 = None  # type: ignore
-    if boto3 is None:  # type: ignore
-        raise RuntimeError("boto3 is required in the Lambda runtime but is not installed locally")
-    sm = boto3.client("secretsmanager")
-    resp = sm.get_secret_value(SecretId=arn)
-    if "SecretString" in resp:
-        js = json.loads(resp["SecretString"])
-    else:
-        js = json.loads(base64.b64decode(resp["SecretBinary"]).decode())
-    _cached_secrets[arn] = js
-    return js
+_api = None
+_db = None
 
 
 def _parse_time(val: Any) -> Optional[datetime]:
     if val in (None, "", 0, "0"):
         return None
+    # Epoch seconds/ms sometimes arrive as digit strings
+    if isinstance(val, str) and val.isdigit():
+        val = int(val)
     try:
         if isinstance(val, (int, float)):
             ts = val / 1000 if val > 1e11 else val
             return datetime.fromtimestamp(ts, tz=timezone.utc)
         if isinstance(val, str):
-            if val.endswith("Z"):
-                return datetime.fromisoformat(val.replace("Z", "+00:00"))
+            if not _FROMISO_ACCEPTS_Z and val.endswith("Z"):
+                val = val[:-1] + "+00:00"
             return datetime.fromisoformat(val)
     except Exception:
         return None
@@ -73,42 +67,22 @@ def _parse_time(val: Any) -> Optional[datetime]:
 
 def _init():
     global _api, _db
-    required = ["DB_SECRET_ARN", "ARUBA_API_SECRET_ARN"]
-    missing = [k for k in required if not os.getenv(k)]
-    if missing:
-        raise RuntimeError(f"Missing env vars {missing}")
-    if _db is None:
-        db_secret = _get_secret_cached(os.environ["DB_SECRET_ARN"])
-        from db import MySqlRepository
-        for key in ("host", "username", "password"):
-            if key not in db_secret:
-                raise RuntimeError(f"DB secret missing '{key}'")
-        _db = MySqlRepository(
-            host=db_secret["host"],
-            port=int(db_secret.get("port", 3306)),
-            user=db_secret["username"],
-            password=db_secret["password"],
-            database=db_secret.get("dbname", "aruba_central"),
-        )
-        _db.connect()
-        _db.ensure_schema()
-        logger.info("[init] DB ready (device_status_v2)")
-    if _api is None:
-        api_secret = _get_secret_cached(os.environ["ARUBA_API_SECRET_ARN"])
-        for key in ("baseUrl", "clientSecret"):
-            if key not in api_secret:
-                raise RuntimeError(f"API secret missing '{key}'")
-        from api_client import ArubaApiClient
-        _api = ArubaApiClient(
-            client_id=api_secret.get("clientId"),
-            client_secret=api_secret["clientSecret"],
-            customer_id=api_secret.get("customerId"),
-            base_url=api_secret["baseUrl"],
-            oauth_token_url=api_secret.get("oauthTokenUrl"),
-            page_limit=int(os.getenv("ARUBA_PAGE_SIZE", "100")),
-            page_delay_seconds=float(os.getenv("ARUBA_PAGE_DELAY_SECONDS", "2.0"))
-        )
-        logger.info("[init] API client ready (device_status_v2)")
+    _db, _api = get_db(), get_api()
+
+
+@lru_cache(maxsize=4096)
+def _naive_utc_cached(val) -> Optional[datetime]:
+    dt = _parse_time(val)
+    if not dt:
+        return None
+    return dt.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _naive_utc(val: Any) -> Optional[datetime]:
+    """_parse_time as naive UTC for MySQL; memoized, as devices in one listing share timestamps."""
+    if isinstance(val, (str, int, float)):
+        return _naive_utc_cached(val)
+    return None
 
 
 def _normalize_event(evt: Dict[str, Any]) -> Dict[str, Any]:
@@ -123,15 +97,6 @@ def _normalize_event(evt: Dict[str, Any]) -> Dict[str, Any]:
         data = {}
     site_id = data.get("siteId") or data.get("site_id")
     site_name = data.get("siteName") or data.get("site_name")
-    last_seen = _parse_time(data.get("lastSeenAt"))
-    config_mod = _parse_time(data.get("configLastModifiedAt"))
-
-    # convert to naive UTC for MySQL DATETIME
-    def _naive(dt: Optional[datetime]):
-        if not dt:
-            return None
-        return dt.astimezone(timezone.utc).replace(tzinfo=None)
-
     rec = {
         "_site_id": site_id,
         "_site_name": site_name,
@@ -151,16 +116,17 @@ def _normalize_event(evt: Dict[str, Any]) -> Dict[str, Any]:
         "persona": data.get("persona"),
         "deviceFunction": data.get("deviceFunction"),
         "uptimeInMillis": data.get("uptimeInMillis"),
-        "lastSeenAt": _naive(last_seen),
-        "configLastModifiedAt": _naive(config_mod),
+        "lastSeenAt": _naive_utc(data.get("lastSeenAt")),
+        "configLastModifiedAt": _naive_utc(data.get("configLastModifiedAt")),
     }
     return rec
 
 
-def _fetch_device_status_events() -> List[Dict[str, Any]]:
+def _fetch_device_status_events() -> Iterator[Dict[str, Any]]:
+    """Yield raw device status events page by page."""
     # Default endpoint now v1alpha1 devices; users can switch to v2 via USE_V2 flag.
     default_endpoint = "/network-monitoring/v1alpha1/devices"
-    use_v2 = os.getenv("ARUBA_DEVICE_STATUS_USE_V2", "false").lower() == "true"
+    use_v2 = _USE_V2
     if use_v2:
         endpoint = os.getenv("ARUBA_DEVICE_STATUS_ENDPOINT", "/network-monitoring/v2/devices/status")
     else:
@@ -169,46 +135,42 @@ def _fetch_device_status_events() -> List[Dict[str, Any]]:
     # If we're not using v2 OR the endpoint clearly references v1alpha1 devices, short-circuit to devices listing.
     if (not use_v2) or "/v1alpha1/devices" in endpoint:
         logger.info(f"[device_status] using devices endpoint endpoint={endpoint} use_v2={use_v2}")
+        count = 0
         try:
-            devices = _api.list_devices()  # type: ignore[attr-defined]
-            logger.info(f"[device_status] devices count={len(devices)}")
-            return devices
+            for d in _api.iter_devices():  # type: ignore[attr-defined]
+                count += 1
+                yield d
         except Exception:
+            # Re-raise so lambda_handler rolls back the rows already inserted
             logger.exception("[device_status] devices listing failed")
-            return []
-    # We call the underlying ArubaApiClient private helpers for simplicity.
-    # Build paginated GETs manually similar to list_clients_single_site.
-    import urllib.request, urllib.parse
-    events: List[Dict[str, Any]] = []
+            raise
+        logger.info(f"[device_status] devices count={count}")
+        return
+    # Page through the client's pooled transport (keep-alive urllib3 / HTTP/2
+    # connections, throttling, retries); only the offset changes per page.
+    import urllib.parse
+    total = 0
     offset = 0
     page_limit = getattr(_api, "page_limit", 100)
     max_pages = getattr(_api, "max_pages_per_call", 60)
+    page_prefix = f"{_api.base_url}{endpoint}?{urllib.parse.urlencode({'limit': page_limit})}&offset="  # type: ignore[attr-defined]
     page = 0
     while True:
         page += 1
-        params = {"limit": page_limit, "offset": offset}
-        qs = urllib.parse.urlencode(params)
-        url = f"{_api.base_url}{endpoint}?{qs}"  # type: ignore[attr-defined]
-        _api._ensure_token()  # type: ignore[attr-defined]
-        req = urllib.request.Request(url, headers=_api._headers())  # type: ignore[attr-defined]
         try:
-            raw = _api._do_request(req)  # type: ignore[attr-defined]
+            js = _api._get_json_url(f"{page_prefix}{offset}")  # type: ignore[attr-defined]
         except Exception as e:
             # If 404 and fallback enabled, try legacy list_devices
-            if "HTTP Error 404" in str(e) and os.getenv("ARUBA_DEVICE_STATUS_FALLBACK_V1ALPHA1", "true").lower() == "true":
+            if getattr(e, "code", None) == 404 and _FALLBACK_V1ALPHA1:
                 logger.warning("[device_status_v2] 404 on v2 endpoint; falling back to v1alpha1 devices list")
                 try:
                     legacy_devices = _api.list_devices()  # type: ignore[attr-defined]
                     logger.info(f"[device_status_v2] fallback list_devices count={len(legacy_devices)}")
-                    return legacy_devices
+                    yield from legacy_devices
+                    return
                 except Exception:
                     logger.exception("[device_status_v2] fallback list_devices failed")
             raise
-        try:
-            js = json.loads(raw.decode())
-        except Exception:
-            logger.warning(f"[device_status_v2] JSON decode failed url={url}")
-            break
         page_items: List[Dict[str, Any]] = []
         if isinstance(js, list):
             page_items = js
@@ -226,33 +188,95 @@ def _fetch_device_status_events() -> List[Dict[str, Any]]:
         logger.info(f"[device_status_v2] page={page} offset={offset} count={cnt}")
         if not cnt:
             break
-        events.extend(page_items)
+        total += cnt
+        yield from page_items
         if cnt < page_limit or page >= max_pages:
             break
         offset += page_limit
-        time.sleep(getattr(_api, "page_delay_seconds", 1.0))  # type: ignore[attr-defined]
-    logger.info(f"[device_status_v2] total_events={len(events)}")
-    return events
+        # Same cap as the client's own paginators; _do_request's throttle does the real pacing
+        time.sleep(min(getattr(_api, "page_delay_seconds", 0.25), 1.0))  # type: ignore[attr-defined]
+    logger.info(f"[device_status_v2] total_events={total}")
 
 
+# Secrets fetch, DB connect and API client setup happen in the Lambda init
+# phase; lambda_handler retries via _init() if this fails.
+if os.getenv("AWS_LAMBDA_FUNCTION_NAME"):
+    try:
+        _init()
+    except Exception as e:
+        logger.warning(f"[init] module-scope init failed, deferring to handler: {e}")
+
 def lambda_handler(event, context):  # noqa: D401
     start = time.time()
     _init()
+    # Reuse the init-phase connection; ping re-establishes it if it was closed or dropped
+    _db.ping()
     close_conn = os.getenv("DB_CLOSE_EACH_INVOCATION", "true").lower() == "true"
+    batch_size = int(os.getenv("DEVICE_STATUS_INSERT_BATCH", "1000"))
     try:
-        raw_events = _fetch_device_status_events()
-        if raw_events and os.getenv("LOG_RAW_DEVICE_STATUS_SAMPLE", "false").lower() == "true":
-            logger.debug("[device_status_v2] sample_raw=%s", json.dumps(raw_events[0])[:800])
-        rows = [_normalize_event(e) for e in raw_events]
-        # Drop rows missing deviceId or macAddress (basic integrity)
-        before = len(rows)
-        rows = [r for r in rows if r.get("deviceId") or r.get("macAddress")]
-        dropped = before - len(rows)
-        inserted = 0
-        if rows:
-            inserted = _db.insert_device_status(rows)  # type: ignore[attr-defined]
+        # Rows are normalized and inserted while later pages are still being
+        # fetched, so only one batch is held in memory; the single transaction
+        # keeps the snapshot all-or-nothing as before.
+        # The transaction is opened at the first flush, so a listing that fits
+        # in one batch is fetched with no transaction open. Larger listings keep
+        # it open (and the RDS Proxy client connection attached to one DB
+        # connection) across the remaining pages. That is one connection for
+        # the length of the listing, once per 30-minute schedule, and staging
+        # every row to shorten it would undo the one-batch memory bound.
+        events = dropped = deduped = inserted = 0
+        # Overlapping pages repeat devices: keep only the newest lastSeenAt per
+        # device.  `latest` spans the whole run; `batch` is keyed so a newer
+        # duplicate replaces its pending row instead of adding another.
+        latest: Dict[str, datetime] = {}
+        batch: Dict[str, Dict[str, Any]] = {}
+        in_txn = False
+
+        def flush():
+            nonlocal in_txn, inserted
+            if not in_txn:
+                _db.begin()
+                in_txn = True
+            inserted += _db.insert_device_status(list(batch.values()))  # type: ignore[attr-defined]
+
+        try:
+            for e in _fetch_device_status_events():
+                if not events and _LOG_RAW_SAMPLE:
+                    logger.debug("[device_status_v2] sample_raw=%s", json.dumps(e)[:800])
+                events += 1
+                row = _normalize_event(e)
+                # Drop rows missing deviceId or macAddress (basic integrity)
+                key = row.get("deviceId") or row.get("macAddress")
+                if not key:
+                    dropped += 1
+                    continue
+                seen_at = row.get("lastSeenAt") or datetime.min
+                prev = latest.get(key)
+                if prev is not None:
+                    if seen_at <= prev:
+                        deduped += 1
+                        continue
+                    # A newer copy of an already-flushed row is a real update.
+                    if key in batch:
+                        deduped += 1
+                latest[key] = seen_at
+                batch[key] = row
+                if len(batch) >= batch_size:
+                    flush()
+                    batch = {}
+            if batch:
+                flush()
+            if in_txn:
+                _db.commit()
+        except Exception:
+            if in_txn:
+                _db.rollback()
+            raise
+        try:
+            _db.rotate_partitions("device_status", int(os.getenv("DB_RETENTION_DAYS", "0")))
+        except Exception as e:
+            logger.warning(f"[device_status_v2] partition rotation failed: {e}")
         dur = round(time.time() - start, 3)
-        summary = {"device_status_events": len(raw_events), "rows_inserted": inserted, "dropped": dropped, "duration_sec": dur}
+        summary = {"device_status_events": events, "rows_inserted": inserted, "dropped": dropped, "deduped": deduped, "duration_sec": dur}
         logger.info(f"[device_status_v2_summary] {json.dumps(summary, separators=(',',':'))}")
         return {"statusCode": 200, "body": json.dumps(summary)}
     except Exception as e:
@@ -1,28 +1,22 @@
-import os, json, time, logging, base64, hashlib, tracemalloc
+import os, sys, json, time, logging, hashlib, resource, tracemalloc
 from datetime import datetime, timezone
+from functools import lru_cache
 from typing import Dict, List, Any
+from bootstrap import get_api, get_db
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# fromisoformat accepts a trailing 'Z' from 3.11 (the Lambda runtime); older interpreters need +00:00
+_FROMISO_ACCEPTS_Z = sys.version_info >= (3, 11)
+
 _api = None
 _db = None
-_cached_secrets: Dict[str, Dict[str, Any]] = {}
-
-def _get_secret_cached(arn: str) -> Dict[str, Any]:
-    if arn in _cached_secrets:
-        return _cached_secrets[arn]
-    import boto3
-    sm = boto3.client("secretsmanager")
-    resp = sm.get_secret_value(SecretId=arn)
-    if "SecretString" in resp:
-        js = json.loads(resp["SecretString"])
-    else:
-        js = json.loads(base64.b64decode(resp["SecretBinary"]).decode())
-    _cached_secrets[arn] = js
-    return js
 
 def _parse_time(val):
+    # Epoch seconds/ms sometimes arrive as digit strings
+    if isinstance(val, str) and val.isdigit():
+        val = int(val)
     if not val:
         return None
     try:
@@ -30,31 +24,45 @@ def _parse_time(val):
             ts = val / 1000 if val > 1e11 else val
             return datetime.fromtimestamp(ts, tz=timezone.utc)
         if isinstance(val, str):
-            if val.endswith("Z"):
-                return datetime.fromisoformat(val.replace("Z", "+00:00"))
+            if not _FROMISO_ACCEPTS_Z and val.endswith("Z"):
+                val = val[:-1] + "+00:00"
             return datetime.fromisoformat(val)
     except Exception:
         return None
     return None
 
+@lru_cache(maxsize=4096)
+def _naive_utc_cached(val):
+    dt = _parse_time(val)
+    if dt:
+        return dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return None
+
+
+def _naive_utc(val):
+    """_parse_time as naive UTC; memoized because one snapshot repeats the same timestamps across clients."""
+    if isinstance(val, (str, int, float)):
+        return _naive_utc_cached(val)
+    return None
+
+
+_LOG_CLIENT_FIELD_GAPS = os.getenv("LOG_CLIENT_FIELD_GAPS", "false").lower() == "true"
+_LOG_RAW_SAMPLE = os.getenv("LOG_RAW_CLIENT_SAMPLE", "false").lower() == "true"
+
+
 def _norm_client(raw: Dict[str, Any]) -> Dict[str, Any]:
     site_id = raw.get("_site_id") or raw.get("siteId") or raw.get("site_id")
     site_name = raw.get("_site_name") or raw.get("siteName") or raw.get("site_name")
     mac = raw.get("mac") or raw.get("macAddress") or raw.get("mac_address")
 
     # lastSeenAt fallback logic
+    connected_since_raw = raw.get("connectedSince") or raw.get("connected_since")
     last_seen_raw = raw.get("lastSeenAt") or raw.get("last_seen") or raw.get("lastSeen")
     if last_seen_raw in (None, "0", 0):
-        last_seen_raw = raw.get("connectedSince") or raw.get("connected_since")
+        last_seen_raw = connected_since_raw
 
-    def _parse_dt(val):
-        dt = _parse_time(val)
-        if dt:
-            return dt.astimezone(timezone.utc).replace(tzinfo=None)
-        return None
-
-    last_seen_dt = _parse_dt(last_seen_raw)
-    connected_since_dt = _parse_dt(raw.get("connectedSince") or raw.get("connected_since"))
+    last_seen_dt = _naive_utc(last_seen_raw)
+    connected_since_dt = _naive_utc(connected_since_raw)
 
     # Build JSON-aligned record
     rec: Dict[str, Any] = {
@@ -84,7 +92,7 @@ def _norm_client(raw: Dict[str, Any]) -> Dict[str, Any]:
     }
 
     # Diagnostics for missing critical fields
-    if os.getenv("LOG_CLIENT_FIELD_GAPS", "false").lower() == "true":
+    if _LOG_CLIENT_FIELD_GAPS:
         if not rec["ipv4"] or not rec["type"]:
             try:
                 logger.debug(
@@ -98,48 +106,26 @@ def _norm_client(raw: Dict[str, Any]) -> Dict[str, Any]:
 
 def _init():
     global _api, _db
-    required = ["DB_SECRET_ARN", "ARUBA_API_SECRET_ARN"]
-    missing = [k for k in required if not os.getenv(k)]
-    if missing:
-        raise RuntimeError(f"Missing env vars {missing}")
-    if _db is None:
-        db_secret = _get_secret_cached(os.environ["DB_SECRET_ARN"])
-        from db import MySqlRepository
-        for key in ("host", "username", "password"):
-            if key not in db_secret:
-                raise RuntimeError(f"DB secret missing '{key}'")
-        _db = MySqlRepository(
-            host=db_secret["host"],
-            port=int(db_secret.get("port", 3306)),
-            user=db_secret["username"],
-            password=db_secret["password"],
-            database=db_secret.get("dbname", "aruba_central"),
-        )
-        _db.connect()
-        _db.ensure_schema()
-        logger.info("[init] DB ready")
-    if _api is None:
-        api_secret = _get_secret_cached(os.environ["ARUBA_API_SECRET_ARN"])
-        for key in ("baseUrl", "clientSecret"):
-            if key not in api_secret:
-                raise RuntimeError(f"API secret missing '{key}'")
-        from api_client import ArubaApiClient
-        _api = ArubaApiClient(
-            client_id=api_secret.get("clientId"),
-            client_secret=api_secret["clientSecret"],
-            customer_id=api_secret.get("customerId"),
-            base_url=api_secret["baseUrl"],
-            oauth_token_url=api_secret.get("oauthTokenUrl"),
-            page_limit=int(os.getenv("ARUBA_PAGE_SIZE", "100")),
-            page_delay_seconds=float(os.getenv("ARUBA_PAGE_DELAY_SECONDS", "2.0"))
-        )
-        logger.info("[init] API client ready")
+    _db, _api = get_db(), get_api()
+
+# Secrets fetch, DB connect and API client setup happen in the Lambda init
+# phase; lambda_handler retries via _init() if this fails.
+if os.getenv("AWS_LAMBDA_FUNCTION_NAME"):
+    try:
+        _init()
+    except Exception as e:
+        logger.warning(f"[init] module-scope init failed, deferring to handler: {e}")
 
 def lambda_handler(event, context):
     logger.info("[lambda_handler] invoked with event=%s", json.dumps(event)[:500])
-    tracemalloc.start()
+    # tracemalloc hooks every allocation; only pay for it when asked to
+    trace = os.getenv("ENABLE_TRACEMALLOC", "false").lower() == "true"
+    if trace:
+        tracemalloc.start()
     start = time.time()
     _init()
+    # Reuse the init-phase connection; ping re-establishes it if it was closed or dropped
+    _db.ping()
 
     site_override = os.getenv("ARUBA_SITE_ID")
     close_conn = os.getenv("DB_CLOSE_EACH_INVOCATION", "true").lower() == "true"
@@ -152,35 +138,54 @@ def lambda_handler(event, context):
         raw_clients = _api.list_all_clients(site_override)
         raw_count = len(raw_clients)
         logger.info(f"[clients] raw_count={raw_count}")
-        if raw_clients and os.getenv("LOG_RAW_CLIENT_SAMPLE", "false").lower() == "true":
+        if raw_clients and _LOG_RAW_SAMPLE and logger.isEnabledFor(logging.DEBUG):
             logger.debug(f"[clients] raw_sample={json.dumps(raw_clients[0], default=str)[:800]}")
-        client_rows = [_norm_client(rc) for rc in raw_clients]
-        missing_mac = sum(1 for c in client_rows if not c["mac"])
-        missing_site = sum(1 for c in client_rows if not c["_site_id"])
-        client_rows = [c for c in client_rows if c["mac"] and c["_site_id"]]
-        # Diagnostics: distinct MACs and time span (using lastSeenAt)
-        try:
-            distinct_macs = len({c["mac"] for c in client_rows})
-            times = [c["lastSeenAt"] for c in client_rows if c.get("lastSeenAt")]
-            earliest = min(times).isoformat() if times else None
-            latest = max(times).isoformat() if times else None
-            logger.info(f"[clients] distinct_mac={distinct_macs} time_range earliest={earliest} latest={latest}")
-        except Exception:
-            pass
+        # Normalize, filter and gather diagnostics (distinct MACs, lastSeenAt span) in one pass
+        client_rows: List[Dict[str, Any]] = []
+        macs = set()
+        missing_mac = missing_site = 0
+        earliest = latest = None
+        for rc in raw_clients:
+            row = _norm_client(rc)
+            if not row["mac"]:
+                missing_mac += 1
+                continue
+            if not row["_site_id"]:
+                missing_site += 1
+                continue
+            client_rows.append(row)
+            macs.add(row["mac"])
+            ls = row["lastSeenAt"]
+            if ls:
+                if earliest is None or ls < earliest:
+                    earliest = ls
+                if latest is None or ls > latest:
+                    latest = ls
+        logger.info(
+            f"[clients] distinct_mac={len(macs)} time_range "
+            f"earliest={earliest.isoformat() if earliest else None} latest={latest.isoformat() if latest else None}"
+        )
         logger.info(f"[clients] normalized={raw_count} dropped_missing_mac={missing_mac} dropped_missing_site={missing_site} retained={len(client_rows)}")
-        if client_rows:
+        if client_rows and logger.isEnabledFor(logging.DEBUG):
             h = hashlib.sha256(client_rows[0]["mac"].encode()).hexdigest()[:10]
             logger.debug(f"[clients] sample_norm_hash={h} sample={client_rows[0]}")
         inserted_clients = _db.insert_clients(client_rows)
         logger.info(f"[clients] inserted={inserted_clients}")
+        try:
+            _db.rotate_partitions("clients", int(os.getenv("DB_RETENTION_DAYS", "0")))
+        except Exception as e:
+            logger.warning(f"[clients] partition rotation failed: {e}")
 
-        peak_mem = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
         duration = round(time.time() - start, 3)
         summary = {
             "clients_inserted": inserted_clients,
             "duration_sec": duration,
-            "peak_mem_mb": round(peak_mem, 2)
         }
+        if trace:
+            summary["peak_mem_mb"] = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 2)
+        else:
+            # Process high-water RSS (KiB on Linux); free to read
+            summary["max_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2)
         logger.info(f"[summary] {json.dumps(summary, separators=(',',':'))}")
         return {"statusCode": 200, "body": json.dumps(summary)}
 
@@ -191,7 +196,8 @@ def lambda_handler(event, context):
         }
         return {"statusCode": 500, "body": json.dumps({"error": str(e), "partial": partial})}
     finally:
-        tracemalloc.stop()
+        if trace:
+            tracemalloc.stop()
         if close_conn and _db:
             try:
                 _db.close()
@@ -0,0 +1,21 @@
+-- Aruba AP child tables: switch from delete+insert to upsert
+-- Adds natural unique keys so ingestion can use INSERT ... ON DUPLICATE KEY UPDATE,
+-- and updated_at recording each row's last write (informational only). Rows the API
+-- no longer reports are deleted by generation_id (006_ap_child_generation.sql).
+-- Run once against existing deployments; new deployments get this via db.ensure_schema().
+
+ALTER TABLE ap_radio
+  ADD COLUMN updated_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP AFTER created_at,
+  ADD UNIQUE KEY uk_ap_radio (ap_serial, radio_index);
+
+ALTER TABLE ap_wlan
+  ADD COLUMN updated_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP AFTER created_at,
+  ADD UNIQUE KEY uk_ap_wlan (ap_serial, bssid);
+
+ALTER TABLE ap_port
+  ADD COLUMN updated_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP AFTER created_at,
+  ADD UNIQUE KEY uk_ap_port (ap_serial, port_index);
+
+ALTER TABLE ap_modem
+  ADD COLUMN updated_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP AFTER created_at,
+  ADD UNIQUE KEY uk_ap_modem (ap_serial);
@@ -0,0 +1,8 @@
+-- Aruba AP detail HTTP validators
+-- Stores the ETag / Last-Modified of the last ingested AP details so the AP Lambda
+-- can send conditional GETs after a cold start and skip unchanged APs (304).
+-- Run once against existing deployments; new deployments get this via db.ensure_schema().
+
+ALTER TABLE ap
+  ADD COLUMN detail_etag VARCHAR(255) DEFAULT NULL AFTER public_ip,
+  ADD COLUMN detail_last_modified VARCHAR(64) DEFAULT NULL AFTER detail_etag;
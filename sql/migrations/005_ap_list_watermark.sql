@@ -0,0 +1,7 @@
+-- Aruba AP list watermark
+-- Stores the AP list item's modification timestamp (epoch ms) from the last
+-- successful ingest so the lister can skip APs that have not changed since.
+-- Run once against existing deployments; new deployments get this via db.ensure_schema().
+
+ALTER TABLE ap
+  ADD COLUMN list_modified_ms BIGINT DEFAULT NULL AFTER detail_last_modified;
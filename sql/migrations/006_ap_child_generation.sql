@@ -0,0 +1,17 @@
+-- Aruba AP child tables: generation-stamped sync
+-- Each AP write stamps its child rows with one generation_id and then deletes
+-- that AP's rows from older generations, so rows the API stopped reporting
+-- are removed with the write instead of by a delete-and-reinsert.
+-- Run once against existing deployments; new deployments get this via db.ensure_schema().
+
+ALTER TABLE ap_radio
+  ADD COLUMN generation_id BIGINT NOT NULL DEFAULT 0 AFTER updated_at;
+
+ALTER TABLE ap_wlan
+  ADD COLUMN generation_id BIGINT NOT NULL DEFAULT 0 AFTER updated_at;
+
+ALTER TABLE ap_port
+  ADD COLUMN generation_id BIGINT NOT NULL DEFAULT 0 AFTER updated_at;
+
+ALTER TABLE ap_modem
+  ADD COLUMN generation_id BIGINT NOT NULL DEFAULT 0 AFTER updated_at;
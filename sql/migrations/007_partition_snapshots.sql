@@ -0,0 +1,22 @@
+-- Daily partitioning for the append-only snapshot tables
+-- created_at becomes NOT NULL and joins the primary key (MySQL requires the
+-- partition column in every unique key); rows then live in a single p_init
+-- partition until rotate_partitions() splits daily partitions off it.
+-- Run once against existing deployments; new deployments get this via db.ensure_schema().
+-- Rebuilds both tables: run in a maintenance window on large installs.
+
+UPDATE clients SET created_at = COALESCE(updated_at, NOW()) WHERE created_at IS NULL;
+ALTER TABLE clients
+  MODIFY created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  DROP PRIMARY KEY,
+  ADD PRIMARY KEY (id, created_at);
+ALTER TABLE clients
+  PARTITION BY RANGE (UNIX_TIMESTAMP(created_at)) (PARTITION p_init VALUES LESS THAN MAXVALUE);
+
+UPDATE device_status SET created_at = COALESCE(updated_at, NOW()) WHERE created_at IS NULL;
+ALTER TABLE device_status
+  MODIFY created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  DROP PRIMARY KEY,
+  ADD PRIMARY KEY (id, created_at);
+ALTER TABLE device_status
+  PARTITION BY RANGE (UNIX_TIMESTAMP(created_at)) (PARTITION p_init VALUES LESS THAN MAXVALUE);
@@ -0,0 +1,20 @@
+-- DATETIME -> TIMESTAMP for the snapshot tables' time columns (5 -> 4 bytes
+-- per column in the row and in every secondary index that carries it).
+-- The ingestion Lambdas already write UTC; TIMESTAMP converts through the
+-- session time_zone, so db.connect() sets it to '+00:00' on every connection.
+-- Run this file (and other clients) with time_zone '+00:00' as well.
+-- TIMESTAMP ends at 2038-01-19 03:14:07 UTC.
+-- Run once against existing deployments; new deployments get this via db.ensure_schema().
+-- Rebuilds the tables: run in a maintenance window on large installs.
+
+ALTER TABLE device_status
+  MODIFY lastSeenAt TIMESTAMP NULL DEFAULT NULL,
+  MODIFY configLastModifiedAt TIMESTAMP NULL DEFAULT NULL;
+
+ALTER TABLE clients
+  MODIFY connectedSince TIMESTAMP NULL DEFAULT NULL,
+  MODIFY lastSeenAt TIMESTAMP NULL DEFAULT NULL;
+
+ALTER TABLE switch_interfacedetails
+  MODIFY created_at TIMESTAMP NULL DEFAULT NULL,
+  MODIFY updated_at TIMESTAMP NULL DEFAULT NULL;
@@ -0,0 +1,42 @@
+-- Latest-state rollups of device_status and clients, keyed by device / (mac, site).
+-- insert_device_status() and insert_clients() upsert them with every snapshot;
+-- the backfill below seeds them from the latest history row per key.
+-- Run once against existing deployments; new deployments get this via db.ensure_schema().
+
+CREATE TABLE IF NOT EXISTS device_status_current (
+    deviceId VARCHAR(64) NOT NULL,
+    _site_id VARCHAR(64) DEFAULT NULL,
+    serialNumber VARCHAR(64) DEFAULT NULL,
+    deviceName VARCHAR(255) DEFAULT NULL,
+    status VARCHAR(32) DEFAULT NULL,
+    lastSeenAt TIMESTAMP NULL DEFAULT NULL,
+    updated_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (deviceId),
+    KEY idx_devcur_site_status (_site_id, status)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+
+CREATE TABLE IF NOT EXISTS clients_current (
+    mac VARCHAR(17) NOT NULL,
+    _site_id VARCHAR(64) NOT NULL,
+    name VARCHAR(255) DEFAULT NULL,
+    status VARCHAR(50) DEFAULT NULL,
+    connectedDeviceSerial VARCHAR(64) DEFAULT NULL,
+    lastSeenAt TIMESTAMP NULL DEFAULT NULL,
+    updated_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (mac, _site_id),
+    KEY idx_clicur_site_status (_site_id, status)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+
+INSERT INTO device_status_current (deviceId, _site_id, serialNumber, deviceName, status, lastSeenAt)
+SELECT deviceId, _site_id, serialNumber, deviceName, status, lastSeenAt FROM (
+  SELECT d.*, ROW_NUMBER() OVER (PARTITION BY deviceId ORDER BY lastSeenAt DESC, created_at DESC) AS rn
+  FROM device_status d WHERE deviceId IS NOT NULL AND deviceId <> ''
+) t WHERE rn = 1
+ON DUPLICATE KEY UPDATE deviceId = deviceId;
+
+INSERT INTO clients_current (mac, _site_id, name, status, connectedDeviceSerial, lastSeenAt)
+SELECT mac, _site_id, name, status, connectedDeviceSerial, lastSeenAt FROM (
+  SELECT c.*, ROW_NUMBER() OVER (PARTITION BY mac, _site_id ORDER BY lastSeenAt DESC, created_at DESC) AS rn
+  FROM clients c WHERE mac <> ''
+) t WHERE rn = 1
+ON DUPLICATE KEY UPDATE mac = mac;
@@ -0,0 +1,15 @@
+-- Site id -> name lookup maintained by every snapshot insert (see MySqlRepository._upsert_sites).
+-- Run once against existing deployments; new deployments get this via db.ensure_schema().
+
+CREATE TABLE IF NOT EXISTS sites (
+    _site_id VARCHAR(128) NOT NULL,
+    name VARCHAR(255) DEFAULT NULL,
+    updated_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (_site_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+
+INSERT INTO sites (_site_id, name)
+SELECT _site_id, MAX(_site_name) FROM device_status
+WHERE _site_id IS NOT NULL AND _site_name IS NOT NULL AND created_at >= NOW() - INTERVAL 7 DAY
+GROUP BY _site_id
+ON DUPLICATE KEY UPDATE name = VALUES(name);
@@ -0,0 +1,9 @@
+-- (_site_id, status, lastSeenAt) for "devices/clients at site X in status S not seen since T".
+-- On device_status it replaces idx_dev_site_status, which is its prefix.
+-- Run once against existing deployments; new deployments get this via db.ensure_schema().
+-- ensure_schema() does not alter existing tables: online DDL on the history tables
+-- would run inside the Lambda init phase, concurrently from every function.
+
+CREATE INDEX idx_dev_site_status_lastSeen ON device_status (_site_id, status, lastSeenAt) ALGORITHM=INPLACE LOCK=NONE;
+DROP INDEX idx_dev_site_status ON device_status ALGORITHM=INPLACE LOCK=NONE;
+CREATE INDEX idx_site_status_lastSeen ON clients (_site_id, status, lastSeenAt) ALGORITHM=INPLACE LOCK=NONE;
@@ -0,0 +1,7 @@
+-- Secondary indexes on switch_interfacedetails for per-site / per-switch interface lookups
+-- and "ports at site X by oper/admin status".
+-- Run once against existing deployments; new deployments get this via db.ensure_schema().
+
+CREATE INDEX idx_sw_site_serial ON switch_interfacedetails (_site_id, switch_serial, name) ALGORITHM=INPLACE LOCK=NONE;
+CREATE INDEX idx_sw_serial_name ON switch_interfacedetails (switch_serial, name) ALGORITHM=INPLACE LOCK=NONE;
+CREATE INDEX idx_sw_site_oper ON switch_interfacedetails (_site_id, operStatus, adminStatus) ALGORITHM=INPLACE LOCK=NONE;
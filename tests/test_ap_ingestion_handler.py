@@ -0,0 +1,61 @@
+import json
+from typing import Any, Dict, List
+import ap_ingestion_lambda_handler as handler
+
+class _Api:
+    def __init__(self, failing=(), empty=()):
+        self.failing = set(failing)
+        self.empty = set(empty)
+    def get_conditional(self, endpoint, params=None, etag=None, last_modified=None):
+        serial = endpoint.rsplit("/", 1)[1]
+        if serial in self.failing:
+            raise RuntimeError("HTTP 503")
+        if serial in self.empty:
+            # What get_conditional returns for a 200 whose body is not JSON
+            return {}, None, None, 200
+        return {"serialNumber": serial, "radios": [], "ports": []}, f"E-{serial}", None, 200
+
+class _Db:
+    def __init__(self):
+        self.stored: List[str] = []
+        self.watermarks: List[Any] = []
+    def upsert_ap_with_children(self, ap_row, radios, wlans, ports, modem):
+        self.stored.append(ap_row[0])
+    def update_ap_watermarks(self, marks):
+        self.watermarks.extend(marks)
+    def load_ap_validators(self):
+        return {}
+    def ping(self):
+        pass
+
+def _records(serials) -> List[Dict[str, Any]]:
+    return [
+        {"messageId": f"m-{s}", "body": json.dumps({"serialNumber": s, "lastModifiedTimestamp": 1700000000000})}
+        for s in serials
+    ]
+
+def _run(monkeypatch, failing=(), empty=()):
+    db = _Db()
+    monkeypatch.setattr(handler, "_api", _Api(failing, empty))
+    monkeypatch.setattr(handler, "_db", db)
+    monkeypatch.setattr(handler, "_init", lambda: None)
+    monkeypatch.setattr(handler, "_ap_validators", {})
+    monkeypatch.setattr(handler, "_ap_validators_loaded", True)
+    result = handler.lambda_handler({"Records": _records(["S1", "S2", "S3"])}, None)
+    return result, db
+
+def test_failed_detail_fetch_is_not_stored_or_watermarked(monkeypatch):
+    result, db = _run(monkeypatch, failing={"S2"})
+
+    assert result == {"batchItemFailures": [{"itemIdentifier": "m-S2"}]}
+    assert "S2" not in db.stored
+    assert sorted(db.stored) == ["S1", "S3"]
+    # Only stored APs get a watermark, so the lister re-enqueues S2 next cycle
+    assert sorted(serial for _, serial in db.watermarks) == ["S1", "S3"]
+
+def test_unparseable_details_are_retried_not_stored(monkeypatch):
+    result, db = _run(monkeypatch, empty={"S3"})
+
+    # Storing {} would sync the AP's radios/WLANs/ports/modem to nothing
+    assert result == {"batchItemFailures": [{"itemIdentifier": "m-S3"}]}
+    assert sorted(db.stored) == ["S1", "S2"]
@@ -1,75 +1,215 @@
-import time
+import io
+import json
+import urllib.error
+import urllib.parse
 from typing import Dict, Any, List
-from lambda_py.api_client import ArubaApiClient
-
-class _Resp:
-    def __init__(self, status_code: int, json_data: Dict[str, Any]):
-        self.status_code = status_code
-        self._json = json_data
-        self.text = str(json_data)
-    def json(self):
-        return self._json
-
-class _Session:
-    def __init__(self):
-        self.calls = []
-    def post(self, url, data=None, timeout=0):
-        # Auth token response
-        return _Resp(200, {"access_token": "TOKEN123", "expires_in": 3600})
-    def request(self, method, url, params=None, json=None, headers=None, timeout=0):
-        self.calls.append((method, url, params))
-        # Simulate pagination: offset 0 => full page; offset >= limit => final partial
-        limit = params.get("limit", 100)
-        offset = params.get("offset", 0)
-        if "sites" in url:
-            if offset == 0:
-                return _Resp(200, {"sites": [{"site_id": "s1", "site_name": "Site1"}]})
-            return _Resp(200, {"sites": []})
-        if "clients" in url:
-            if offset == 0:
-                return _Resp(200, {"clients": [{"mac_address": "AA:BB", "name": "c1"}]})
-            return _Resp(200, {"clients": []})
-        if "devices" in url:
-            if offset == 0:
-                return _Resp(200, {"devices": [{"serial": "SER1", "name": "ap1"}]})
-            return _Resp(200, {"devices": []})
-        return _Resp(200, {})
-
-def test_pagination_and_auth(monkeypatch):
-    client = ArubaApiClient(
-        client_id="cid",
-        client_secret="csec",
-        customer_id="cust",
-        base_url="https://example",
-        page_limit=50
-    )
-    session = _Session()
-    monkeypatch.setattr(client, "_session", session)
-
-    # list_sites
-    sites = client.list_sites()
-    assert len(sites) == 1
-    # list_clients
-    clients = client.list_clients("s1")
-    assert len(clients) == 1
-    # list_devices
-    devices = client.list_devices("s1")
-    assert len(devices) == 1
-
-    # Auth should have happened only once
-    # First call is token POST; subsequent are GET requests
-    # session.calls only records request() calls (not auth post)
-    assert any("sites" in c[1] for c in session.calls)
-    assert any("clients" in c[1] for c in session.calls)
-    assert any("devices" in c[1] for c in session.calls)
-
-def test_list_clients_single_site_sets_filter(monkeypatch):
-    from lambda_py.api_client import ArubaApiClient
-    captured = {}
-    def fake_paged(endpoint, base_params=None, root_keys=None):
-        captured['params'] = base_params
-        return []
-    client = ArubaApiClient(client_id=None, client_secret="tok", customer_id=None, base_url="https://example")
-    client._paged_collect = fake_paged  # type: ignore
-    client.list_clients_single_site("SITE123")
-    assert 'filter' in captured['params']
\ No newline at end of file
+import api_client
+
+class _Transport:
+    """Stand-in for ArubaApiClient._send: token POSTs plus GET responses from `route`.
+
+    `route` is a list of (status, headers, body) replayed in order, or a
+    callable taking the parsed URL and returning one.
+    """
+    def __init__(self, route=()):
+        self.route = route if callable(route) else list(route)
+        self.gets: List[Dict[str, str]] = []
+        self.urls: List[str] = []
+        self.token_posts = 0
+    def __call__(self, req):
+        if req.get_method() == "POST":
+            self.token_posts += 1
+            body = json.dumps({"access_token": f"T{self.token_posts}", "expires_in": 3600}).encode()
+            return 200, {}, body
+        self.gets.append(dict(req.header_items()))
+        self.urls.append(req.full_url)
+        if callable(self.route):
+            status, headers, body = self.route(urllib.parse.urlsplit(req.full_url))
+        else:
+            status, headers, body = self.route.pop(0)
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        if status >= 300:
+            raise urllib.error.HTTPError(req.full_url, status, "", headers, io.BytesIO(body))
+        return status, headers, body
+
+def _client(monkeypatch, tmp_path, route=()):
+    monkeypatch.setenv("ARUBA_MIN_REQUEST_INTERVAL_SEC", "0")
+    monkeypatch.setattr(api_client, "_TOKEN_CACHE_PATH", str(tmp_path / "token.json"))
+    # Page delays and backoff sleeps are not under test here
+    monkeypatch.setattr(api_client.time, "sleep", lambda s: None)
+    client = api_client.ArubaApiClient(client_id="cid", client_secret="csec", customer_id="cust",
+                                       base_url="https://example", oauth_token_url="https://example/oauth2/token",
+                                       page_limit=50)
+    transport = _Transport(route)
+    monkeypatch.setattr(client, "_send", transport)
+    return client, transport
+
+def _query(url) -> Dict[str, str]:
+    return dict(urllib.parse.parse_qsl(url.query))
+
+def test_pagination_and_auth(monkeypatch, tmp_path):
+    def route(url):
+        q = _query(url)
+        if url.path.endswith("/sites-health"):
+            return 200, {}, {"items": [{"id": "s1", "name": "Site1"}]}
+        if url.path.endswith("/clients"):
+            return 200, {}, {"items": [{"mac": "AA:BB", "name": "c1"}]}
+        if url.path.endswith("/devices"):
+            if "next" not in q:
+                return 200, {}, {"devices": [{"serialNumber": "SER1"}], "next": "c2"}
+            # Overlapping cursor page: SER1 is repeated
+            return 200, {}, {"devices": [{"serialNumber": "SER1"}, {"serialNumber": "SER2"}]}
+        return 200, {}, {}
+    client, transport = _client(monkeypatch, tmp_path, route)
+    client.get("/network-monitoring/v1alpha1/sites-health")
+
+    assert client.list_sites() == [{"id": "s1", "name": "Site1"}]
+    clients = client.list_clients_single_site("s1")
+    assert clients == [{"mac": "AA:BB", "name": "c1", "_site_id": "s1"}]
+    assert [d["serialNumber"] for d in client.list_devices()] == ["SER1", "SER2"]
+
+    # One token POST; every GET carries it and the customer id
+    assert transport.token_posts == 1
+    assert all(h["Authorization"] == "Bearer T1" and h["X-customer-id"] == "cust" for h in transport.gets)
+    first_devices = next(u for u in transport.urls if "/devices" in u)
+    assert _query(urllib.parse.urlsplit(first_devices))["limit"] == "50"
+
+def test_token_reused_across_clients(monkeypatch, tmp_path):
+    client, transport = _client(monkeypatch, tmp_path, [(200, {}, {})] * 2)
+    client.get("/a")
+    client.get("/b")
+    assert transport.token_posts == 1
+
+    # A new instance (e.g. the next cold start in this sandbox) adopts the cached token
+    other, other_transport = _client(monkeypatch, tmp_path, [(200, {}, {})])
+    other.get("/a")
+    assert other_transport.token_posts == 0
+    assert other_transport.gets[0]["Authorization"] == "Bearer T1"
+
+def test_get_conditional_not_modified(monkeypatch, tmp_path):
+    client, transport = _client(monkeypatch, tmp_path, [(304, {}, b"")])
+    js, etag, last_modified, status = client.get_conditional("/aps/S1", etag="E1", last_modified="LM1")
+
+    assert (js, etag, last_modified, status) == (None, "E1", "LM1", 304)
+    assert transport.gets[0]["If-none-match"] == "E1"
+    assert transport.gets[0]["If-modified-since"] == "LM1"
+    # The shared header dict is not modified by the conditional request
+    assert "If-None-Match" not in client._headers()
+
+def test_get_conditional_returns_new_validators(monkeypatch, tmp_path):
+    client, _ = _client(monkeypatch, tmp_path, [(200, {"ETag": "E2", "Last-Modified": "LM2"}, {"serialNumber": "S1"})])
+    assert client.get_conditional("/aps/S1", etag="E1") == ({"serialNumber": "S1"}, "E2", "LM2", 200)
+
+def test_reauth_after_401_keeps_conditional_headers(monkeypatch, tmp_path):
+    client, transport = _client(monkeypatch, tmp_path, [
+        (401, {}, b'{"message": "Invalid access token"}'),
+        (304, {}, b""),
+    ])
+    js, etag, _, status = client.get_conditional("/aps/S1", etag="E1")
+
+    assert (js, etag, status) == (None, "E1", 304)
+    first, retry = transport.gets
+    assert first["Authorization"] == "Bearer T1"
+    assert retry["Authorization"] == "Bearer T2"
+    assert retry["If-none-match"] == "E1"
+
+def test_reauth_skipped_when_token_already_replaced(monkeypatch, tmp_path):
+    client, transport = _client(monkeypatch, tmp_path)
+    client._ensure_token()
+
+    def route(url):
+        if len(transport.gets) == 1:
+            # Another worker refreshes the token while this request is being rejected
+            client._access_token = "T9"
+            return 401, {}, b'{"message": "Invalid access token"}'
+        return 200, {}, {}
+    transport.route = route
+    client.get("/a")
+
+    assert transport.token_posts == 1
+    assert transport.gets[1]["Authorization"] == "Bearer T9"
+
+def test_clients_variant_is_cached(monkeypatch, tmp_path):
+    def route(url):
+        q = _query(url)
+        if "siteId" in q:
+            return 200, {}, {"items": [{"mac": f"m-{q['siteId']}"}]}
+        # The site-id spelling is ignored by this (simulated) API version
+        return 200, {}, {"items": []}
+    client, transport = _client(monkeypatch, tmp_path, route)
+
+    assert client.list_clients_single_site("s1") == [{"mac": "m-s1", "_site_id": "s1"}]
+    assert client._clients_variant == "siteId"
+    probes = len(transport.urls)
+    assert client.list_clients_single_site("s2") == [{"mac": "m-s2", "_site_id": "s2"}]
+    # Later sites go straight to the variant that worked
+    assert len(transport.urls) == probes + 1
+    assert "siteId=s2" in transport.urls[-1]
+
+def test_clients_total_zero_skips_other_variants(monkeypatch, tmp_path):
+    client, transport = _client(monkeypatch, tmp_path, [(200, {}, {"items": [], "total": 0})])
+    assert client.list_clients_single_site("empty") == []
+    assert len(transport.urls) == 1
+    assert client._clients_variant is None
+
+def test_empty_page_without_total_probes_next_variant(monkeypatch, tmp_path):
+    client, transport = _client(monkeypatch, tmp_path, [(200, {}, {"items": []}), (200, {}, {"items": []})])
+    assert client.list_clients_single_site("s1") == []
+    assert len(transport.urls) == 2
+
+def test_aimd_backoff_and_recovery(monkeypatch, tmp_path):
+    monkeypatch.setenv("ARUBA_AIMD_WINDOW", "3")
+    client, _ = _client(monkeypatch, tmp_path)
+    client.min_interval = 1.0
+
+    client._record_outcome(0.2, ok=False)
+    assert client.min_interval == 1.5
+    # No decrease while the failure is still in the window
+    client._record_outcome(0.2, ok=True)
+    client._record_outcome(0.2, ok=True)
+    assert client.min_interval == 1.5
+    client._record_outcome(0.2, ok=True)
+    assert client.min_interval == 1.45
+    # Slow responses hold the interval even without errors
+    for _ in range(3):
+        client._record_outcome(5.0, ok=True)
+    assert client.min_interval == 1.45
+
+def test_429_widens_interval(monkeypatch, tmp_path):
+    client, transport = _client(monkeypatch, tmp_path, [(429, {"Retry-After": "0"}, b""), (200, {}, {"ok": 1})])
+    client.min_interval = 1.0
+    assert client.get("/a") == {"ok": 1}
+    assert len(transport.gets) == 2
+    assert client.min_interval == 1.5
+
+def test_rate_headers_shrink_and_restore_rpm_cap(monkeypatch, tmp_path):
+    monkeypatch.setenv("ARUBA_MAX_RPM", "100")
+    monkeypatch.setenv("ARUBA_MIN_RPM", "30")
+    client, _ = _client(monkeypatch, tmp_path)
+
+    client._observe_rate_headers({"X-RateLimit-Remaining": "5", "X-RateLimit-Limit": "100"})
+    assert client._rpm_cap == 50
+    client._observe_rate_headers({"X-RateLimit-Remaining-minute": "1", "X-RateLimit-Limit-minute": "100"})
+    assert client._rpm_cap == 30
+    # Between the thresholds the cap holds; above half the quota it is restored
+    client._observe_rate_headers({"X-RateLimit-Remaining": "30", "X-RateLimit-Limit": "100"})
+    assert client._rpm_cap == 30
+    client._observe_rate_headers({"X-RateLimit-Remaining": "60", "X-RateLimit-Limit": "100"})
+    assert client._rpm_cap == 100
+
+def test_throttle_waits_for_window_when_rpm_cap_reached(monkeypatch, tmp_path):
+    client, _ = _client(monkeypatch, tmp_path)
+    now = [1000.0]
+    slept = []
+    monkeypatch.setattr(api_client.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(api_client.time, "sleep", slept.append)
+    client.min_interval = 0.5
+    client._rpm_cap = 2
+
+    client._throttle()
+    client._throttle()
+    assert slept == [0.5]
+    # Third request in the window waits until the first slot is 60s old
+    client._throttle()
+    assert slept == [0.5, 60.0]
@@ -1,31 +1,56 @@
-import types
-from typing import List, Any
-from lambda_py.db import MySqlRepository, ClientRecord, DeviceRecord
+import os
+import pytest
+from collections import Counter, deque
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Any
+import db
+from db import MySqlRepository, CLIENT_COLUMNS, DEVICE_STATUS_COLUMNS, _flat_params
+
+class _Calls(deque):
+    """Append-only call log that tallies call kinds as they are recorded."""
+    __slots__ = ("kinds",)
+    def __init__(self):
+        super().__init__()
+        self.kinds = Counter()
+    def append(self, call):
+        self.kinds[call[0]] += 1
+        super().append(call)
 
 class _Cursor:
+    __slots__ = ("recorder",)
     def __init__(self, recorder):
         self.recorder = recorder
     def execute(self, sql, params=None):
-        self.recorder.append(("execute", sql.strip(), params))
+        self.recorder.append(("execute", sql, params))
     def executemany(self, sql, seq):
-        collected = list(seq)
-        self.recorder.append(("executemany", sql.strip(), collected))
+        # Only the row count is asserted on; don't keep the rows
+        self.recorder.append(("executemany", sql, sum(1 for _ in seq)))
     def __enter__(self):
         return self
     def __exit__(self, exc_type, exc, tb):
         return False
 
 class _Conn:
+    __slots__ = ("recorder",)
     def __init__(self, recorder):
         self.recorder = recorder
-    def cursor(self):
+    def cursor(self, *args):
+        self.recorder.append(("cursor", None, None))
         return _Cursor(self.recorder)
+    def begin(self):
+        self.recorder.append(("begin", None, None))
+    def commit(self):
+        self.recorder.append(("commit", None, None))
+    def rollback(self):
+        self.recorder.append(("rollback", None, None))
     def close(self):
         self.recorder.append(("close", None, None))
+    def ping(self, reconnect=True, /):
+        # Positional-only like mysqlclient's Connection.ping
+        self.recorder.append(("ping", None, None))
 
-def test_upsert_clients_and_devices(monkeypatch):
-    calls: List[Any] = []
-
+def _repo(calls):
     repo = MySqlRepository(
         host="test",
         port=3306,
@@ -33,46 +58,248 @@ def test_upsert_clients_and_devices(monkeypatch):
         password="p",
         database="d"
     )
+    # Stand-in connection; the repository only needs cursor() and commit()
+    repo.connection = _Conn(calls)
+    return repo
+
+def _inserts(calls, table):
+    return [c for c in calls if c[0] == "execute" and c[1].startswith(f"INSERT INTO {table} (")]
 
-    # Monkeypatch internal connection handling
-    conn = _Conn(calls)
-    repo._conn = conn  # type: ignore[attr-defined]
+def test_insert_clients_and_device_status(monkeypatch):
+    monkeypatch.setenv("ARUBA_DB_INSERT_BATCH_SIZE", "1")
+    calls = _Calls()
+    repo = _repo(calls)
 
-    clients: List[ClientRecord] = [
+    seen = datetime(2023, 11, 14, 22, 13, 20)
+    clients = [
         {
-            "mac_address": "AA:BB:CC:DD:EE:FF",
-            "site_id": "site1",
-            "client_name": "cl1",
-            "ip_address": "10.0.0.1",
-            "device_type": "laptop",
-            "status": "Up",
-            "associated_device": "ap1",
-            "signal_strength": 42,
-            "last_seen": "1700000000"  # epoch string
-        }
+            "mac": "aa:bb:cc:dd:ee:ff",
+            "_site_id": "site1",
+            "_site_name": "Site 1",
+            "name": "cl1",
+            "status": "Connected",
+            "ipv4": "10.0.0.1",
+            "connectedDeviceSerial": "SER123",
+            "lastSeenAt": seen,
+        },
+        {
+            "mac": "aa:bb:cc:dd:ee:00",
+            "_site_id": "site1",
+            "_site_name": "Site 1",
+            "lastSeenAt": seen,
+        },
     ]
-
-    devices: List[DeviceRecord] = [
+    devices = [
         {
-            "serial_number": "SER123",
-            "site_id": "site1",
-            "mac_address": "11:22:33:44:55:66",
-            "device_name": "ap1",
+            "deviceId": "dev1",
+            "_site_id": "site1",
+            "_site_name": "Site 1",
+            "serialNumber": "SER123",
+            "macAddress": "11:22:33:44:55:66",
+            "deviceName": "ap1",
             "model": "AP-515",
-            "device_type": "ap",
-            "firmware_version": "8.10",
-            "ip_address": "10.0.0.10",
-            "status": "Up"
+            "status": "Up",
+            "lastSeenAt": seen,
         }
     ]
 
-    repo.upsert_clients(clients, batch_size=1)
-    repo.upsert_devices(devices, batch_size=1)
+    assert repo.insert_clients(clients) == 2
+    assert repo.insert_device_status(devices) == 1
+
+    # One multi-row INSERT per chunk; batch size 1 gives one statement per row
+    client_inserts = _inserts(calls, "clients")
+    assert len(client_inserts) == 2
+    assert all(len(c[2]) == len(CLIENT_COLUMNS) for c in client_inserts)
+    # Columns missing from a row are bound as NULL
+    assert client_inserts[1][2][CLIENT_COLUMNS.index("name")] is None
+    device_inserts = _inserts(calls, "device_status")
+    assert len(device_inserts) == 1
+    assert device_inserts[0][2][DEVICE_STATUS_COLUMNS.index("lastSeenAt")] == seen
+    kinds = calls.kinds
+    assert kinds["executemany"] == 0
+    # One commit per insert_* call, not per chunk
+    assert kinds["commit"] == 2
+
+def test_insert_clients_single_statement_per_chunk():
+    calls = _Calls()
+    repo = _repo(calls)
+    rows = [{"mac": f"aa:bb:cc:dd:ee:{i:02x}", "_site_id": "site1", "_site_name": "Site 1"} for i in range(3)]
+
+    assert repo.insert_clients(rows) == 3
+
+    (sql, params), = [(c[1], c[2]) for c in _inserts(calls, "clients")]
+    assert sql.count("),(") == len(rows) - 1
+    assert len(params) == len(rows) * len(CLIENT_COLUMNS)
+
+def test_equal_sized_chunks_reuse_sql(monkeypatch):
+    monkeypatch.setenv("ARUBA_DB_INSERT_BATCH_SIZE", "2")
+    calls = _Calls()
+    repo = _repo(calls)
+    rows = [{"mac": f"aa:bb:cc:dd:ee:{i:02x}", "_site_id": "site1", "_site_name": "Site 1"} for i in range(5)]
+
+    assert repo.insert_clients(rows) == 5
+
+    full1, full2, last = [c[1] for c in _inserts(calls, "clients")]
+    # The statement text is built once per chunk size, not once per chunk
+    assert full1 is full2
+    assert last.count("),(") == 0
+
+def test_flat_params_column_order():
+    cols = ("mac", "_site_id", "lastSeenAt")
+    full = [{"lastSeenAt": "1700000000", "mac": "m1", "_site_id": "s1", "extra": 1},
+            {"_site_id": "s2", "mac": "m2", "lastSeenAt": None}]
+    assert _flat_params(full, cols) == ["m1", "s1", "1700000000", "m2", "s2", None]
+    # A row missing a column takes the dict.get fallback for the whole batch
+    partial = full + [{"mac": "m3"}]
+    assert _flat_params(partial, cols)[-3:] == ["m3", None, None]
+    assert _flat_params(partial, cols)[:6] == _flat_params(full, cols)
+
+def _connect_with_fake_drivers(monkeypatch, driver_env=None, kwargs=None):
+    used = []
+    def fake(name):
+        def connect(**kw):
+            used.append(name)
+            if kwargs is not None:
+                kwargs.update(kw)
+            return _Conn(_Calls())
+        return connect
+    monkeypatch.setattr(db, "MySQLdb", SimpleNamespace(connect=fake("MySQLdb")))
+    monkeypatch.setattr(db.pymysql, "connect", fake("pymysql"))
+    if driver_env:
+        monkeypatch.setenv("DB_DRIVER", driver_env)
+    repo = MySqlRepository(host="driver-test", port=3306, user="u", password="p", database="d")
+    repo.connect()
+    repo.close(discard=True)
+    return used
+
+def test_connect_prefers_mysqlclient(monkeypatch):
+    assert _connect_with_fake_drivers(monkeypatch) == ["MySQLdb"]
+
+def test_connect_pymysql_opt_out(monkeypatch):
+    assert _connect_with_fake_drivers(monkeypatch, "pymysql") == ["pymysql"]
+
+def test_connect_pins_session_time_zone_to_utc(monkeypatch):
+    for driver in ("auto", "pymysql"):
+        kw = {}
+        _connect_with_fake_drivers(monkeypatch, driver, kw)
+        assert kw["init_command"] == "SET time_zone = '+00:00'"
+
+def test_insert_rolls_back_on_failure(monkeypatch):
+    monkeypatch.setenv("ARUBA_DB_INSERT_BATCH_SIZE", "1")
+    calls = _Calls()
+    repo = _repo(calls)
+
+    def fail_second_insert(sql, params=None):
+        calls.append(("execute", sql, params))
+        if len(_inserts(calls, "clients")) == 2:
+            raise RuntimeError("boom")
+    monkeypatch.setattr(_Cursor, "execute", lambda self, sql, params=None: fail_second_insert(sql, params))
+
+    rows = [{"mac": f"aa:bb:cc:dd:ee:{i:02x}", "_site_id": "site1", "_site_name": "Site 1"} for i in range(3)]
+    with pytest.raises(RuntimeError):
+        repo.insert_clients(rows)
+    kinds = calls.kinds
+    # The chunk already sent is undone with the rest; nothing was committed
+    assert kinds["commit"] == 0
+    assert kinds["rollback"] == 1
+
+def test_insert_inside_caller_transaction_defers_commit():
+    calls = _Calls()
+    repo = _repo(calls)
+    repo.begin()
+    repo.insert_clients([{"mac": "aa:bb:cc:dd:ee:ff", "_site_id": "site1", "_site_name": "Site 1"}])
+    assert calls.kinds["commit"] == 0
+    repo.commit()
+    assert calls.kinds["commit"] == 1
+
+def test_closed_connection_is_reused(monkeypatch):
+    opened = []
+    monkeypatch.setattr(db, "MySQLdb", None)
+    monkeypatch.setattr(db.pymysql, "connect", lambda **kw: opened.append(_Conn(_Calls())) or opened[-1])
+
+    first = MySqlRepository(host="reuse-test", port=3306, user="u", password="p", database="d")
+    first.connect()
+    first.close()
+    # A later repository for the same target takes the parked connection after a ping
+    second = MySqlRepository(host="reuse-test", port=3306, user="u", password="p", database="d")
+    second.connect()
+    assert len(opened) == 1
+    assert second.connection is opened[0]
+    assert ("ping", None, None) in opened[0].recorder
+    second.close(discard=True)
+
+def test_ping_keeps_live_connection():
+    calls = _Calls()
+    repo = _repo(calls)
+    conn = repo.connection
+    repo.ping()
+    assert repo.connection is conn
+    assert calls.kinds["ping"] == 1
+    assert calls.kinds["close"] == 0
+
+def test_large_batch_uses_load_data(monkeypatch):
+    monkeypatch.setenv("ARUBA_DB_LOAD_DATA_MIN_ROWS", "3")
+    calls = _Calls()
+    repo = _repo(calls)
+    loaded = []
+
+    def execute(self, sql, params=None):
+        if sql.startswith("LOAD DATA"):
+            # The TSV is removed after the statement; read it while it exists
+            with open(params[0], encoding="utf-8") as f:
+                loaded.append(f.read())
+        calls.append(("execute", sql, params))
+    monkeypatch.setattr(_Cursor, "execute", execute)
+
+    rows = [{"mac": f"aa:bb:cc:dd:ee:{i:02x}", "_site_id": "site1", "_site_name": "Site 1", "name": "a\tb"}
+            for i in range(3)]
+    assert repo.insert_clients(rows) == 3
+
+    assert not _inserts(calls, "clients")
+    load_params, = [c[2] for c in calls if c[0] == "execute" and c[1].startswith("LOAD DATA")]
+    assert [c[1].split(" (")[0] for c in calls if c[0] == "execute" and c[1].startswith("LOAD DATA")] == [
+        "LOAD DATA LOCAL INFILE %s INTO TABLE clients CHARACTER SET utf8mb4 "
+        "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n'"
+    ]
+    first = loaded[0].split("\n")[0].split("\t")
+    assert len(first) == len(CLIENT_COLUMNS)
+    assert first[CLIENT_COLUMNS.index("name")] == "a\\tb"
+    assert first[CLIENT_COLUMNS.index("lastSeenAt")] == "\\N"
+    # The rollup upsert still runs
+    assert _inserts(calls, "clients_current")
+    assert not os.path.exists(load_params[0])
+
+def test_small_batch_skips_load_data(monkeypatch):
+    monkeypatch.setenv("ARUBA_DB_LOAD_DATA_MIN_ROWS", "3")
+    calls = _Calls()
+    repo = _repo(calls)
+    repo.insert_clients([{"mac": "aa:bb:cc:dd:ee:ff", "_site_id": "site1", "_site_name": "Site 1"}])
+    assert len(_inserts(calls, "clients")) == 1
+    assert not [c for c in calls if c[0] == "execute" and c[1].startswith("LOAD DATA")]
+
+def test_empty_batch_is_a_no_op():
+    calls = _Calls()
+    repo = _repo(calls)
+    assert repo.insert_clients([]) == 0
+    assert repo.insert_device_status([]) == 0
+    assert not calls
+
+def test_skip_unchanged_filters_against_rollup(monkeypatch):
+    monkeypatch.setenv("ARUBA_DB_SKIP_UNCHANGED", "1")
+    calls = _Calls()
+    repo = _repo(calls)
+    repo.insert_device_status([{"deviceId": "dev1", "_site_id": "site1", "_site_name": "Site 1", "status": "Up"}])
+    history = [c[1] for c in calls if c[0] == "execute" and c[1].startswith("INSERT INTO device_status (")]
+    # Unchanged rows are dropped by the statement itself, against device_status_current
+    assert len(history) == 1
+    assert "NOT EXISTS (SELECT 1 FROM device_status_current" in history[0]
 
-    # Expect two executemany calls
-    executemany_calls = [c for c in calls if c[0] == "executemany"]
-    assert len(executemany_calls) == 2
-    # Verify first batch row count
-    assert len(executemany_calls[0][2]) == 1
-    # Verify second batch row count
-    assert len(executemany_calls[1][2]) == 1
\ No newline at end of file
+def test_one_cursor_per_insert_call(monkeypatch):
+    monkeypatch.setenv("ARUBA_DB_INSERT_BATCH_SIZE", "1")
+    calls = _Calls()
+    repo = _repo(calls)
+    rows = [{"mac": f"aa:bb:cc:dd:ee:{i:02x}", "_site_id": "site1", "_site_name": "Site 1"} for i in range(3)]
+    repo.insert_clients(rows)
+    # Every chunk, rollup and sites statement shares the call's cursor
+    assert calls.kinds["cursor"] == 1
+    assert calls.kinds["execute"] == 7
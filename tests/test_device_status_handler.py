@@ -0,0 +1,56 @@
+import device_status_v2_ingestion_handler as handler
+
+class _Api:
+    def __init__(self, db, fail=True):
+        self.db = db
+        self.fail = fail
+    def iter_devices(self):
+        for i in range(3):
+            yield {"id": f"d{i}", "status": "Up", "lastSeenAt": "2026-10-15T00:00:00Z"}
+        if self.fail:
+            raise RuntimeError("HTTP 503 after retries")
+        self.db.calls.append("listed")
+
+class _Db:
+    def __init__(self):
+        self.calls = []
+    def ping(self):
+        pass
+    def begin(self):
+        self.calls.append("begin")
+    def commit(self):
+        self.calls.append("commit")
+    def rollback(self):
+        self.calls.append("rollback")
+    def insert_device_status(self, rows):
+        self.calls.append("insert")
+        return len(rows)
+    def close(self):
+        pass
+    def rotate_partitions(self, table, retention_days):
+        pass
+
+def _run(monkeypatch, batch, fail=True):
+    db = _Db()
+    monkeypatch.setattr(handler, "_api", _Api(db, fail))
+    monkeypatch.setattr(handler, "_db", db)
+    monkeypatch.setattr(handler, "_init", lambda: None)
+    monkeypatch.setattr(handler, "_USE_V2", False)
+    monkeypatch.setenv("DEVICE_STATUS_INSERT_BATCH", str(batch))
+    return handler.lambda_handler({}, None), db
+
+def test_listing_failure_rolls_back_the_snapshot(monkeypatch):
+    result, db = _run(monkeypatch, batch=2)
+
+    assert result["statusCode"] == 500
+    # A batch was already sent when the listing failed; it must not be committed
+    assert "insert" in db.calls
+    assert "commit" not in db.calls
+    assert db.calls[-1] == "rollback"
+
+def test_single_batch_listing_is_fetched_before_the_transaction(monkeypatch):
+    result, db = _run(monkeypatch, batch=10, fail=False)
+
+    assert result["statusCode"] == 200
+    assert db.calls == ["listed", "begin", "insert", "commit"]
+